@@ -0,0 +1,151 @@
+"""Benchmark the standard and the fast response path of the analytics API
+
+Usage:
+    python benchmark_responses.py --requests 2000 --rows 50
+
+Every path serves the same in-memory result, as a response cache hit would,
+through an in-process ASGI client, so only response validation, encoding
+and compression are measured (no database, no network).
+"""
+import asyncio
+import os
+import random
+import time
+from typing import List
+
+import httpx
+import typer
+from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
+
+# server.py reads its settings at import; nothing connects until a query runs
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'streaming_analytics')
+
+from fast_response import FastJSON
+from server import (
+    DashboardMetrics, DashboardSnapshot, DeviceAnalytics, GenreAnalytics, GeographicData, HourlyTrend, TopMovie
+)
+
+COUNTRIES = ['USA', 'UK', 'Canada', 'Germany', 'France', 'India', 'Brazil', 'Japan', 'Australia', 'Spain']
+DEVICES = ['Smart TV', 'Mobile', 'Desktop', 'Tablet', 'Gaming Console']
+GENRES = ['Action', 'Comedy', 'Drama', 'Horror', 'Sci-Fi', 'Romance', 'Thriller', 'Documentary', 'Animation', 'Crime']
+
+
+def sample_payloads(rows: int, seed: int = 42) -> dict:
+    """Aggregation-shaped results: (response model, list item model or None, value)"""
+    rng = random.Random(seed)
+
+    def rate():
+        return round(rng.uniform(0.3, 0.9), 2)
+
+    top_movies = [
+        {'title': f"Movie {i}", 'genre': rng.choice(GENRES), 'total_views': rng.randint(100, 5000),
+         'avg_completion_rate': rate(), 'avg_rating': round(rng.uniform(1, 5), 1)}
+        for i in range(rows)
+    ]
+    genres = [
+        {'genre': genre, 'total_views': rng.randint(1000, 50000), 'avg_watch_time': round(rng.uniform(20, 120), 2),
+         'unique_users': rng.randint(100, 5000), 'unique_users_approximate': False}
+        for genre in GENRES
+    ]
+    devices = [{'device_type': device, 'session_count': rng.randint(1000, 50000), 'avg_completion_rate': rate()} for device in DEVICES]
+    geographic = [
+        {'country': country, 'total_views': rng.randint(1000, 50000), 'unique_users': rng.randint(100, 5000),
+         'avg_completion_rate': rate(), 'unique_users_approximate': True}
+        for country in COUNTRIES
+    ]
+    hourly = [{'hour': hour, 'view_count': rng.randint(100, 5000), 'avg_completion_rate': rate()} for hour in range(24)]
+    daily = [
+        {'date': f"2026-{1 + day // 28:02d}-{1 + day % 28:02d}", 'total_views': rng.randint(500, 3000),
+         'total_watch_time': rng.randint(10000, 90000), 'avg_completion_rate': rate(), 'unique_users': rng.randint(100, 900)}
+        for day in range(max(rows, 30))
+    ]
+    metrics = DashboardMetrics(
+        total_users=5000, active_users=4100, total_movies=200, total_views=50000,
+        total_watch_time_hours=61234.5, avg_completion_rate=0.58, premium_subscribers=1600
+    )
+    snapshot = DashboardSnapshot(
+        metrics=metrics, top_movies=top_movies[:10], genres=genres, devices=devices,
+        geographic=geographic, hourly_trends=hourly, daily_trends=daily[:30]
+    )
+    return {
+        'top-movies': (List[TopMovie], TopMovie, top_movies),
+        'genres': (List[GenreAnalytics], GenreAnalytics, genres),
+        'devices': (List[DeviceAnalytics], DeviceAnalytics, devices),
+        'geographic': (List[GeographicData], GeographicData, geographic),
+        'hourly-trends': (List[HourlyTrend], HourlyTrend, hourly),
+        'daily-trends': (None, None, daily),
+        'snapshot': (DashboardSnapshot, None, snapshot)
+    }
+
+
+def build_apps(payloads: dict, min_size: int) -> dict:
+    """One app per path, each with a GET /<panel> route returning the prepared value"""
+    standard = FastAPI()
+    compressed = FastAPI()
+    compressed.add_middleware(GZipMiddleware, minimum_size=min_size)
+    fast = FastAPI()
+    fast_json = FastJSON(enabled=True, min_size=min_size)
+
+    def returning(value):
+        async def endpoint():
+            return value
+        return endpoint
+
+    for name, (response_model, item_model, value) in payloads.items():
+        endpoint = returning(value)
+        for app in (standard, compressed):
+            app.get(f"/{name}", response_model=response_model)(endpoint)
+        fast.get(f"/{name}", response_model=response_model)(fast_json.endpoint(item_model)(endpoint))
+    return {'standard': standard, 'standard+gzip': compressed, 'fast': fast, 'fast+gzip': fast}
+
+
+async def measure(app, path: str, requests: int, accept_encoding: str) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    headers = {'Accept-Encoding': accept_encoding}
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for _ in range(min(50, requests)):
+            await client.get(path, headers=headers)
+        wall, cpu = time.perf_counter(), time.process_time()
+        size = 0
+        for _ in range(requests):
+            response = await client.get(path, headers=headers)
+            size = len(response.content) if 'content-encoding' not in response.headers else int(response.headers['content-length'])
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return {'req_per_sec': requests / wall, 'cpu_us': cpu / requests * 1e6, 'bytes': size}
+
+
+app = typer.Typer(add_completion=False, help="Compare the standard and fast analytics response paths")
+
+
+@app.command()
+def benchmark(
+    requests: int = typer.Option(2000, "--requests", "-n", min=1, help="Requests per panel and path"),
+    rows: int = typer.Option(50, "--rows", min=1, help="Rows in the top-movies and daily-trends results"),
+    min_size: int = typer.Option(1024, "--min-size", min=0, help="Compress bodies at least this large"),
+    rounds: int = typer.Option(3, "--rounds", min=1, help="Interleaved rounds per panel; the best one is kept")
+):
+    """Serve every panel through each path and print throughput, CPU per request and body size"""
+    payloads = sample_payloads(rows)
+    apps = build_apps(payloads, min_size)
+    print(f"{'panel':<14} {'path':<14} {'req/s':>9} {'cpu us/req':>11} {'bytes':>8}")
+    for name in payloads:
+        best = {}
+        # Paths take turns within each round, so background noise hits all of them alike
+        for _ in range(rounds):
+            for path, path_app in apps.items():
+                accept_encoding = 'gzip' if path.endswith('gzip') else 'identity'
+                result = asyncio.run(measure(path_app, f"/{name}", requests, accept_encoding))
+                if path not in best or result['cpu_us'] < best[path]['cpu_us']:
+                    best[path] = result
+        baseline = best['standard']['cpu_us']
+        for path, result in best.items():
+            print(
+                f"{name:<14} {path:<14} {result['req_per_sec']:>9.0f} {result['cpu_us']:>11.1f} {result['bytes']:>8}"
+                f"  ({baseline / result['cpu_us']:.2f}x)"
+            )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,137 @@
+"""Chunked bulk write helpers for ETL stages"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+async def _aiter(operations):
+    if hasattr(operations, '__aiter__'):
+        async for operation in operations:
+            yield operation
+    else:
+        for operation in operations:
+            yield operation
+
+
+async def bulk_write_chunked(collection, operations, chunk_size=1000, max_in_flight=4, label=None):
+    """Send pymongo write operations as unordered bulk_write batches.
+
+    operations may be a plain or async iterable of InsertOne/UpdateOne/...
+    requests, so callers can stream them straight out of an aggregation
+    cursor. Up to max_in_flight batches are outstanding at once. Returns
+    the write totals plus throughput, which is also logged.
+    """
+    label = label or collection.name
+    stats = {'operations': 0, 'inserted': 0, 'matched': 0, 'modified': 0, 'upserted': 0}
+    pending = set()
+    started = time.perf_counter()
+
+    def collect(task):
+        result = task.result()
+        stats['inserted'] += result.inserted_count
+        stats['matched'] += result.matched_count
+        stats['modified'] += result.modified_count
+        stats['upserted'] += result.upserted_count
+
+    async def flush(chunk):
+        if len(pending) >= max_in_flight:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+                collect(task)
+        pending.add(asyncio.ensure_future(collection.bulk_write(chunk, ordered=False)))
+
+    chunk = []
+    async for operation in _aiter(operations):
+        chunk.append(operation)
+        stats['operations'] += 1
+        if len(chunk) >= chunk_size:
+            await flush(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+
+    if pending:
+        await asyncio.wait(pending)
+        for task in pending:
+            collect(task)
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = round(elapsed, 3)
+    stats['rows_per_sec'] = round(stats['operations'] / elapsed, 1) if elapsed > 0 else 0.0
+    logger.info(
+        f"{label}: wrote {stats['operations']} rows in {stats['seconds']}s "
+        f"({stats['rows_per_sec']} rows/sec)"
+    )
+    return stats
+
+
+_DONE = object()
+
+
+async def _next_batch(batches):
+    """Pull the next batch, running synchronous generators off the event loop"""
+    if hasattr(batches, '__anext__'):
+        return await batches.__anext__()
+    batch = await asyncio.to_thread(next, batches, _DONE)
+    if batch is _DONE:
+        raise StopAsyncIteration
+    return batch
+
+
+async def insert_batches(collection, batches, writers=4, queue_depth=8, label=None):
+    """Insert documents from an iterable of batches through a bounded queue.
+
+    One producer pulls batches (a sync generator runs in a worker thread so
+    generation overlaps with I/O) while `writers` consumers send unordered
+    insert_many calls. At most queue_depth + writers + 1 batches are alive
+    at once, so memory is set by batch size, not by dataset size. Returns
+    the insert totals plus throughput, which is also logged.
+    """
+    label = label or collection.name
+    stats = {'operations': 0, 'inserted': 0, 'batches': 0}
+    queue = asyncio.Queue(maxsize=queue_depth)
+    batches = batches.__aiter__() if hasattr(batches, '__aiter__') else iter(batches)
+    started = time.perf_counter()
+
+    async def produce():
+        while True:
+            try:
+                batch = await _next_batch(batches)
+            except StopAsyncIteration:
+                break
+            if batch:
+                await queue.put(batch)
+        for _ in range(writers):
+            await queue.put(None)
+
+    async def consume():
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            result = await collection.insert_many(batch, ordered=False)
+            stats['operations'] += len(batch)
+            stats['inserted'] += len(result.inserted_ids)
+            stats['batches'] += 1
+
+    tasks = [asyncio.ensure_future(produce())]
+    tasks += [asyncio.ensure_future(consume()) for _ in range(writers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # A failed writer must not leave the producer blocked on a full queue
+        for task in tasks:
+            task.cancel()
+        raise
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = round(elapsed, 3)
+    stats['rows_per_sec'] = round(stats['operations'] / elapsed, 1) if elapsed > 0 else 0.0
+    logger.info(
+        f"{label}: inserted {stats['operations']} rows in {stats['batches']} batches, "
+        f"{stats['seconds']}s ({stats['rows_per_sec']} rows/sec)"
+    )
+    return stats
@@ -0,0 +1,576 @@
+"""In-memory columnar copy of viewing_sessions answering the analytics panels with NumPy"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from session_ingest import INGEST_SETTLE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SESSION_FIELDS = {
+    '_id': 0, 'id': 1, 'user_id': 1, 'movie_id': 1, 'start_time': 1, 'watch_duration_minutes': 1,
+    'completion_rate': 1, 'device_type': 1, 'user_country': 1, 'created_at': 1
+}
+
+# Dictionary-encoded columns and the session field each one holds
+ENCODED = {'movie': 'movie_id', 'user': 'user_id', 'device': 'device_type', 'country': 'user_country'}
+
+# Column dtypes; start is epoch seconds, day is days since the epoch
+DTYPES = {
+    'start': np.int64,
+    'day': np.int32,
+    'hour': np.int8,
+    'movie': np.int32,
+    'user': np.int32,
+    'device': np.int16,
+    'country': np.int16,
+    'watch': np.int32,
+    'completion': np.float64
+}
+
+# Keys the panels group by
+GROUP_KEYS = ('movie', 'device', 'country', 'hour', 'day')
+
+# Filter dimensions with running totals of their own (filter value x group key)
+FILTER_DIMENSIONS = ('device', 'country')
+
+# Segments are merged back into one once there are more than this many
+MAX_SEGMENTS = 8
+
+# The grouped measures, in the order of the (views, watch, completion) tuples
+MEASURES = ('views', 'watch', 'completion')
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(value):
+    """Naive UTC datetime -> epoch seconds"""
+    return int((value - EPOCH).total_seconds())
+
+
+def day_label(day):
+    return (EPOCH + timedelta(days=int(day))).strftime('%Y-%m-%d')
+
+
+class Dictionary:
+    """Append-only string dictionary: value <-> dense int code.
+
+    base may be a read-only sequence (the strings of a mapped snapshot); the
+    value -> code lookup is only built when a code is first looked up.
+    """
+
+    def __init__(self, base=()):
+        self._base = base
+        self._extra = []
+        self._codes = None
+
+    def __len__(self):
+        return len(self._base) + len(self._extra)
+
+    def __getitem__(self, code):
+        size = len(self._base)
+        return self._base[code] if code < size else self._extra[code - size]
+
+    def __iter__(self):
+        yield from self._base
+        yield from self._extra
+
+    @property
+    def codes(self):
+        if self._codes is None:
+            self._codes = {value: code for code, value in enumerate(self)}
+        return self._codes
+
+    def code(self, value):
+        return self.codes.get(value)
+
+    def encode(self, values, dtype=np.int32, added=None):
+        """Codes of values, new values getting the next free codes.
+
+        With added (a dict), new values are only recorded there, value ->
+        code in code order, and the dictionary itself is left untouched, so
+        it can be encoded against off the event loop while queries read it;
+        extend(added) then publishes them.
+        """
+        codes = self.codes
+        if added is None:
+            added = {}
+            publish = True
+        else:
+            publish = False
+        size = len(self)
+
+        def code(value):
+            found = codes.get(value)
+            if found is None:
+                found = added.get(value)
+                if found is None:
+                    found = added[value] = size + len(added)
+            return found
+
+        encoded = np.fromiter((code(value) for value in values), dtype=dtype, count=len(values))
+        if publish:
+            self.extend(added)
+        return encoded
+
+    def extend(self, added):
+        """Append the values encode() assigned codes to"""
+        codes = self.codes
+        for value, code in added.items():
+            self._extra.append(value)
+            codes[value] = code
+
+
+def concat_columns(parts):
+    return {name: np.concatenate([part[name] for part in parts]) for name in DTYPES}
+
+
+def add_groups(totals, group):
+    """Element-wise sum of two (views, watch, completion) groupings of different shapes"""
+    if totals is None:
+        return group
+    shape = np.maximum(totals[0].shape, group[0].shape)
+
+    def pad(array):
+        return np.pad(array, [(0, size - current) for size, current in zip(shape, array.shape)])
+
+    return tuple(pad(a) + pad(b) for a, b in zip(totals, group))
+
+
+class Segment:
+    """Sessions clustered by (country, device, start time).
+
+    Each (country, device) pair is one contiguous block sorted by start, so
+    any combination of the filters is a set of searchsorted slices. Columns
+    that are already clustered (a mapped snapshot) are used as they are
+    when their blocks are passed in.
+    """
+
+    def __init__(self, columns, blocks=None):
+        if blocks is None:
+            order = np.lexsort((columns['start'], columns['device'], columns['country']))
+            columns = {name: columns[name][order] for name in DTYPES}
+        self.columns = columns
+        self.size = len(columns['start'])
+        if blocks is None:
+            country, device = columns['country'], columns['device']
+            changes = np.flatnonzero((np.diff(country) != 0) | (np.diff(device) != 0)) + 1
+            bounds = np.concatenate(([0], changes, [self.size])) if self.size else np.zeros(1, dtype=np.int64)
+            blocks = [
+                (int(country[start]), int(device[start]), int(start), int(stop))
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+        # (country code, device code, first row, row after the last)
+        self.blocks = [tuple(int(value) for value in block) for block in blocks]
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def slices(self, lo=None, hi=None, device=None, country=None):
+        """(start, stop) row ranges matching a start-time window and dimension codes"""
+        start_time = self.columns['start']
+        ranges = []
+        for block_country, block_device, start, stop in self.blocks:
+            if (country is not None and block_country != country) or (device is not None and block_device != device):
+                continue
+            if lo is not None:
+                start += int(np.searchsorted(start_time[start:stop], lo, 'left'))
+            if hi is not None:
+                stop = start + int(np.searchsorted(start_time[start:stop], hi, 'left'))
+            if start < stop:
+                ranges.append((start, stop))
+        return ranges
+
+    def gather(self, name, ranges):
+        column = self.columns[name]
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            return column[start:stop]
+        return np.concatenate([column[start:stop] for start, stop in ranges])
+
+
+class ColumnarEngine:
+    """viewing_sessions held in RAM as NumPy columns, grouped with bincount.
+
+    Sessions live in a few segments clustered by (country, device, start),
+    so every filter selects contiguous slices and only the matching rows
+    are grouped. Running totals per group key, and per device and per
+    country, answer the unfiltered and single-dimension panels without
+    scanning anything. New sessions (by created_at) are appended as a new
+    segment in the background at most once per refresh_interval; segments
+    are compacted past MAX_SEGMENTS. Each refresh re-reads settle_seconds
+    below the newest created_at loaded, skipping the ids it already holds,
+    so sessions that commit after later-stamped ones are still picked up.
+
+    With a snapshot_store.SnapshotReader, the engine starts from the latest
+    published snapshot, mapped read-only, and switches to each new version
+    as it appears; only sessions created after the snapshot are read from
+    MongoDB and held privately.
+    """
+
+    def __init__(self, collection, refresh_interval=5.0, batch_size=50000, snapshots=None,
+                 settle_seconds=INGEST_SETTLE_SECONDS):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.settle = timedelta(seconds=settle_seconds)
+        self.batch_size = batch_size
+        self.snapshots = snapshots
+        self.snapshot_version = None
+        self._reset()
+        self._refreshed_at = None
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def _reset(self):
+        self.dictionaries = {name: Dictionary() for name in ENCODED}
+        self.segments = []
+        self.totals = {}
+        self.dimension_totals = {}
+        self.size = 0
+        self.loaded = False
+        self._watermark = None
+        # id -> created_at of the loaded sessions the next refresh reads again
+        self._recent = {}
+        # Leading segments mapped from a snapshot, never compacted into private memory
+        self._mapped = 0
+
+    # ---------- loading ----------
+
+    def _encode(self, docs, added):
+        """Columns of a batch of documents; new dictionary values are collected in added (runs off the event loop)"""
+        start = np.fromiter(
+            (epoch_seconds(doc['start_time']) for doc in docs), dtype=np.int64, count=len(docs)
+        )
+        columns = {
+            'start': start,
+            'day': (start // 86400).astype(DTYPES['day']),
+            'hour': ((start // 3600) % 24).astype(DTYPES['hour']),
+            'watch': np.fromiter((doc['watch_duration_minutes'] for doc in docs), dtype=DTYPES['watch'], count=len(docs)),
+            'completion': np.fromiter((doc['completion_rate'] for doc in docs), dtype=DTYPES['completion'], count=len(docs))
+        }
+        for name, field in ENCODED.items():
+            columns[name] = self.dictionaries[name].encode([doc[field] for doc in docs], DTYPES[name], added[name])
+        return columns
+
+    def _build(self, columns):
+        """Segments and running totals with a batch of new sessions added (runs off the event loop)"""
+        segment = Segment(columns)
+        segments = self.segments + [segment]
+        if len(segments) > MAX_SEGMENTS:
+            private = segments[self._mapped:]
+            segments = segments[:self._mapped] + [Segment(concat_columns([part.columns for part in private]))]
+        everything = [(0, segment.size)]
+        totals = {
+            key: add_groups(self.totals.get(key), self._group_rows(segment, key, everything))
+            for key in GROUP_KEYS
+        }
+        dimension_totals = {
+            (dimension, key): add_groups(
+                self.dimension_totals.get((dimension, key)), self._group_rows(segment, key, everything, by=dimension)
+            )
+            for dimension in FILTER_DIMENSIONS for key in GROUP_KEYS
+        }
+        return segments, totals, dimension_totals
+
+    async def _load_new(self):
+        query = {}
+        if self._watermark is not None:
+            query = {'created_at': {'$gte': self._watermark - self.settle}}
+        elif self.size:
+            return 0
+        watermark, recent = self._watermark, dict(self._recent)
+        parts, batch, loaded = [], [], 0
+        # New dictionary values of this load, published together with its segments
+        added = {name: {} for name in ENCODED}
+        async for doc in self.collection.find(query, SESSION_FIELDS, batch_size=self.batch_size):
+            if doc['id'] in self._recent:
+                continue
+            batch.append(doc)
+            created_at = doc.get('created_at')
+            if created_at is not None:
+                recent[doc['id']] = created_at
+                if watermark is None or created_at > watermark:
+                    watermark = created_at
+            if len(batch) >= self.batch_size:
+                parts.append(await asyncio.to_thread(self._encode, batch, added))
+                loaded += len(batch)
+                batch = []
+        if batch:
+            parts.append(await asyncio.to_thread(self._encode, batch, added))
+            loaded += len(batch)
+        if parts:
+            columns = parts[0] if len(parts) == 1 else concat_columns(parts)
+            segments, totals, dimension_totals = await asyncio.to_thread(self._build, columns)
+            # Published in one step on the event loop, so a query never sees half an update
+            for name, values in added.items():
+                self.dictionaries[name].extend(values)
+            self.segments, self.totals, self.dimension_totals = segments, totals, dimension_totals
+            self.size += loaded
+        if watermark is not None:
+            # Only sessions inside the window the next refresh re-reads need remembering
+            oldest = watermark - self.settle
+            recent = {session_id: created_at for session_id, created_at in recent.items() if created_at >= oldest}
+        self._watermark, self._recent = watermark, recent
+        return loaded
+
+    def load_snapshot(self, snapshot):
+        """Replace the engine state with a mapped snapshot (zero-copy)"""
+        arrays, meta = snapshot.arrays, snapshot.meta
+        segments = []
+        if meta['rows']:
+            columns = {name: arrays[f"columns.{name}"] for name in DTYPES}
+            segments.append(Segment(columns, arrays['blocks'].tolist()))
+        totals = {
+            key: tuple(arrays[f"totals.{key}.{measure}"] for measure in MEASURES)
+            for key in GROUP_KEYS if f"totals.{key}.views" in arrays
+        }
+        dimension_totals = {
+            (dimension, key): tuple(arrays[f"totals.{dimension}.{key}.{measure}"] for measure in MEASURES)
+            for dimension in FILTER_DIMENSIONS for key in GROUP_KEYS
+            if f"totals.{dimension}.{key}.views" in arrays
+        }
+        self.dictionaries = {name: Dictionary(snapshot.strings[f"dictionary.{name}"]) for name in ENCODED}
+        self.segments, self.totals, self.dimension_totals = segments, totals, dimension_totals
+        self.size = meta['rows']
+        self._watermark = datetime.fromisoformat(meta['watermark']) if meta['watermark'] else None
+        if 'recent_ids' in meta:
+            self._recent = {
+                session_id: datetime.fromisoformat(created_at) for session_id, created_at in meta['recent_ids'].items()
+            }
+        else:
+            # Snapshots written before the settle window only list the ids at the watermark
+            self._recent = {session_id: self._watermark for session_id in meta.get('boundary_ids', [])}
+        self._mapped = len(segments)
+        self.snapshot_version = snapshot.version
+        self.loaded = True
+
+    def to_snapshot(self):
+        """(arrays, strings, meta) for snapshot_store.write_snapshot, all segments merged into one"""
+        segments = self.segments
+        if len(segments) > 1:
+            segments = [Segment(concat_columns([part.columns for part in segments]))]
+        arrays = {}
+        if segments:
+            arrays.update({f"columns.{name}": column for name, column in segments[0].columns.items()})
+            arrays['blocks'] = np.array(segments[0].blocks, dtype=np.int64).reshape(-1, 4)
+        for key, group in self.totals.items():
+            arrays.update({f"totals.{key}.{measure}": column for measure, column in zip(MEASURES, group)})
+        for (dimension, key), group in self.dimension_totals.items():
+            arrays.update({f"totals.{dimension}.{key}.{measure}": column for measure, column in zip(MEASURES, group)})
+        strings = {f"dictionary.{name}": list(dictionary) for name, dictionary in self.dictionaries.items()}
+        meta = {
+            'rows': self.size,
+            'watermark': self._watermark.isoformat() if self._watermark else None,
+            'recent_ids': {session_id: created_at.isoformat() for session_id, created_at in sorted(self._recent.items())}
+        }
+        return arrays, strings, meta
+
+    async def refresh(self):
+        """Load sessions created since the last refresh (everything on the first call)"""
+        async with self._lock:
+            started = time.perf_counter()
+            snapshot = self.snapshots.latest() if self.snapshots is not None else None
+            if snapshot is not None and snapshot.version != self.snapshot_version:
+                self.load_snapshot(snapshot)
+                logger.info(f"Columnar engine: mapped snapshot v{snapshot.version} ({self.size} sessions)")
+            elif self.size and await self.collection.estimated_document_count() < self.size:
+                logger.info("viewing_sessions shrank, reloading the columnar engine")
+                self._reset()
+            loaded = await self._load_new()
+            self._refreshed_at = time.monotonic()
+            if loaded or not self.loaded:
+                logger.info(
+                    f"Columnar engine: +{loaded} sessions ({self.size} total, {len(self.segments)} segments) "
+                    f"in {time.perf_counter() - started:.2f}s"
+                )
+            self.loaded = True
+
+    def ensure_fresh(self):
+        """Start a background refresh when one is due; queries keep using the current data"""
+        if self._task is not None and not self._task.done():
+            return
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self._task = asyncio.ensure_future(self.refresh())
+
+    # ---------- selection and grouping ----------
+
+    def _selections(self, flt):
+        """(segment, row ranges) for every segment with sessions matching flt"""
+        codes = {}
+        for name, value in (('device', flt.device_type), ('country', flt.country)):
+            if value is not None:
+                codes[name] = self.dictionaries[name].code(value)
+                if codes[name] is None:
+                    return
+        lo = epoch_seconds(flt.start) if flt.start else None
+        hi = epoch_seconds(flt.end) if flt.end else None
+        for segment in self.segments:
+            ranges = segment.slices(lo, hi, **codes)
+            if ranges:
+                yield segment, ranges
+
+    def _group_rows(self, segment, key, ranges, minlength=0, by=None):
+        """Grouped measures of the rows in ranges; with by, a (by code x key code) table"""
+        codes = segment.gather(key, ranges)
+        shape = None
+        if by is not None:
+            rows = segment.gather(by, ranges)
+            width = max(minlength, int(codes.max()) + 1 if len(codes) else 0)
+            shape = (int(rows.max()) + 1 if len(rows) else 0, width)
+            codes = rows.astype(np.int64) * width + codes
+            minlength = shape[0] * width
+        group = (
+            np.bincount(codes, minlength=minlength).astype(np.int64),
+            np.bincount(codes, weights=segment.gather('watch', ranges), minlength=minlength),
+            np.bincount(codes, weights=segment.gather('completion', ranges), minlength=minlength)
+        )
+        return group if shape is None else tuple(column.reshape(shape) for column in group)
+
+    def _key_size(self, key):
+        if key in self.dictionaries:
+            return len(self.dictionaries[key])
+        if key == 'hour':
+            return 24
+        return len(self.totals['day'][0]) if 'day' in self.totals else 0
+
+    def group(self, key, flt):
+        """(views, watch minutes, completion sum) arrays indexed by the key's code"""
+        size = self._key_size(key)
+        empty = tuple(np.zeros(size) for _ in range(3))
+        if flt.is_empty or not (flt.start or flt.end or (flt.device_type and flt.country)):
+            if flt.is_empty:
+                totals = self.totals.get(key)
+            else:
+                # A single dimension filter: that value's row of its running totals
+                dimension, value = ('device', flt.device_type) if flt.device_type else ('country', flt.country)
+                code = self.dictionaries[dimension].code(value)
+                table = self.dimension_totals.get((dimension, key))
+                if code is None or table is None or code >= len(table[0]):
+                    return empty
+                totals = tuple(column[code] for column in table)
+            if totals is None:
+                return empty
+            return tuple(np.pad(column, (0, size - len(column))) for column in totals)
+        result = empty
+        for segment, ranges in self._selections(flt):
+            group = self._group_rows(segment, key, ranges, size)
+            result = tuple(a + b[:size] for a, b in zip(result, group))
+        return result
+
+    def label(self, key, code):
+        if key in self.dictionaries:
+            return self.dictionaries[key][code]
+        if key == 'day':
+            return day_label(code)
+        return int(code)
+
+    def distinct_users(self, key, flt, mapping=None):
+        """Exact distinct users per key value over the matching sessions.
+
+        mapping optionally re-keys the codes first (e.g. movie -> genre);
+        codes mapped to -1 are dropped. Returns {label or mapped code: count}.
+        """
+        users = max(len(self.dictionaries['user']), 1)
+        pairs = []
+        for segment, ranges in self._selections(flt):
+            codes = segment.gather(key, ranges)
+            user_codes = segment.gather('user', ranges)
+            if mapping is not None:
+                codes = mapping[codes]
+                keep = codes >= 0
+                codes, user_codes = codes[keep], user_codes[keep]
+            pairs.append(codes.astype(np.int64) * users + user_codes)
+        if not pairs:
+            return {}
+        counts = np.bincount(np.unique(np.concatenate(pairs)) // users)
+        found = np.nonzero(counts)[0]
+        if mapping is not None:
+            return {int(code): int(counts[code]) for code in found}
+        return {self.label(key, code): int(counts[code]) for code in found}
+
+    # ---------- panels (same rows as the Mongo pipelines in server.py) ----------
+
+    def _measure_rows(self, key, flt):
+        """(label, views, watch minutes, rounded average completion) for every key with sessions"""
+        views, watch, completion = self.group(key, flt)
+        return [
+            (self.label(key, code), int(views[code]), float(watch[code]), round(float(completion[code] / views[code]), 2))
+            for code in np.nonzero(views)[0]
+        ]
+
+    def top_movies(self, flt):
+        """Per-movie views, most viewed first (input of join_top_movies)"""
+        views, _, completion = self.group('movie', flt)
+        codes = np.nonzero(views)[0]
+        movie_ids = self.dictionaries['movie']
+        order = sorted(codes, key=lambda code: (-views[code], movie_ids[code]))
+        return [
+            {'_id': movie_ids[code], 'total_views': int(views[code]), 'avg_completion_rate': float(completion[code] / views[code])}
+            for code in order
+        ]
+
+    def genre_mapping(self, movies):
+        """(movie code -> genre code array, genre names) from the movie dimension"""
+        genres = Dictionary()
+        mapping = np.full(len(self.dictionaries['movie']), -1, dtype=np.int64)
+        for code, movie_id in enumerate(self.dictionaries['movie']):
+            movie = movies.get(movie_id)
+            if movie is not None:
+                mapping[code] = genres.encode([movie['genre']])[0]
+        return mapping, list(genres)
+
+    def genres(self, flt, movies):
+        views, watch, _ = self.group('movie', flt)
+        mapping, names = self.genre_mapping(movies)
+        keep = mapping >= 0
+        genre_views = np.bincount(mapping[keep], weights=views[keep], minlength=len(names))
+        genre_watch = np.bincount(mapping[keep], weights=watch[keep], minlength=len(names))
+        rows = [
+            {
+                'genre': names[code],
+                'total_views': int(genre_views[code]),
+                'avg_watch_time': round(float(genre_watch[code] / genre_views[code]), 2)
+            }
+            for code in np.nonzero(genre_views)[0]
+        ]
+        rows.sort(key=lambda row: row['total_views'], reverse=True)
+        return rows
+
+    def genre_distinct_users(self, flt, movies):
+        mapping, names = self.genre_mapping(movies)
+        return {names[code]: count for code, count in self.distinct_users('movie', flt, mapping).items()}
+
+    def devices(self, flt):
+        rows = self._measure_rows('device', flt)
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return [
+            {'device_type': label, 'session_count': views, 'avg_completion_rate': avg_completion}
+            for label, views, _, avg_completion in rows
+        ]
+
+    def geographic(self, flt, limit=20):
+        """Top countries by views (unique users are attached by the caller)"""
+        rows = self._measure_rows('country', flt)
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return [
+            {'country': label, 'total_views': views, 'avg_completion_rate': avg_completion}
+            for label, views, _, avg_completion in rows[:limit]
+        ]
+
+    def hourly_trends(self, flt):
+        rows = self._measure_rows('hour', flt)
+        return [
+            {'hour': label, 'view_count': views, 'avg_completion_rate': avg_completion}
+            for label, views, _, avg_completion in rows
+        ]
+
+    def daily_trends(self, flt, days):
+        """The latest `days` days with sessions, newest first"""
+        rows = self._measure_rows('day', flt)
+        return [
+            {'date': label, 'total_views': views, 'total_watch_time': int(watch), 'avg_completion_rate': avg_completion}
+            for label, views, watch, avg_completion in reversed(rows[-days:])
+        ]
@@ -2,7 +2,7 @@
 import random
 from datetime import datetime, timedelta
 from faker import Faker
-import uuid
+import numpy as np
 
 fake = Faker()
 
@@ -11,35 +11,79 @@ MOVIE_GENRES = ['Action', 'Comedy', 'Drama', 'Horror', 'Sci-Fi', 'Romance', 'Thr
 MOVIE_RATINGS = ['G', 'PG', 'PG-13', 'R', 'NC-17']
 COUNTRIES = ['USA', 'UK', 'India', 'Canada', 'Australia', 'Germany', 'France', 'Japan', 'Brazil', 'Mexico']
 DEVICE_TYPES = ['Mobile', 'Desktop', 'Tablet', 'Smart TV', 'Gaming Console']
+QUALITIES = ['SD', 'HD', 'FHD', '4K']
+
+# Vectorized mode samples review texts from a pre-generated pool instead of
+# calling Faker once per rating
+REVIEW_POOL_SIZE = 1000
+
+
+HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+UUID_DIGIT_POSITIONS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+
+def uuid4_strings(rng, count):
+    """count random version-4 UUID strings drawn from rng, formatted in bulk"""
+    raw = rng.integers(0, 256, size=(count, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    nibbles = np.stack([raw >> 4, raw & 0x0F], axis=2).reshape(count, 32)
+    chars = np.full((count, 36), ord('-'), dtype=np.uint8)
+    chars[:, UUID_DIGIT_POSITIONS] = HEX_DIGITS[nibbles]
+    text = chars.tobytes().decode('ascii')
+    return [text[i:i + 36] for i in range(0, 36 * count, 36)]
+
+
+def random_datetimes(rng, count, days_back, now):
+    """count datetime64[s] values uniformly distributed over [now - days_back days, now)"""
+    offsets = rng.integers(0, days_back * 86400, size=count).astype('timedelta64[s]')
+    return np.datetime64(now.replace(microsecond=0), 's') - np.timedelta64(days_back * 86400, 's') + offsets
+
+
+def day_strings(timestamps):
+    """'%Y-%m-%d' strings for datetime64 values, formatting each distinct day once"""
+    days, inverse = np.unique(timestamps.astype('datetime64[D]'), return_inverse=True)
+    return np.datetime_as_string(days, unit='D').astype(object)[inverse].tolist()
+
 
 class StreamingDataGenerator:
-    def __init__(self):
+    def __init__(self, seed=None, reference_time=None):
+        """seed makes every generated value reproducible; reference_time pins "now" (UTC) as well"""
         self.fake = Faker()
+        self.reference_time = reference_time
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        if seed is not None:
+            self.fake.seed_instance(seed)
         self.movies = []
         self.users = []
+    
+    def now(self):
+        return self.reference_time or datetime.utcnow()
         
     def generate_movies(self, count=200):
         """Generate movie catalog data"""
         movies = []
+        today = self.now().date()
         for i in range(count):
-            release_date = self.fake.date_between(start_date='-10y', end_date='today')
+            release_date = self.fake.date_between(start_date=today - timedelta(days=3652), end_date=today)
             movie = {
-                'id': str(uuid.uuid4()),
-                'title': f"{self.fake.catch_phrase()} {random.choice(['Movie', 'Story', 'Adventure', 'Chronicles', 'Legacy'])}",
-                'genre': random.choice(MOVIE_GENRES),
-                'sub_genres': random.sample(MOVIE_GENRES, k=random.randint(1, 3)),
-                'duration_minutes': random.randint(80, 180),
+                'id': self.fake.uuid4(),
+                'title': f"{self.fake.catch_phrase()} {self.random.choice(['Movie', 'Story', 'Adventure', 'Chronicles', 'Legacy'])}",
+                'genre': self.random.choice(MOVIE_GENRES),
+                'sub_genres': self.random.sample(MOVIE_GENRES, k=self.random.randint(1, 3)),
+                'duration_minutes': self.random.randint(80, 180),
                 'release_date': release_date.isoformat(),
-                'rating': random.choice(MOVIE_RATINGS),
+                'rating': self.random.choice(MOVIE_RATINGS),
                 'director': self.fake.name(),
-                'cast': [self.fake.name() for _ in range(random.randint(3, 8))],
-                'production_budget': random.randint(1000000, 200000000),
+                'cast': [self.fake.name() for _ in range(self.random.randint(3, 8))],
+                'production_budget': self.random.randint(1000000, 200000000),
                 'description': self.fake.text(max_nb_chars=200),
-                'language': random.choice(['English', 'Spanish', 'French', 'Hindi', 'Japanese']),
-                'country': random.choice(COUNTRIES),
-                'avg_rating': round(random.uniform(3.0, 9.5), 1),
+                'language': self.random.choice(['English', 'Spanish', 'French', 'Hindi', 'Japanese']),
+                'country': self.random.choice(COUNTRIES),
+                'avg_rating': round(self.random.uniform(3.0, 9.5), 1),
                 'total_views': 0,
-                'created_at': datetime.utcnow().isoformat()
+                'created_at': self.now().isoformat()
             }
             movies.append(movie)
         self.movies = movies
@@ -48,92 +92,227 @@ class StreamingDataGenerator:
     def generate_users(self, count=5000):
         """Generate user demographics data"""
         users = []
+        today = self.now().date()
         for i in range(count):
-            signup_date = self.fake.date_between(start_date='-3y', end_date='today')
+            signup_date = self.fake.date_between(start_date=today - timedelta(days=1096), end_date=today)
             user = {
-                'id': str(uuid.uuid4()),
+                'id': self.fake.uuid4(),
                 'username': self.fake.user_name(),
                 'email': self.fake.email(),
-                'age': random.randint(18, 65),
-                'gender': random.choice(['Male', 'Female', 'Other']),
-                'country': random.choice(COUNTRIES),
-                'subscription_type': random.choice(['Free', 'Basic', 'Premium', 'Family']),
+                'age': self.random.randint(18, 65),
+                'gender': self.random.choice(['Male', 'Female', 'Other']),
+                'country': self.random.choice(COUNTRIES),
+                'subscription_type': self.random.choice(['Free', 'Basic', 'Premium', 'Family']),
                 'signup_date': signup_date.isoformat(),
-                'is_active': random.choice([True, True, True, False]),
-                'preferred_genres': random.sample(MOVIE_GENRES, k=random.randint(2, 4)),
-                'created_at': datetime.utcnow().isoformat()
+                'is_active': self.random.choice([True, True, True, False]),
+                'preferred_genres': self.random.sample(MOVIE_GENRES, k=self.random.randint(2, 4)),
+                'created_at': self.now().isoformat()
             }
             users.append(user)
         self.users = users
         return users
     
-    def generate_viewing_sessions(self, count=50000):
+    def generate_viewing_sessions(self, count=50000, vectorized=False):
         """Generate viewing session data (fact table)"""
         if not self.movies or not self.users:
             raise ValueError("Generate movies and users first")
+        if vectorized:
+            return [session for chunk in self.iter_viewing_sessions(count) for session in chunk]
         
         sessions = []
+        now = self.now()
         for i in range(count):
-            movie = random.choice(self.movies)
-            user = random.choice(self.users)
-            start_time = self.fake.date_time_between(start_date='-90d', end_date='now')
+            movie = self.random.choice(self.movies)
+            user = self.random.choice(self.users)
+            start_time = self.fake.date_time_between(start_date=now - timedelta(days=90), end_date=now)
             
             # Calculate watch duration (some users don't finish)
-            completion_rate = random.uniform(0.1, 1.0)
+            completion_rate = self.random.uniform(0.1, 1.0)
             watch_duration = int(movie['duration_minutes'] * completion_rate)
             
             session = {
-                'id': str(uuid.uuid4()),
+                'id': self.fake.uuid4(),
                 'user_id': user['id'],
                 'movie_id': movie['id'],
-                'start_time': start_time.isoformat(),
-                'end_time': (start_time + timedelta(minutes=watch_duration)).isoformat(),
+                # Native datetimes (stored as BSON dates) plus precomputed buckets
+                'start_time': start_time,
+                'end_time': start_time + timedelta(minutes=watch_duration),
+                'hour_of_day': start_time.hour,
+                'day': start_time.strftime('%Y-%m-%d'),
                 'watch_duration_minutes': watch_duration,
                 'completion_rate': round(completion_rate, 2),
-                'device_type': random.choice(DEVICE_TYPES),
-                'quality': random.choice(['SD', 'HD', 'FHD', '4K']),
-                'buffering_count': random.randint(0, 5) if random.random() < 0.3 else 0,
+                'device_type': self.random.choice(DEVICE_TYPES),
+                'quality': self.random.choice(['SD', 'HD', 'FHD', '4K']),
+                'buffering_count': self.random.randint(0, 5) if self.random.random() < 0.3 else 0,
                 'user_country': user['country'],
                 'subscription_type': user['subscription_type'],
-                'created_at': datetime.utcnow().isoformat()
+                'created_at': self.now()
             }
             sessions.append(session)
         
         return sessions
     
-    def generate_ratings(self, count=20000):
+    def generate_ratings(self, count=20000, vectorized=False):
         """Generate user ratings and reviews"""
         if not self.movies or not self.users:
             raise ValueError("Generate movies and users first")
+        if vectorized:
+            return [rating for chunk in self.iter_ratings(count) for rating in chunk]
         
         ratings = []
         used_combinations = set()
+        now = self.now()
         
         for i in range(count):
             # Ensure unique user-movie combinations
             while True:
-                user = random.choice(self.users)
-                movie = random.choice(self.movies)
+                user = self.random.choice(self.users)
+                movie = self.random.choice(self.movies)
                 combo = f"{user['id']}_{movie['id']}"
                 if combo not in used_combinations:
                     used_combinations.add(combo)
                     break
             
-            rating_date = self.fake.date_time_between(start_date='-2y', end_date='now')
+            rating_date = self.fake.date_time_between(start_date=now - timedelta(days=730), end_date=now)
             rating = {
-                'id': str(uuid.uuid4()),
+                'id': self.fake.uuid4(),
                 'user_id': user['id'],
                 'movie_id': movie['id'],
-                'rating': random.randint(1, 10),
-                'review_text': self.fake.text(max_nb_chars=300) if random.random() < 0.4 else None,
-                'helpful_count': random.randint(0, 500),
+                'rating': self.random.randint(1, 10),
+                'review_text': self.fake.text(max_nb_chars=300) if self.random.random() < 0.4 else None,
+                'helpful_count': self.random.randint(0, 500),
                 'rating_date': rating_date.isoformat(),
-                'created_at': datetime.utcnow().isoformat()
+                'created_at': self.now().isoformat()
             }
             ratings.append(rating)
         
         return ratings
 
+    def iter_viewing_sessions(self, count=50000, chunk_size=100000, days=90, end_time=None):
+        """Vectorized session generation, yielding lists of up to chunk_size sessions.
+
+        Draws every column of a chunk as a NumPy array from the seeded
+        generator, with the same distributions as generate_viewing_sessions.
+        Start times are uniform over the `days` days before end_time (now).
+        """
+        if not self.movies or not self.users:
+            raise ValueError("Generate movies and users first")
+        
+        rng = self.rng
+        movie_ids = np.array([movie['id'] for movie in self.movies], dtype=object)
+        durations = np.array([movie['duration_minutes'] for movie in self.movies])
+        user_ids = np.array([user['id'] for user in self.users], dtype=object)
+        user_countries = np.array([user['country'] for user in self.users], dtype=object)
+        user_subscriptions = np.array([user['subscription_type'] for user in self.users], dtype=object)
+        devices = np.array(DEVICE_TYPES, dtype=object)
+        qualities = np.array(QUALITIES, dtype=object)
+        
+        for offset in range(0, count, chunk_size):
+            n = min(chunk_size, count - offset)
+            now = self.now()
+            movie_idx = rng.integers(0, len(movie_ids), size=n)
+            user_idx = rng.integers(0, len(user_ids), size=n)
+            start = random_datetimes(rng, n, days, end_time or now)
+            
+            # Calculate watch duration (some users don't finish)
+            completion = rng.uniform(0.1, 1.0, size=n)
+            watch_duration = (durations[movie_idx] * completion).astype(np.int64)
+            end = start + watch_duration.astype('timedelta64[m]')
+            hours = (start - start.astype('datetime64[D]')).astype('timedelta64[h]').astype(np.int64)
+            buffering = np.where(rng.random(size=n) < 0.3, rng.integers(0, 6, size=n), 0)
+            
+            columns = zip(
+                uuid4_strings(rng, n),
+                user_ids[user_idx].tolist(),
+                movie_ids[movie_idx].tolist(),
+                start.astype(datetime).tolist(),
+                end.astype(datetime).tolist(),
+                hours.tolist(),
+                day_strings(start),
+                watch_duration.tolist(),
+                np.round(completion, 2).tolist(),
+                devices[rng.integers(0, len(devices), size=n)].tolist(),
+                qualities[rng.integers(0, len(qualities), size=n)].tolist(),
+                buffering.tolist(),
+                user_countries[user_idx].tolist(),
+                user_subscriptions[user_idx].tolist()
+            )
+            yield [
+                {
+                    'id': session_id,
+                    'user_id': user_id,
+                    'movie_id': movie_id,
+                    'start_time': start_time,
+                    'end_time': end_time,
+                    'hour_of_day': hour,
+                    'day': day,
+                    'watch_duration_minutes': duration,
+                    'completion_rate': rate,
+                    'device_type': device,
+                    'quality': quality,
+                    'buffering_count': buffering_count,
+                    'user_country': country,
+                    'subscription_type': subscription,
+                    'created_at': now
+                }
+                for (session_id, user_id, movie_id, start_time, end_time, hour, day, duration,
+                     rate, device, quality, buffering_count, country, subscription) in columns
+            ]
+    
+    def iter_ratings(self, count=20000, chunk_size=100000):
+        """Vectorized rating generation, yielding lists of up to chunk_size ratings.
+
+        User-movie combinations are drawn without replacement up front, so
+        they stay unique across chunks.
+        """
+        if not self.movies or not self.users:
+            raise ValueError("Generate movies and users first")
+        combinations = len(self.users) * len(self.movies)
+        if count > combinations:
+            raise ValueError(f"Cannot draw {count} unique ratings from {combinations} user-movie pairs")
+        
+        rng = self.rng
+        movie_ids = np.array([movie['id'] for movie in self.movies], dtype=object)
+        user_ids = np.array([user['id'] for user in self.users], dtype=object)
+        reviews = np.array(
+            [self.fake.text(max_nb_chars=300) for _ in range(min(REVIEW_POOL_SIZE, count))],
+            dtype=object
+        )
+        pairs = rng.choice(combinations, size=count, replace=False)
+        
+        for offset in range(0, count, chunk_size):
+            chunk = pairs[offset:offset + chunk_size]
+            n = len(chunk)
+            now = self.now()
+            created_at = now.isoformat()
+            rating_dates = random_datetimes(rng, n, 730, now)
+            review_text = np.where(
+                rng.random(size=n) < 0.4, reviews[rng.integers(0, len(reviews), size=n)], None
+            )
+            
+            columns = zip(
+                uuid4_strings(rng, n),
+                user_ids[chunk // len(movie_ids)].tolist(),
+                movie_ids[chunk % len(movie_ids)].tolist(),
+                rng.integers(1, 11, size=n).tolist(),
+                review_text.tolist(),
+                rng.integers(0, 501, size=n).tolist(),
+                np.datetime_as_string(rating_dates, unit='s').tolist()
+            )
+            yield [
+                {
+                    'id': rating_id,
+                    'user_id': user_id,
+                    'movie_id': movie_id,
+                    'rating': rating,
+                    'review_text': text,
+                    'helpful_count': helpful_count,
+                    'rating_date': rating_date,
+                    'created_at': created_at
+                }
+                for rating_id, user_id, movie_id, rating, text, helpful_count, rating_date in columns
+            ]
+
 
 if __name__ == "__main__":
     generator = StreamingDataGenerator()
@@ -0,0 +1,90 @@
+"""Arrow schemas of the file datasets (generated or exported from MongoDB)
+
+Layout shared by generate_dataset.py and parquet_export.py:
+    movies.parquet, users.parquet
+    sessions/day=YYYY-MM-DD/part-NNNNN.parquet
+    ratings/month=YYYY-MM/part-NNNNN.parquet
+    _manifest.json
+Partition columns are encoded in the directory names, not stored in the files.
+"""
+import shutil
+from pathlib import Path
+
+import pyarrow as pa
+
+ARROW_SCHEMAS = {
+    'movies': pa.schema([
+        ('id', pa.string()),
+        ('title', pa.string()),
+        ('genre', pa.string()),
+        ('sub_genres', pa.list_(pa.string())),
+        ('duration_minutes', pa.int32()),
+        ('release_date', pa.string()),
+        ('rating', pa.string()),
+        ('director', pa.string()),
+        ('cast', pa.list_(pa.string())),
+        ('production_budget', pa.int64()),
+        ('description', pa.string()),
+        ('language', pa.string()),
+        ('country', pa.string()),
+        ('avg_rating', pa.float64()),
+        ('total_views', pa.int64()),
+        ('created_at', pa.string())
+    ]),
+    'users': pa.schema([
+        ('id', pa.string()),
+        ('username', pa.string()),
+        ('email', pa.string()),
+        ('age', pa.int32()),
+        ('gender', pa.string()),
+        ('country', pa.string()),
+        ('subscription_type', pa.string()),
+        ('signup_date', pa.string()),
+        ('is_active', pa.bool_()),
+        ('preferred_genres', pa.list_(pa.string())),
+        ('created_at', pa.string())
+    ]),
+    # Partition columns (day, month) are encoded in the directory names
+    'sessions': pa.schema([
+        ('id', pa.string()),
+        ('user_id', pa.string()),
+        ('movie_id', pa.string()),
+        ('start_time', pa.timestamp('us', tz='UTC')),
+        ('end_time', pa.timestamp('us', tz='UTC')),
+        ('hour_of_day', pa.int32()),
+        ('watch_duration_minutes', pa.int32()),
+        ('completion_rate', pa.float64()),
+        ('device_type', pa.string()),
+        ('quality', pa.string()),
+        ('buffering_count', pa.int32()),
+        ('user_country', pa.string()),
+        ('subscription_type', pa.string()),
+        ('created_at', pa.timestamp('us', tz='UTC'))
+    ]),
+    'ratings': pa.schema([
+        ('id', pa.string()),
+        ('user_id', pa.string()),
+        ('movie_id', pa.string()),
+        ('rating', pa.int32()),
+        ('review_text', pa.string()),
+        ('helpful_count', pa.int32()),
+        ('rating_date', pa.string()),
+        ('created_at', pa.string())
+    ])
+}
+
+# Partition column of each partitioned table
+PARTITIONS = {
+    'sessions': 'day',
+    'ratings': 'month'
+}
+
+
+def clear_dataset(output: Path):
+    """Remove only the paths a dataset written to output consists of"""
+    for table in PARTITIONS:
+        if (output / table).is_dir():
+            shutil.rmtree(output / table)
+    for pattern in ('movies.*', 'users.*', '_manifest.json'):
+        for path in output.glob(pattern):
+            path.unlink()
@@ -1,20 +1,80 @@
 """ETL/ELT Pipeline for Movie Streaming Analytics"""
 import asyncio
+import importlib.util
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
 import os
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from pathlib import Path
 from data_generator import StreamingDataGenerator
+from bulk_writer import bulk_write_chunked, insert_batches
+from columnar_engine import ColumnarEngine
+from hll import HyperLogLog, merge_sketches_by
+from log_ingestion import ingest_directory
+from parquet_export import export_dataset
+from session_ingest import INGEST_SETTLE_SECONDS
+from snapshot_store import SnapshotReader, write_snapshot
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class StreamingETLPipeline:
+    # Operations per unordered bulk_write batch for derived-data writes
+    write_chunk_size = 1000
+    
+    # Generated dataset size and the bounded load pipeline that inserts it
+    session_count = 50000
+    rating_count = 20000
+    load_batch_size = 5000
+    load_writers = 4
+    load_queue_depth = 8
+    
+    # Transform engines: single-node Mongo aggregations, or Spark over a Parquet export
+    engines = ('mongo', 'spark')
+    
+    # Sessions posted to the API may commit up to this long after their created_at
+    ingest_settle_seconds = INGEST_SETTLE_SECONDS
+    
     def __init__(self, mongo_url, db_name):
+        self.mongo_url = mongo_url
+        self.db_name = db_name
         self.client = AsyncIOMotorClient(mongo_url)
         self.db = self.client[db_name]
+        # Timings and row counts of the stages run so far, stored in etl_state for /metrics
+        self.stages = []
+        self._active_stages = []
         self.generator = StreamingDataGenerator()
     
+    @asynccontextmanager
+    async def stage(self, name):
+        """Time a pipeline stage; rows counted while it runs are attributed to it (innermost stage wins)"""
+        record = {'stage': name, 'seconds': 0.0, 'rows': None}
+        self.stages.append(record)
+        self._active_stages.append(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - started, 3)
+            self._active_stages.remove(record)
+    
+    def count_rows(self, rows):
+        """Add rows to the stage currently running, if any"""
+        if self._active_stages:
+            record = self._active_stages[-1]
+            record['rows'] = (record['rows'] or 0) + rows
+    
+    async def write_chunked(self, collection, operations, label):
+        """bulk_write_chunked with the pipeline's chunk size, counting the rows towards the current stage"""
+        stats = await bulk_write_chunked(collection, operations, chunk_size=self.write_chunk_size, label=label)
+        self.count_rows(stats['operations'])
+        return stats
+    
     async def create_indexes(self):
         """Create indexes for optimization (simulating Snowflake clustering)"""
         logger.info("Creating indexes for performance optimization...")
@@ -32,11 +92,15 @@ class StreamingETLPipeline:
         await self.db.users.create_index('is_active')
         
         # Viewing sessions indexes (partitioning simulation)
+        await self.db.viewing_sessions.create_index('id', unique=True)
         await self.db.viewing_sessions.create_index([('start_time', -1)])
+        await self.db.viewing_sessions.create_index('day')
+        await self.db.viewing_sessions.create_index([('created_at', -1)])
         await self.db.viewing_sessions.create_index('user_id')
         await self.db.viewing_sessions.create_index('movie_id')
-        await self.db.viewing_sessions.create_index('device_type')
-        await self.db.viewing_sessions.create_index('user_country')
+        # Equality filter first, then the time range, for filtered analytics queries
+        await self.db.viewing_sessions.create_index([('device_type', 1), ('start_time', -1)])
+        await self.db.viewing_sessions.create_index([('user_country', 1), ('start_time', -1)])
         await self.db.viewing_sessions.create_index([('movie_id', 1), ('start_time', -1)])
         
         # Ratings indexes
@@ -44,6 +108,28 @@ class StreamingETLPipeline:
         await self.db.ratings.create_index('user_id')
         await self.db.ratings.create_index([('rating_date', -1)])
         
+        # Log files already ingested, keyed by content fingerprint
+        await self.db.ingested_files.create_index('id', unique=True)
+        
+        # Aggregate tables ($merge targets need a unique key)
+        await self.db.daily_analytics.create_index('id', unique=True)
+        await self.db.genre_analytics.create_index('id', unique=True)
+        
+        # Rollup cube (one document per dimension combination)
+        await self.db.session_rollup.create_index('id', unique=True)
+        await self.db.session_rollup.create_index([('hour_start', -1)])
+        await self.db.session_rollup.create_index([('device_type', 1), ('hour_start', -1)])
+        await self.db.session_rollup.create_index([('user_country', 1), ('hour_start', -1)])
+        
+        # Distinct-user sketches (one per day, genre and country)
+        await self.db.user_sketches.create_index('id', unique=True)
+        await self.db.user_sketches.create_index('day')
+        await self.db.user_sketches.create_index('genre')
+        await self.db.user_sketches.create_index('country')
+        
+        # ETL state (run metadata and watermarks keyed by id)
+        await self.db.etl_state.create_index('id', unique=True)
+        
         logger.info("Indexes created successfully")
     
     async def extract_and_load_data(self):
@@ -60,173 +146,719 @@ class StreamingETLPipeline:
         logger.info("Generating movies...")
         movies = self.generator.generate_movies(200)
         await self.db.movies.insert_many(movies)
+        self.count_rows(len(movies))
         logger.info(f"Loaded {len(movies)} movies")
         
         logger.info("Generating users...")
         users = self.generator.generate_users(5000)
         await self.db.users.insert_many(users)
+        self.count_rows(len(users))
         logger.info(f"Loaded {len(users)} users")
         
-        logger.info("Generating viewing sessions...")
-        sessions = self.generator.generate_viewing_sessions(50000)
-        # Batch insert for performance
-        batch_size = 5000
-        for i in range(0, len(sessions), batch_size):
-            await self.db.viewing_sessions.insert_many(sessions[i:i+batch_size])
-        logger.info(f"Loaded {len(sessions)} viewing sessions")
-        
-        logger.info("Generating ratings...")
-        ratings = self.generator.generate_ratings(20000)
-        for i in range(0, len(ratings), batch_size):
-            await self.db.ratings.insert_many(ratings[i:i+batch_size])
-        logger.info(f"Loaded {len(ratings)} ratings")
-    
-    async def transform_and_aggregate(self):
-        """Transform phase - Create aggregated analytics (ELT approach)"""
-        logger.info("Starting Transform phase - Creating analytics...")
-        
-        # 1. Update movie view counts
+        # Facts are generated batch by batch and streamed through concurrent
+        # unordered writers, so memory stays flat however many rows are loaded
+        logger.info("Generating and loading viewing sessions...")
+        sessions = await self.load_batches(
+            self.db.viewing_sessions,
+            self.generator.iter_viewing_sessions(self.session_count, chunk_size=self.load_batch_size)
+        )
+        logger.info(f"Loaded {sessions['inserted']} viewing sessions")
+        
+        logger.info("Generating and loading ratings...")
+        ratings = await self.load_batches(
+            self.db.ratings,
+            self.generator.iter_ratings(self.rating_count, chunk_size=self.load_batch_size)
+        )
+        logger.info(f"Loaded {ratings['inserted']} ratings")
+    
+    async def ingest_session_logs(self, directory, workers=None):
+        """Extract sessions from a directory of NDJSON/CSV log files instead of the generator"""
+        logger.info(f"Starting ETL Pipeline - ingesting session logs from {directory}...")
+        totals = await ingest_directory(self.db, directory, self.mongo_url, self.db_name, workers=workers)
+        self.count_rows(totals['records'])
+        return totals
+    
+    async def load_batches(self, collection, batches):
+        """Insert generated batches through the bounded producer/consumer load pipeline"""
+        stats = await insert_batches(
+            collection, batches, writers=self.load_writers, queue_depth=self.load_queue_depth
+        )
+        self.count_rows(stats['inserted'])
+        return stats
+    
+    async def migrate_session_timestamps(self):
+        """Convert legacy ISO-string session timestamps to BSON dates with hour/day buckets"""
+        logger.info("Migrating viewing session timestamps...")
+        
+        result = await self.db.viewing_sessions.update_many(
+            {'start_time': {'$type': 'string'}},
+            [
+                {'$set': {
+                    'start_time': {'$toDate': '$start_time'},
+                    'end_time': {'$toDate': '$end_time'},
+                    'created_at': {'$toDate': '$created_at'}
+                }},
+                {'$set': {
+                    'hour_of_day': {'$hour': '$start_time'},
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$start_time'}}
+                }}
+            ]
+        )
+        logger.info(f"Migrated {result.modified_count} viewing sessions")
+        self.count_rows(result.modified_count)
+    
+    async def get_transform_window(self, incremental=False):
+        """Return the session filter for this transform run, its low- and new high-water marks
+
+        All three are None when there are no sessions to transform.
+        """
+        latest = await self.db.viewing_sessions.find_one(
+            {'created_at': {'$ne': None}}, {'_id': 0, 'created_at': 1}, sort=[('created_at', -1)]
+        )
+        if latest is None:
+            return None, None, None
+        high_water = latest['created_at']
+        
+        # Sessions stamped before high_water may still be committing (the API's
+        # write-behind writers commit out of order): wait until they have settled,
+        # or the watermark would move past them for good
+        unsettled = (high_water - datetime.utcnow()).total_seconds() + self.ingest_settle_seconds
+        if unsettled > 0:
+            wait = min(unsettled, self.ingest_settle_seconds)
+            logger.info(f"Waiting {wait:.1f}s for sessions still being written to settle")
+            await asyncio.sleep(wait)
+        
+        low_water = None
+        if incremental:
+            state = await self.db.etl_state.find_one({'id': 'transform_watermark'})
+            low_water = state['created_at'] if state else None
+            if low_water is None:
+                logger.info("No transform watermark recorded yet, running a full transform")
+        
+        if low_water is None:
+            return {'created_at': {'$lte': high_water}}, None, high_water
+        return {'created_at': {'$gt': low_water, '$lte': high_water}}, low_water, high_water
+    
+    async def save_transform_watermark(self, high_water):
+        """Record the created_at high-water mark of the last committed transform"""
+        await self.db.etl_state.update_one(
+            {'id': 'transform_watermark'},
+            {'$set': {'created_at': high_water, 'updated_at': datetime.utcnow().isoformat()}},
+            upsert=True
+        )
+    
+    @classmethod
+    def check_engine(cls, engine):
+        """Raise if engine is not a transform engine or its dependencies are not installed"""
+        if engine not in cls.engines:
+            raise ValueError(f"Unknown transform engine {engine!r} (expected one of {', '.join(cls.engines)})")
+        if engine == 'spark' and importlib.util.find_spec('pyspark') is None:
+            raise RuntimeError("The Spark transform engine needs pyspark (and Java): pyspark is not installed")
+    
+    async def transform_and_aggregate(self, incremental=False, engine='mongo'):
+        """Transform phase - Create aggregated analytics (ELT approach)
+        
+        With incremental=True only sessions created after the stored watermark
+        are aggregated and merged into the existing analytics collections.
+        engine='spark' computes the aggregate collections with Spark instead;
+        it always recomputes them in full.
+        """
+        self.check_engine(engine)
+        logger.info(f"Starting Transform phase - Creating analytics ({engine} engine)...")
+        
+        if engine == 'spark' and incremental:
+            logger.info("The Spark engine recomputes every aggregate, running a full transform")
+            incremental = False
+        
+        window, low_water, high_water = await self.get_transform_window(incremental)
+        if high_water is None or (low_water is not None and high_water <= low_water):
+            logger.info("No new viewing sessions since the last transform")
+            return
+        incremental = low_water is not None
+        run_id = str(uuid.uuid4())
+        # Sessions this run aggregates, reported as the rows of the enclosing stage
+        self.count_rows(await self.db.viewing_sessions.count_documents(window))
+        
+        if engine == 'spark':
+            # 1, 3, 4, 5. Movie statistics and the aggregate collections, computed by Spark
+            async with self.stage('spark_aggregates'):
+                await self.spark_transform(high_water, run_id)
+            
+            # 2. Distinct-user sketches backing every unique_users figure
+            async with self.stage('user_sketches'):
+                days, genres = await self.build_user_sketches(window, incremental, run_id)
+        else:
+            # 1. Update movie view counts
+            async with self.stage('movie_statistics'):
+                await self.update_movie_statistics(window, incremental)
+            
+            # 2. Distinct-user sketches backing every unique_users figure
+            async with self.stage('user_sketches'):
+                days, genres = await self.build_user_sketches(window, incremental, run_id)
+            
+            # 3. Create daily analytics cache
+            async with self.stage('daily_analytics'):
+                await self.create_daily_analytics(window, incremental, run_id)
+            
+            # 4. Create genre analytics
+            async with self.stage('genre_analytics'):
+                await self.create_genre_analytics(window, incremental, run_id)
+            
+            # 5. Rollup cube re-grouped by the analytics endpoints
+            async with self.stage('session_rollup'):
+                await self.build_session_rollup(window, incremental, run_id)
+        
+        async with self.stage('unique_user_counts'):
+            await self.apply_unique_user_counts(self.db.daily_analytics, 'day', days)
+            await self.apply_unique_user_counts(self.db.genre_analytics, 'genre', genres)
+        
+        # 6. Record dashboard counters for the API's fast metrics mode
+        async with self.stage('dashboard_metrics'):
+            await self.record_dashboard_metrics()
+        
+        # 7. Commit the watermark and publish the new data version so API
+        #    response caches are invalidated
+        await self.save_transform_watermark(high_water)
+        await self.bump_data_version()
+        
+        logger.info("Transform phase completed")
+    
+    async def spark_transform(self, high_water, run_id):
+        """Compute movie statistics and the aggregate collections with Spark
+        
+        The collections are exported to a staging Parquet dataset that Spark
+        reads in parallel; the results are written back with bulk upserts and
+        documents of earlier runs are removed, as in a full Mongo transform.
+        """
+        # Only the Spark engine needs pyspark (and a JVM)
+        from spark_processor import SparkStreamingProcessor
+        
+        with tempfile.TemporaryDirectory(prefix='etl-spark-') as staging:
+            await export_dataset(self.db, Path(staging), tables=('movies', 'sessions'))
+            processor = await asyncio.to_thread(SparkStreamingProcessor, staging)
+            try:
+                results = await asyncio.to_thread(processor.compute_transform_aggregates, high_water)
+            finally:
+                await asyncio.to_thread(processor.close)
+        await self.write_spark_aggregates(results, run_id)
+    
+    async def write_spark_aggregates(self, results, run_id):
+        """Bulk-write the Spark engine's results; all collections are written concurrently"""
+        created_at = datetime.utcnow()
+        
+        def movie_updates():
+            for doc in results['movie_statistics']:
+                yield UpdateOne({'id': doc.pop('id')}, {'$set': doc})
+        
+        def analytics_upserts(collection):
+            # $set keeps unique_users until apply_unique_user_counts refreshes it
+            for doc in results[collection]:
+                yield UpdateOne({'id': doc['id']}, {'$set': {**doc, 'run_id': run_id, 'created_at': created_at}}, upsert=True)
+        
+        def rollup_replacements():
+            for doc in results['session_rollup']:
+                yield ReplaceOne({'id': doc['id']}, {**doc, 'run_id': run_id}, upsert=True)
+        
+        writes = {
+            self.db.movies: movie_updates(),
+            self.db.daily_analytics: analytics_upserts('daily_analytics'),
+            self.db.genre_analytics: analytics_upserts('genre_analytics'),
+            self.db.session_rollup: rollup_replacements()
+        }
+        await asyncio.gather(*(
+            self.write_chunked(collection, operations, label=f"Spark {collection.name}")
+            for collection, operations in writes.items()
+        ))
+        await asyncio.gather(*(
+            collection.delete_many({'run_id': {'$ne': run_id}})
+            for collection in (self.db.daily_analytics, self.db.genre_analytics, self.db.session_rollup)
+        ))
+        logger.info("Spark aggregates written")
+    
+    async def update_movie_statistics(self, window, incremental=False):
+        """Write per-movie view, completion and watch time totals onto movies"""
         pipeline = [
+            {'$match': window},
             {'$group': {
                 '_id': '$movie_id',
                 'total_views': {'$sum': 1},
-                'avg_completion_rate': {'$avg': '$completion_rate'},
+                'completion_sum': {'$sum': '$completion_rate'},
                 'total_watch_time': {'$sum': '$watch_duration_minutes'}
             }}
         ]
         
-        async for result in self.db.viewing_sessions.aggregate(pipeline):
-            await self.db.movies.update_one(
-                {'id': result['_id']},
+        async def updates():
+            async for result in self.db.viewing_sessions.aggregate(pipeline):
+                if incremental:
+                    # Add the new sessions to the stored totals
+                    update = [
+                        {'$set': {
+                            'total_views': {'$add': [{'$ifNull': ['$total_views', 0]}, result['total_views']]},
+                            'completion_sum': {'$add': [{'$ifNull': ['$completion_sum', 0]}, result['completion_sum']]},
+                            'total_watch_time_minutes': {'$add': [
+                                {'$ifNull': ['$total_watch_time_minutes', 0]}, result['total_watch_time']
+                            ]}
+                        }},
+                        {'$set': {
+                            'avg_completion_rate': {'$round': [{'$divide': ['$completion_sum', '$total_views']}, 2]}
+                        }}
+                    ]
+                else:
+                    update = {'$set': {
+                        'total_views': result['total_views'],
+                        'completion_sum': result['completion_sum'],
+                        'avg_completion_rate': round(result['completion_sum'] / result['total_views'], 2),
+                        'total_watch_time_minutes': result['total_watch_time']
+                    }}
+                yield UpdateOne({'id': result['_id']}, update)
+        
+        await self.write_chunked(
+            self.db.movies, updates(), label="Movie statistics"
+        )
+        logger.info("Movie statistics updated")
+    
+    async def build_user_sketches(self, window, incremental=False, run_id=None):
+        """Build HyperLogLog distinct-user sketches per (day, genre, country)
+        
+        Sketches are fixed-size and mergeable, so distinct users for any date
+        range or dimension combination are answered by merging sketches rather
+        than by collecting user ids with $addToSet. Returns the touched days and
+        genres.
+        """
+        logger.info("Building distinct-user sketches...")
+        run_id = run_id or str(uuid.uuid4())
+        
+        genres = {}
+        async for movie in self.db.movies.find({}, {'_id': 0, 'id': 1, 'genre': 1}):
+            genres[movie['id']] = movie['genre']
+        
+        users_by_key = {}
+        sketches = {}
+        
+        def flush_users():
+            for key, user_ids in users_by_key.items():
+                sketches.setdefault(key, HyperLogLog()).update(user_ids)
+            users_by_key.clear()
+        
+        buffered = 0
+        projection = {'_id': 0, 'day': 1, 'movie_id': 1, 'user_country': 1, 'user_id': 1}
+        async for session in self.db.viewing_sessions.find(window, projection, batch_size=10000):
+            genre = genres.get(session['movie_id'])
+            if genre is None:
+                continue
+            key = (session['day'], genre, session['user_country'])
+            users_by_key.setdefault(key, []).append(session['user_id'])
+            buffered += 1
+            if buffered >= 50000:
+                flush_users()
+                buffered = 0
+        flush_users()
+        
+        ids = {key: '|'.join(key) for key in sketches}
+        if incremental and sketches:
+            # Fold the new users into the stored sketches
+            stored = {}
+            async for doc in self.db.user_sketches.find(
+                {'id': {'$in': list(ids.values())}}, {'_id': 0, 'id': 1, 'registers': 1, 'precision': 1}
+            ):
+                stored[doc['id']] = HyperLogLog.from_binary(doc['registers'], doc['precision'])
+            for key, sketch in sketches.items():
+                if ids[key] in stored:
+                    sketch.merge(stored[ids[key]])
+        
+        operations = (
+            UpdateOne(
+                {'id': ids[key]},
                 {'$set': {
-                    'total_views': result['total_views'],
-                    'avg_completion_rate': round(result['avg_completion_rate'], 2),
-                    'total_watch_time_minutes': result['total_watch_time']
-                }}
+                    'day': key[0],
+                    'genre': key[1],
+                    'country': key[2],
+                    'precision': sketch.precision,
+                    'registers': sketch.to_binary(),
+                    'run_id': run_id,
+                    'updated_at': datetime.utcnow().isoformat()
+                }},
+                upsert=True
             )
+            for key, sketch in sketches.items()
+        )
+        await self.write_chunked(
+            self.db.user_sketches, operations, label="User sketches"
+        )
+        if not incremental:
+            await self.db.user_sketches.delete_many({'run_id': {'$ne': run_id}})
         
-        logger.info("Movie statistics updated")
+        return sorted({key[0] for key in sketches}), sorted({key[1] for key in sketches})
+    
+    async def apply_unique_user_counts(self, collection, field, keys):
+        """Set unique_users on aggregate docs (id == key) from the merged sketches of field"""
+        merged = await merge_sketches_by(self.db.user_sketches, {field: {'$in': keys}}, field)
+        operations = [
+            UpdateOne(
+                {'id': key},
+                {'$set': {'unique_users': sketch.count(), 'unique_users_approximate': True}}
+            )
+            for key, sketch in merged.items()
+        ]
+        await self.write_chunked(
+            collection, operations, label=f"{collection.name} unique users"
+        )
+    
+    async def build_session_rollup(self, window, incremental=False, run_id=None):
+        """Materialize the session_rollup cube
         
-        # 2. Create daily analytics cache
-        await self.create_daily_analytics()
+        One document per (hour, genre, device_type, user_country,
+        subscription_type, quality) holding additive measures, so every
+        analytics panel can be answered by re-grouping the cube. Its size is
+        bounded by the number of dimension combinations, not session volume.
+        Incremental runs add the window's measures onto the matching cells.
+        """
+        logger.info("Building session rollup cube...")
+        run_id = run_id or str(uuid.uuid4())
         
-        # 3. Create genre analytics
-        await self.create_genre_analytics()
+        dimensions = ['device_type', 'user_country', 'subscription_type', 'quality']
+        measures = ['session_count', 'watch_minutes', 'completion_sum', 'buffering_sum']
+        pipeline = [
+            {'$match': window},
+            # Group with movie_id first, then join the grouped rows to movies for the genre
+            {'$group': {
+                '_id': {
+                    'hour_start': {'$subtract': [
+                        '$start_time', {'$mod': [{'$toLong': '$start_time'}, 3600000]}
+                    ]},
+                    'movie_id': '$movie_id',
+                    **{dim: f'${dim}' for dim in dimensions}
+                },
+                'session_count': {'$sum': 1},
+                'watch_minutes': {'$sum': '$watch_duration_minutes'},
+                'completion_sum': {'$sum': '$completion_rate'},
+                'buffering_sum': {'$sum': {'$ifNull': ['$buffering_count', 0]}}
+            }},
+            {'$lookup': {
+                'from': 'movies',
+                'localField': '_id.movie_id',
+                'foreignField': 'id',
+                'as': 'movie_info'
+            }},
+            {'$unwind': '$movie_info'},
+            {'$group': {
+                '_id': {
+                    'hour_start': '$_id.hour_start',
+                    'genre': '$movie_info.genre',
+                    **{dim: f'$_id.{dim}' for dim in dimensions}
+                },
+                **{measure: {'$sum': f'${measure}'} for measure in measures}
+            }},
+            {'$project': {
+                '_id': 0,
+                'id': {'$concat': [
+                    {'$dateToString': {'format': '%Y-%m-%dT%H', 'date': '$_id.hour_start'}},
+                    '|', {'$ifNull': ['$_id.genre', '']},
+                    *[part for dim in dimensions for part in ('|', {'$ifNull': [{'$toString': f'$_id.{dim}'}, '']})]
+                ]},
+                'hour_start': '$_id.hour_start',
+                'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$_id.hour_start'}},
+                'hour_of_day': {'$hour': '$_id.hour_start'},
+                'genre': '$_id.genre',
+                **{dim: f'$_id.{dim}' for dim in dimensions},
+                **{measure: 1 for measure in measures},
+                'run_id': {'$literal': run_id}
+            }}
+        ]
         
-        logger.info("Transform phase completed")
+        if incremental:
+            when_matched = [{'$set': {
+                **{measure: {'$add': [f'${measure}', f'$$new.{measure}']} for measure in measures},
+                'run_id': '$$new.run_id'
+            }}]
+        else:
+            when_matched = 'replace'
+        pipeline.append({'$merge': {
+            'into': 'session_rollup',
+            'on': 'id',
+            'whenMatched': when_matched,
+            'whenNotMatched': 'insert'
+        }})
+        await self.db.viewing_sessions.aggregate(pipeline, allowDiskUse=True).to_list(None)
+        
+        if not incremental:
+            await self.db.session_rollup.delete_many({'run_id': {'$ne': run_id}})
+        
+        logger.info(f"Session rollup refreshed ({'incremental' if incremental else 'full'})")
     
-    async def create_daily_analytics(self):
-        """Create daily aggregated analytics for dashboard performance"""
+    async def create_daily_analytics(self, window=None, incremental=False, run_id=None):
+        """Create daily aggregated analytics for dashboard performance
+        
+        Days are recomputed and $merge'd in place, so readers keep seeing the
+        previous snapshot of a day until its new document is written. In
+        incremental mode only the days touched by new sessions are recomputed.
+        unique_users is filled in from the user sketches afterwards.
+        """
         logger.info("Creating daily analytics cache...")
+        run_id = run_id or str(uuid.uuid4())
         
-        # Clear existing cache
-        await self.db.daily_analytics.delete_many({})
+        # Sessions past this run's high-water mark are left to the next run, as
+        # in the movie and genre stages. Touched days are recomputed whole, so
+        # an incremental run keeps the window's upper bound only.
+        match = {'created_at': {'$lte': window['created_at']['$lte']}} if window else {}
+        if incremental:
+            days = await self.db.viewing_sessions.distinct('day', window)
+            match['day'] = {'$in': days}
         
-        # Aggregate by date
+        # Aggregate by the precomputed day bucket
         pipeline = [
-            {'$addFields': {
-                'date': {'$dateFromString': {'dateString': '$start_time'}}
-            }},
+            {'$match': match},
             {'$group': {
-                '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+                '_id': '$day',
                 'total_views': {'$sum': 1},
-                'unique_users': {'$addToSet': '$user_id'},
                 'total_watch_time': {'$sum': '$watch_duration_minutes'},
-                'avg_completion_rate': {'$avg': '$completion_rate'},
-                'device_breakdown': {'$push': '$device_type'}
+                'avg_completion_rate': {'$avg': '$completion_rate'}
             }},
             {'$project': {
+                '_id': 0,
+                'id': '$_id',
                 'date': '$_id',
                 'total_views': 1,
-                'unique_users': {'$size': '$unique_users'},
                 'total_watch_time': 1,
-                'avg_completion_rate': 1,
-                'device_breakdown': 1
+                'avg_completion_rate': {'$round': ['$avg_completion_rate', 2]},
+                'run_id': {'$literal': run_id},
+                'created_at': '$$NOW'
             }},
-            {'$sort': {'_id': 1}}
+            {'$merge': {
+                'into': 'daily_analytics',
+                'on': 'id',
+                'whenMatched': 'merge',
+                'whenNotMatched': 'insert'
+            }}
         ]
+        await self.db.viewing_sessions.aggregate(pipeline).to_list(None)
         
-        results = []
-        async for doc in self.db.viewing_sessions.aggregate(pipeline):
-            results.append({
-                'id': doc['_id'],
-                'date': doc['_id'],
-                'total_views': doc['total_views'],
-                'unique_users': doc['unique_users'],
-                'total_watch_time': doc['total_watch_time'],
-                'avg_completion_rate': round(doc.get('avg_completion_rate', 0), 2),
-                'created_at': datetime.utcnow().isoformat()
-            })
-        
-        if results:
-            await self.db.daily_analytics.insert_many(results)
-            logger.info(f"Created {len(results)} daily analytics records")
-    
-    async def create_genre_analytics(self):
-        """Create genre performance analytics"""
-        logger.info("Creating genre analytics...")
+        if not incremental:
+            # Drop days that no longer have any sessions
+            await self.db.daily_analytics.delete_many({'run_id': {'$ne': run_id}})
         
-        # Clear existing
-        await self.db.genre_analytics.delete_many({})
+        logger.info(f"Daily analytics refreshed ({'incremental' if incremental else 'full'})")
+    
+    async def create_genre_analytics(self, window=None, incremental=False, run_id=None):
+        """Create genre performance analytics
         
-        # Aggregate by genre
+        A full run rebuilds every genre with $merge. An incremental run
+        aggregates only sessions in the window and adds them to the stored
+        totals. unique_users is filled in from the user sketches afterwards.
+        """
+        logger.info("Creating genre analytics...")
+        run_id = run_id or str(uuid.uuid4())
+        
+        # Aggregate by movie first, then join the (small) per-movie result
+        # with movies and roll it up by genre
         pipeline = [
+            {'$match': window or {}},
+            {'$group': {
+                '_id': '$movie_id',
+                'total_views': {'$sum': 1},
+                'total_watch_time': {'$sum': '$watch_duration_minutes'},
+                'completion_sum': {'$sum': '$completion_rate'}
+            }},
             {'$lookup': {
                 'from': 'movies',
-                'localField': 'movie_id',
+                'localField': '_id',
                 'foreignField': 'id',
                 'as': 'movie_info'
             }},
             {'$unwind': '$movie_info'},
             {'$group': {
                 '_id': '$movie_info.genre',
-                'total_views': {'$sum': 1},
-                'avg_watch_time': {'$avg': '$watch_duration_minutes'},
-                'avg_completion_rate': {'$avg': '$completion_rate'},
-                'unique_users': {'$addToSet': '$user_id'}
+                'total_views': {'$sum': '$total_views'},
+                'total_watch_time': {'$sum': '$total_watch_time'},
+                'completion_sum': {'$sum': '$completion_sum'}
             }},
             {'$project': {
+                '_id': 0,
+                'id': '$_id',
                 'genre': '$_id',
                 'total_views': 1,
-                'avg_watch_time': {'$round': ['$avg_watch_time', 2]},
-                'avg_completion_rate': {'$round': ['$avg_completion_rate', 2]},
-                'unique_users': {'$size': '$unique_users'}
-            }},
-            {'$sort': {'total_views': -1}}
+                'total_watch_time': 1,
+                'completion_sum': 1
+            }}
         ]
         
-        results = []
+        if not incremental:
+            pipeline += [
+                {'$set': {
+                    'avg_watch_time': {'$round': [{'$divide': ['$total_watch_time', '$total_views']}, 2]},
+                    'avg_completion_rate': {'$round': [{'$divide': ['$completion_sum', '$total_views']}, 2]},
+                    'run_id': {'$literal': run_id},
+                    'created_at': '$$NOW'
+                }},
+                {'$merge': {
+                    'into': 'genre_analytics',
+                    'on': 'id',
+                    'whenMatched': 'merge',
+                    'whenNotMatched': 'insert'
+                }}
+            ]
+            await self.db.viewing_sessions.aggregate(pipeline).to_list(None)
+            await self.db.genre_analytics.delete_many({'run_id': {'$ne': run_id}})
+            logger.info("Genre analytics rebuilt")
+            return
+        
+        operations = []
         async for doc in self.db.viewing_sessions.aggregate(pipeline):
-            results.append({
-                'id': doc['_id'],
-                'genre': doc['_id'],
-                'total_views': doc['total_views'],
-                'avg_watch_time': doc['avg_watch_time'],
-                'avg_completion_rate': doc['avg_completion_rate'],
-                'unique_users': doc['unique_users'],
-                'created_at': datetime.utcnow().isoformat()
-            })
-        
-        if results:
-            await self.db.genre_analytics.insert_many(results)
-            logger.info(f"Created {len(results)} genre analytics records")
-    
-    async def run_full_pipeline(self):
-        """Run complete ETL pipeline"""
+            operations.append(UpdateOne({'id': doc['id']}, [
+                {'$set': {
+                    'genre': doc['genre'],
+                    'total_views': {'$add': [{'$ifNull': ['$total_views', 0]}, doc['total_views']]},
+                    'total_watch_time': {'$add': [{'$ifNull': ['$total_watch_time', 0]}, doc['total_watch_time']]},
+                    'completion_sum': {'$add': [{'$ifNull': ['$completion_sum', 0]}, doc['completion_sum']]},
+                    'run_id': {'$literal': run_id},
+                    'created_at': '$$NOW'
+                }},
+                {'$set': {
+                    'avg_watch_time': {'$round': [{'$divide': ['$total_watch_time', '$total_views']}, 2]},
+                    'avg_completion_rate': {'$round': [{'$divide': ['$completion_sum', '$total_views']}, 2]}
+                }}
+            ], upsert=True))
+        
+        await self.write_chunked(
+            self.db.genre_analytics, operations, label="Genre analytics"
+        )
+        logger.info(f"Merged new sessions into {len(operations)} genre analytics records")
+    
+    async def record_dashboard_metrics(self):
+        """Store the counters behind the dashboard metric cards in etl_state"""
+        logger.info("Recording dashboard metrics...")
+        
+        user_pipeline = [
+            {'$facet': {
+                'active_users': [{'$match': {'is_active': True}}, {'$count': 'count'}],
+                'premium_subscribers': [{'$match': {'subscription_type': 'Premium'}}, {'$count': 'count'}]
+            }}
+        ]
+        session_pipeline = [
+            {'$group': {
+                '_id': None,
+                'total_watch_time': {'$sum': '$watch_duration_minutes'},
+                'avg_completion_rate': {'$avg': '$completion_rate'}
+            }}
+        ]
+        user_stats, watch_stats = await asyncio.gather(
+            self.db.users.aggregate(user_pipeline).to_list(1),
+            self.db.viewing_sessions.aggregate(session_pipeline).to_list(1)
+        )
+        user_stats = user_stats[0] if user_stats else {}
+        watch_stats = watch_stats[0] if watch_stats else {}
+        
+        def facet_count(name):
+            return user_stats[name][0]['count'] if user_stats.get(name) else 0
+        
+        await self.db.etl_state.update_one(
+            {'id': 'dashboard_metrics'},
+            {'$set': {
+                'active_users': facet_count('active_users'),
+                'premium_subscribers': facet_count('premium_subscribers'),
+                'total_watch_time': watch_stats.get('total_watch_time', 0),
+                'avg_completion_rate': watch_stats.get('avg_completion_rate') or 0,
+                'updated_at': datetime.utcnow().isoformat()
+            }},
+            upsert=True
+        )
+        logger.info("Dashboard metrics recorded")
+    
+    async def bump_data_version(self):
+        """Increment the analytics data version read by the API response cache"""
+        state = await self.db.etl_state.find_one_and_update(
+            {'id': 'data_version'},
+            {'$inc': {'version': 1}, '$set': {'updated_at': datetime.utcnow().isoformat()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        logger.info(f"Analytics data version is now {state['version']}")
+        return state['version']
+    
+    async def publish_snapshot(self, directory):
+        """Write the session columns and their aggregate tables as a memory-mapped snapshot
+        
+        The API workers map the snapshot read-only. It is built on top of the
+        previous one, so only sessions created since are read from MongoDB.
+        """
+        logger.info(f"Publishing analytics snapshot to {directory}...")
+        state = await self.db.etl_state.find_one({'id': 'data_version'})
+        version = state.get('version', 0) if state else 0
+        
+        reader = SnapshotReader(directory)
+        previous = reader.latest()
+        if previous is not None:
+            if previous.version == version:
+                logger.info(f"Snapshot v{version} is already current")
+                return
+            if await self.db.viewing_sessions.estimated_document_count() < previous.meta['rows']:
+                # Sessions were removed since: rebuild from the collection alone
+                reader = None
+        
+        engine = ColumnarEngine(self.db.viewing_sessions, snapshots=reader)
+        await engine.refresh()
+        arrays, strings, meta = await asyncio.to_thread(engine.to_snapshot)
+        await asyncio.to_thread(write_snapshot, directory, version, arrays, strings, meta)
+        self.count_rows(meta['rows'])
+    
+    async def save_run_stats(self, status, started_at):
+        """Store this run's stage timings and row counts in etl_state, where the API's /metrics reads them"""
+        await self.db.etl_state.update_one(
+            {'id': 'etl_run'},
+            {'$set': {
+                'status': status,
+                'started_at': started_at.isoformat(),
+                'finished_at': datetime.utcnow().isoformat(),
+                'stages': self.stages
+            }},
+            upsert=True
+        )
+    
+    async def run_full_pipeline(self, incremental=False, log_dir=None, engine='mongo', snapshot_dir=None):
+        """Run complete ETL pipeline (extracting from log files when log_dir is given)
+        
+        engine selects the transform engine: 'mongo' or 'spark'. With
+        snapshot_dir, the final stage publishes a snapshot for the API workers.
+        Every stage is timed; the timings are saved in etl_state, failed runs included.
+        """
         logger.info("=" * 50)
         logger.info("STARTING FULL ETL/ELT PIPELINE")
         logger.info("=" * 50)
         
+        self.stages = []
+        started_at = datetime.utcnow()
+        status = 'failed'
         try:
+            # Fail before extracting anything if the transform engine cannot run
+            self.check_engine(engine)
+            
             # Extract & Load
-            await self.extract_and_load_data()
+            async with self.stage('extract'):
+                if log_dir:
+                    # The unique session id index must exist before upserting log records
+                    await self.create_indexes()
+                    await self.ingest_session_logs(log_dir)
+                else:
+                    await self.extract_and_load_data()
+            
+            # Upgrade sessions loaded before timestamps were stored as dates
+            async with self.stage('migrate'):
+                await self.migrate_session_timestamps()
             
             # Create indexes (optimization)
-            await self.create_indexes()
+            async with self.stage('indexes'):
+                await self.create_indexes()
             
             # Transform & Aggregate
-            await self.transform_and_aggregate()
+            async with self.stage('transform'):
+                await self.transform_and_aggregate(incremental=incremental, engine=engine)
+            
+            # Publish
+            if snapshot_dir:
+                async with self.stage('publish'):
+                    await self.publish_snapshot(snapshot_dir)
             
+            status = 'success'
             logger.info("=" * 50)
             logger.info("ETL/ELT PIPELINE COMPLETED SUCCESSFULLY")
             logger.info("=" * 50)
@@ -235,15 +867,27 @@ class StreamingETLPipeline:
             logger.error(f"Pipeline failed: {e}")
             raise
         finally:
+            try:
+                await self.save_run_stats(status, started_at)
+            except Exception as e:
+                logger.error(f"Could not save ETL run stats: {e}")
             self.client.close()
 
 
 async def main():
     mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
     db_name = os.environ.get('DB_NAME', 'streaming_analytics')
+    incremental = os.environ.get('ETL_INCREMENTAL', '').lower() in ('1', 'true', 'yes')
     
     pipeline = StreamingETLPipeline(mongo_url, db_name)
-    await pipeline.run_full_pipeline()
+    pipeline.session_count = int(os.environ.get('ETL_SESSION_COUNT', pipeline.session_count))
+    pipeline.rating_count = int(os.environ.get('ETL_RATING_COUNT', pipeline.rating_count))
+    await pipeline.run_full_pipeline(
+        incremental=incremental,
+        log_dir=os.environ.get('ETL_LOG_DIR'),
+        engine=os.environ.get('ETL_ENGINE', 'mongo'),
+        snapshot_dir=os.environ.get('SNAPSHOT_DIR')
+    )
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,196 @@
+"""Pre-encoded JSON responses for trusted analytics results
+
+FastAPI validates an endpoint's return value against its response_model,
+runs it through jsonable_encoder and encodes it with the stdlib json module,
+on every request, cache hit or not. FastJSON.endpoint returns a ready
+Response instead (which FastAPI passes through untouched): rows are only
+projected onto the model's fields, encoded with orjson when it is installed,
+and compressed with brotli or gzip above min_size. The encoded and
+compressed bodies are memoized per result object, so a response cache hit
+costs a dict lookup.
+"""
+import functools
+import gzip
+import inspect
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Name of the Request parameter added to decorated endpoints
+REQUEST_PARAM = 'fast_json_request'
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        # NumPy scalars
+        return value.item()
+    return str(value)
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def project(content, fields):
+    """Keep only a model's fields of every row (rows missing a field are left to the client)"""
+    if isinstance(content, list):
+        return [{field: row[field] for field in fields if field in row} if isinstance(row, dict) else row for row in content]
+    if isinstance(content, dict):
+        return {field: content[field] for field in fields if field in content}
+    return content
+
+
+def accepted_encodings(header: str) -> dict:
+    """Quality of every content coding an Accept-Encoding header lists ('*' included)"""
+    encodings = {}
+    for part in header.split(','):
+        name, *params = part.split(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+def choose_encoding(header: str, available=('br', 'gzip')):
+    """The preferred of the available codings for an Accept-Encoding header, or None for identity.
+
+    Unlisted codings take the quality of '*'. Identity is always the
+    fallback, but only preferred to a compressed coding when the header
+    gives it a higher quality; among equal qualities the order of available
+    wins.
+    """
+    qualities = accepted_encodings(header)
+    wildcard = qualities.get('*')
+
+    def quality(coding):
+        if coding in qualities:
+            return qualities[coding]
+        return wildcard if wildcard is not None else 0.0
+
+    candidates = [coding for coding in available if quality(coding) > 0]
+    if not candidates:
+        return None
+    # max() keeps the first of equal qualities
+    best = max(candidates, key=quality)
+    return best if quality(best) >= quality('identity') else None
+
+
+class EncodedBody:
+    """JSON bytes of one result and its compressed variants, each computed once"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self._compressed = {}
+
+    def compressed(self, encoding: str) -> bytes:
+        body = self._compressed.get(encoding)
+        if body is None:
+            body = brotli.compress(self.body, quality=5) if encoding == 'br' else gzip.compress(self.body, compresslevel=6)
+            self._compressed[encoding] = body
+        return body
+
+
+class FastJSON:
+    """Decorator factory for the fast response path (a no-op unless enabled)"""
+
+    def __init__(self, enabled=False, min_size=1024, max_entries=512):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.max_entries = max_entries
+        self._bodies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, value, fields=None) -> EncodedBody:
+        """Encoded body of value, reused while the same object keeps coming back (e.g. from the response cache)"""
+        entry = self._bodies.get(id(value))
+        if entry is not None and entry[0] is value:
+            self._bodies.move_to_end(id(value))
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        body = EncodedBody(dumps(project(value, fields) if fields else value))
+        # The value is kept alive with its body, so its id cannot be reused meanwhile
+        self._bodies[id(value)] = (value, body)
+        while len(self._bodies) > self.max_entries:
+            self._bodies.popitem(last=False)
+        return body
+
+    def response(self, body: EncodedBody, accept_encoding: str) -> Response:
+        if len(body.body) < self.min_size:
+            return Response(body.body, media_type='application/json')
+        headers = {'Vary': 'Accept-Encoding'}
+        encoding = choose_encoding(accept_encoding, ('br', 'gzip') if brotli is not None else ('gzip',))
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            return Response(body.compressed(encoding), media_type='application/json', headers=headers)
+        return Response(body.body, media_type='application/json', headers=headers)
+
+    def endpoint(self, model=None):
+        """Serve an endpoint's result through the fast path.
+
+        model is the response_model (or, for lists, its item model) whose
+        fields the rows are projected onto; the route keeps its
+        response_model for the OpenAPI schema.
+        """
+        fields = tuple(model.model_fields) if model is not None else None
+
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request = kwargs.pop(REQUEST_PARAM)
+                value = await func(*args, **kwargs)
+                if isinstance(value, Response):
+                    return value
+                body = self.encode(value, fields)
+                return self.response(body, request.headers.get('accept-encoding', ''))
+
+            signature = inspect.signature(func)
+            wrapper.__signature__ = signature.replace(parameters=[
+                *signature.parameters.values(),
+                inspect.Parameter(REQUEST_PARAM, inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+            ])
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'encoder': 'orjson' if orjson is not None else 'json',
+            'compression': ['br', 'gzip'] if brotli is not None else ['gzip'],
+            'min_size': self.min_size,
+            'encoded_bodies': len(self._bodies),
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,223 @@
+"""Scale-factor benchmark dataset generator writing partitioned NDJSON/Parquet files
+
+Usage:
+    python generate_dataset.py --scale-factor 10 --format parquet --output /data/sf10
+
+Scale factor 1 matches what the ETL loads (200 movies, 5,000 users, 50,000
+sessions, 20,000 ratings); every table grows linearly with it. The output is
+fully determined by --seed and --end-date, whatever the number of workers.
+
+Layout (Hive-style partitions; the partition column lives in the path only):
+    movies.<ext>, users.<ext>
+    sessions/day=YYYY-MM-DD/part-NNNNN.<ext>
+    ratings/month=YYYY-MM/part-NNNNN.<ext>
+    _manifest.json
+"""
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+
+from data_generator import StreamingDataGenerator
+from dataset_schemas import ARROW_SCHEMAS, PARTITIONS, clear_dataset
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rows per table at scale factor 1
+BASE_ROWS = {'movies': 200, 'users': 5000, 'sessions': 50000, 'ratings': 20000}
+
+# Sessions cover the last SESSION_DAYS days up to and including --end-date
+SESSION_DAYS = 90
+
+# Fields of the dimension rows fact generation needs in each worker
+MOVIE_FIELDS = ('id', 'duration_minutes')
+USER_FIELDS = ('id', 'country', 'subscription_type')
+
+
+class OutputFormat(str, Enum):
+    ndjson = 'ndjson'
+    parquet = 'parquet'
+
+
+def table_rows(scale_factor: float) -> dict:
+    return {table: max(1, int(round(rows * scale_factor))) for table, rows in BASE_ROWS.items()}
+
+
+def task_seed(seed: int, *key: int) -> int:
+    """Independent, reproducible seed for one unit of work"""
+    return int(np.random.SeedSequence([seed, *key]).generate_state(1)[0])
+
+
+def split_evenly(total: int, parts: int) -> list:
+    base, remainder = divmod(total, parts)
+    return [base + (1 if i < remainder else 0) for i in range(parts)]
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def write_rows(rows: list, path: Path, table: str, fmt: OutputFormat):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == OutputFormat.parquet:
+        pq.write_table(pa.Table.from_pylist(rows, schema=ARROW_SCHEMAS[table]), path, compression='snappy')
+    else:
+        with open(path, 'w') as f:
+            for row in rows:
+                f.write(json.dumps(row, default=_json_default))
+                f.write('\n')
+
+
+def write_partitioned(rows: list, table_dir: Path, table: str, partition: str, key, part: int, fmt: OutputFormat) -> int:
+    """Write rows grouped by key(row) under table_dir/<partition>=<value>/; returns files written"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+    for value, group in groups.items():
+        write_rows(group, table_dir / f"{partition}={value}" / f"part-{part:05d}.{fmt.value}", table, fmt)
+    return len(groups)
+
+
+# ========== WORKER TASKS ==========
+# Dimension rows are generated once by the parent and handed to every worker,
+# so all facts reference ids that exist in movies/users.
+
+_movies = None
+_users = None
+
+
+def _init_worker(movies, users):
+    global _movies, _users
+    _movies = movies
+    _users = users
+
+
+def _worker_generator(seed: int, reference_time: datetime, users=None) -> StreamingDataGenerator:
+    generator = StreamingDataGenerator(seed=seed, reference_time=reference_time)
+    generator.movies = _movies
+    generator.users = _users if users is None else users
+    return generator
+
+
+def session_task(seed, day, part, count, period_end, output, fmt):
+    """Sessions starting on one day (one file per task)"""
+    day_end = period_end - timedelta(days=day)
+    generator = _worker_generator(task_seed(seed, 1, day, part), period_end)
+    rows = next(generator.iter_viewing_sessions(count, chunk_size=count, days=1, end_time=day_end))
+    for row in rows:
+        del row['day']
+    day_name = (day_end - timedelta(days=1)).strftime('%Y-%m-%d')
+    write_rows(rows, Path(output) / 'sessions' / f"day={day_name}" / f"part-{part:05d}.{fmt.value}", 'sessions', fmt)
+    return 'sessions', len(rows), 1
+
+
+def rating_task(seed, index, user_start, user_end, count, period_end, output, fmt):
+    """Ratings by one slice of users; slices are disjoint so user-movie pairs stay unique"""
+    generator = _worker_generator(task_seed(seed, 2, index), period_end, users=_users[user_start:user_end])
+    rows = next(generator.iter_ratings(count, chunk_size=count))
+    files = write_partitioned(
+        rows, Path(output) / 'ratings', 'ratings', 'month', lambda row: row['rating_date'][:7], index, fmt
+    )
+    return 'ratings', len(rows), files
+
+
+def plan_tasks(rows: dict, seed: int, period_end: datetime, output: Path, fmt: OutputFormat, rows_per_file: int) -> list:
+    tasks = []
+    for day, day_count in enumerate(split_evenly(rows['sessions'], SESSION_DAYS)):
+        parts = max(1, math.ceil(day_count / rows_per_file))
+        for part, count in enumerate(split_evenly(day_count, parts)):
+            if count:
+                tasks.append((session_task, (seed, day, part, count, period_end, str(output), fmt)))
+
+    slices = max(1, math.ceil(rows['ratings'] / rows_per_file))
+    users_per_slice = math.ceil(rows['users'] / slices)
+    for index, count in enumerate(split_evenly(rows['ratings'], slices)):
+        user_start = index * users_per_slice
+        user_end = min(rows['users'], user_start + users_per_slice)
+        if count and user_end > user_start:
+            count = min(count, (user_end - user_start) * rows['movies'])
+            tasks.append((rating_task, (seed, index, user_start, user_end, count, period_end, str(output), fmt)))
+    return tasks
+
+
+app = typer.Typer(add_completion=False, help="Generate a reproducible, scale-factor sized benchmark dataset")
+
+
+@app.command()
+def generate(
+    scale_factor: float = typer.Option(1.0, "--scale-factor", "-s", min=0.001, help="1 = 200 movies, 5k users, 50k sessions, 20k ratings"),
+    output: Path = typer.Option(Path("dataset"), "--output", "-o", help="Output directory"),
+    fmt: OutputFormat = typer.Option(OutputFormat.parquet, "--format", "-f", help="File format"),
+    workers: int = typer.Option(os.cpu_count() or 1, "--workers", "-w", min=1, help="Worker processes"),
+    seed: int = typer.Option(42, "--seed", help="Random seed"),
+    end_date: Optional[datetime] = typer.Option(None, "--end-date", formats=["%Y-%m-%d"], help="Last day of activity (default: today, UTC)"),
+    rows_per_file: int = typer.Option(500000, "--rows-per-file", min=1000, help="Maximum fact rows per task/file"),
+    overwrite: bool = typer.Option(False, "--overwrite", help="Replace a dataset already in the output directory")
+):
+    """Write movies, users, sessions and ratings as date-partitioned files"""
+    if (output / '_manifest.json').exists() and not overwrite:
+        raise typer.BadParameter(f"{output} already contains a dataset (use --overwrite)", param_hint="--output")
+    output.mkdir(parents=True, exist_ok=True)
+    clear_dataset(output)
+
+    started = time.perf_counter()
+    last_day = (end_date or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    period_end = last_day + timedelta(days=1)
+    rows = table_rows(scale_factor)
+    logger.info(f"Scale factor {scale_factor}: {rows}")
+
+    # Dimensions: one seeded generator, so ids are shared by every fact worker
+    generator = StreamingDataGenerator(seed=seed, reference_time=period_end)
+    movies = generator.generate_movies(rows['movies'])
+    users = generator.generate_users(rows['users'])
+    write_rows(movies, output / f"movies.{fmt.value}", 'movies', fmt)
+    write_rows(users, output / f"users.{fmt.value}", 'users', fmt)
+    logger.info(f"Wrote {len(movies)} movies and {len(users)} users")
+
+    movie_keys = [{field: movie[field] for field in MOVIE_FIELDS} for movie in movies]
+    user_keys = [{field: user[field] for field in USER_FIELDS} for user in users]
+    del movies, users
+
+    written = {'movies': rows['movies'], 'users': rows['users'], 'sessions': 0, 'ratings': 0}
+    files = 2
+    tasks = plan_tasks(rows, seed, period_end, output, fmt, rows_per_file)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(movie_keys, user_keys)) as pool:
+        futures = [pool.submit(task, *args) for task, args in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            table, count, task_files = future.result()
+            written[table] += count
+            files += task_files
+            if done % 50 == 0 or done == len(futures):
+                logger.info(f"{done}/{len(futures)} tasks done")
+
+    elapsed = time.perf_counter() - started
+    manifest = {
+        'scale_factor': scale_factor,
+        'seed': seed,
+        'end_date': last_day.strftime('%Y-%m-%d'),
+        'format': fmt.value,
+        'rows': written,
+        'files': files,
+        'partitioning': PARTITIONS,
+        'seconds': round(elapsed, 1)
+    }
+    (output / '_manifest.json').write_text(json.dumps(manifest, indent=2))
+    logger.info(f"Wrote {sum(written.values())} rows in {files} files to {output} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,109 @@
+"""HyperLogLog sketches for mergeable distinct-user counts"""
+import hashlib
+import math
+import zlib
+
+import numpy as np
+from bson.binary import Binary
+
+# 2^11 registers: ~2.3% standard error, 2KB uncompressed per sketch
+DEFAULT_PRECISION = 11
+
+
+def hash_values(values):
+    """64-bit hashes of the given values as a uint64 array"""
+    values = list(values)
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(str(v).encode(), digest_size=8).digest(), 'big') for v in values),
+        dtype=np.uint64,
+        count=len(values)
+    )
+
+
+def _leading_zeros(words):
+    """Count leading zero bits of each uint64 word"""
+    zeros = np.zeros(words.shape, dtype=np.uint8)
+    shifted = words.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        top_clear = shifted < np.uint64(1 << (64 - shift))
+        zeros[top_clear] += shift
+        shifted[top_clear] <<= np.uint64(shift)
+    zeros[words == 0] = 64
+    return zeros
+
+
+class HyperLogLog:
+    """Fixed-size cardinality sketch; two sketches merge by taking register maxima"""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            registers = np.zeros(self.m, dtype=np.uint8)
+        self.registers = registers
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value):
+        self.update([value])
+
+    def update(self, values):
+        """Add many values at once (hashing is the only per-value Python work)"""
+        hashes = hash_values(values)
+        if not hashes.size:
+            return
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rank = _leading_zeros(hashes << p) + 1
+        np.minimum(rank, 64 - self.precision + 1, out=rank)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_binary(self):
+        return Binary(zlib.compress(self.registers.tobytes()))
+
+    @classmethod
+    def from_binary(cls, data, precision=DEFAULT_PRECISION):
+        registers = np.frombuffer(zlib.decompress(data), dtype=np.uint8).copy()
+        return cls(precision, registers)
+
+
+async def merge_sketches(collection, query):
+    """Merge every stored sketch matching query; returns (sketch, sketches_merged)"""
+    merged = HyperLogLog()
+    merged_count = 0
+    async for doc in collection.find(query, {'_id': 0, 'registers': 1, 'precision': 1}):
+        merged.merge(HyperLogLog.from_binary(doc['registers'], doc.get('precision', DEFAULT_PRECISION)))
+        merged_count += 1
+    return merged, merged_count
+
+
+async def merge_sketches_by(collection, query, field):
+    """Merge stored sketches matching query per value of field; returns {value: sketch}"""
+    merged = {}
+    async for doc in collection.find(query, {'_id': 0, field: 1, 'registers': 1, 'precision': 1}):
+        sketch = HyperLogLog.from_binary(doc['registers'], doc.get('precision', DEFAULT_PRECISION))
+        if doc[field] in merged:
+            merged[doc[field]].merge(sketch)
+        else:
+            merged[doc[field]] = sketch
+    return merged
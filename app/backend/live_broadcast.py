@@ -0,0 +1,161 @@
+"""Tick-based fan-out of live dashboard state to streaming subscribers"""
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def diff(previous, current):
+    """Keys of current whose value changed since previous; nested dicts are compared key by key.
+
+    Keys that disappeared map to None (a tombstone), so clients can drop them.
+    """
+    changes = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            nested = diff(old, value)
+            if nested:
+                changes[key] = nested
+        elif value != old:
+            changes[key] = value
+    for key in previous:
+        if key not in current:
+            changes[key] = None
+    return changes
+
+
+def merge(base, changes, delete=True):
+    """Apply changes (as returned by diff) on top of base, returning a new dict.
+
+    None removes the key; with delete=False it is kept instead, for merging
+    two deltas into one that still carries the tombstone.
+    """
+    merged = dict(base)
+    for key, value in changes.items():
+        if value is None and delete:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value, delete)
+        else:
+            merged[key] = value
+    return merged
+
+
+def encode(data):
+    return json.dumps(data, default=str, separators=(',', ':'))
+
+
+class Subscriber:
+    """One connected client: a single pending frame that later ticks are merged into"""
+
+    def __init__(self):
+        self.started = False
+        self.event = None
+        self.sequence = 0
+        self.data = None
+        self.encoded = None
+        self._ready = asyncio.Event()
+
+    def push(self, event, sequence, data, encoded):
+        """Queue a frame; returns True when it was merged into one the client has not taken yet"""
+        coalesced = self.event is not None
+        if coalesced:
+            # Keep 'snapshot' if that is what is pending: the merge is still the whole state.
+            # A pending delta keeps tombstones, or the client would never drop those keys
+            self.data = merge(self.data, data, delete=self.event == 'snapshot')
+            self.encoded = None
+        else:
+            self.event, self.data, self.encoded = event, data, encoded
+        self.started = True
+        self.sequence = sequence
+        self._ready.set()
+        return coalesced
+
+    async def take(self, timeout):
+        """(event, sequence, JSON text) of the pending frame, or None after timeout seconds without one"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._ready.clear()
+        frame = (self.event, self.sequence, self.encoded if self.encoded is not None else encode(self.data))
+        self.event = self.data = self.encoded = None
+        return frame
+
+
+class Broadcaster:
+    """Computes the live state once per tick and fans what changed out to every subscriber.
+
+    The compute coroutine runs only while someone is subscribed, however many
+    subscribers there are. A new subscriber first gets a 'snapshot' frame of
+    the whole state, then 'delta' frames with only the changed keys (null
+    for keys that were removed, as in a JSON merge patch). Each
+    tick's delta is encoded once and shared; a subscriber still holding an
+    unsent frame gets the new changes merged into it, so slow clients skip
+    frames instead of buffering them.
+    """
+
+    def __init__(self, compute, interval=2.0):
+        self.compute = compute
+        self.interval = interval
+        self.state = None
+        self.sequence = 0
+        self._subscribers = set()
+        self._task = None
+        self._stats = {'ticks': 0, 'frames': 0, 'coalesced': 0, 'errors': 0}
+
+    def _push(self, subscriber, event, data, encoded):
+        self._stats['frames'] += 1
+        if subscriber.push(event, self.sequence, data, encoded):
+            self._stats['coalesced'] += 1
+
+    async def _run(self):
+        while self._subscribers:
+            started = time.monotonic()
+            try:
+                state = await self.compute()
+            except Exception as e:
+                logger.error(f"Live dashboard tick failed: {e}")
+                self._stats['errors'] += 1
+                state = None
+            self._stats['ticks'] += 1
+            if state is not None:
+                changes = diff(self.state, state) if self.state is not None else state
+                self.state = state
+                if changes:
+                    self.sequence += 1
+                encoded_changes = encode(changes) if changes else None
+                encoded_state = None
+                for subscriber in list(self._subscribers):
+                    if not subscriber.started:
+                        encoded_state = encoded_state or encode(state)
+                        self._push(subscriber, 'snapshot', state, encoded_state)
+                    elif changes:
+                        self._push(subscriber, 'delta', changes, encoded_changes)
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        self._task = None
+
+    async def subscribe(self, keepalive=15.0):
+        """Async iterator of (event, sequence, JSON text) frames; (None, None, None) marks keepalive timeouts"""
+        subscriber = Subscriber()
+        self._subscribers.add(subscriber)
+        if self.state is not None and self._task is not None:
+            self._push(subscriber, 'snapshot', self.state, encode(self.state))
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        try:
+            while True:
+                frame = await subscriber.take(keepalive)
+                yield frame if frame is not None else (None, None, None)
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def stats(self):
+        return {
+            **self._stats,
+            'subscribers': len(self._subscribers),
+            'sequence': self.sequence
+        }
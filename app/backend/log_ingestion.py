@@ -0,0 +1,248 @@
+"""Parallel ingestion of rotated session log files (NDJSON/CSV) into viewing_sessions"""
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from response_cache import bump_ingest_version
+
+logger = logging.getLogger(__name__)
+
+# Rotated and compressed variants are matched too (sessions.ndjson.1, sessions.csv.gz, ...)
+LOG_PATTERNS = ('*.ndjson*', '*.jsonl*', '*.json*', '*.csv*')
+
+REQUIRED_FIELDS = (
+    'id', 'user_id', 'movie_id', 'start_time', 'watch_duration_minutes',
+    'completion_rate', 'device_type', 'user_country'
+)
+
+# Rejected records whose reasons are kept on the ingested_files entry
+MAX_ERROR_SAMPLES = 10
+
+
+def parse_timestamp(value):
+    """ISO 8601 string or epoch seconds -> naive UTC datetime"""
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)) or (isinstance(value, str) and value.replace('.', '', 1).isdigit()):
+        return datetime.fromtimestamp(float(value), timezone.utc).replace(tzinfo=None)
+    else:
+        parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_record(raw, ingested_at):
+    """Validate one raw log record and normalize it to the viewing_sessions schema.
+
+    Raises ValueError describing the first problem found.
+    """
+    missing = [field for field in REQUIRED_FIELDS if raw.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    start_time = parse_timestamp(raw['start_time'])
+    watch_duration = int(float(raw['watch_duration_minutes']))
+    completion_rate = float(raw['completion_rate'])
+    if watch_duration < 0:
+        raise ValueError("negative watch_duration_minutes")
+    if not 0.0 <= completion_rate <= 1.0:
+        raise ValueError("completion_rate outside [0, 1]")
+    end_time = raw.get('end_time')
+    end_time = parse_timestamp(end_time) if end_time not in (None, '') else start_time + timedelta(minutes=watch_duration)
+    buffering = raw.get('buffering_count')
+
+    return {
+        'id': str(raw['id']),
+        'user_id': str(raw['user_id']),
+        'movie_id': str(raw['movie_id']),
+        'start_time': start_time,
+        'end_time': end_time,
+        'hour_of_day': start_time.hour,
+        'day': start_time.date().isoformat(),
+        'watch_duration_minutes': watch_duration,
+        'completion_rate': round(completion_rate, 2),
+        'device_type': str(raw['device_type']),
+        'quality': raw.get('quality') or None,
+        'buffering_count': int(float(buffering)) if buffering not in (None, '') else 0,
+        'user_country': str(raw['user_country']),
+        'subscription_type': raw.get('subscription_type') or None,
+        # Ingestion time, so the incremental transform picks these sessions up
+        'created_at': ingested_at
+    }
+
+
+def open_log(path):
+    path = Path(path)
+    if path.suffix == '.gz':
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def iter_raw_records(path):
+    """Yield (line_number, raw dict or None) for every record of an NDJSON or CSV log"""
+    name = Path(path).name
+    with open_log(path) as f:
+        if '.csv' in name:
+            for line_number, row in enumerate(csv.DictReader(f), 2):
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield line_number, record if isinstance(record, dict) else None
+
+
+def file_fingerprint(path):
+    """Identity of a log file's content: size plus a hash of its head and tail.
+
+    A rotated (renamed) file keeps its fingerprint, so it is not ingested twice.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(65536))
+        if size > 65536:
+            f.seek(max(65536, size - 65536))
+            digest.update(f.read(65536))
+    return digest.hexdigest()
+
+
+def discover_log_files(directory):
+    files = set()
+    for pattern in LOG_PATTERNS:
+        files.update(path for path in Path(directory).glob(pattern) if path.is_file())
+    return sorted(files)
+
+
+# ========== WORKER PROCESS ==========
+# Each worker parses its file and upserts straight into MongoDB with its own
+# client, so parsed rows never travel back through the parent process.
+
+_collection = None
+
+
+def _init_worker(mongo_url, db_name):
+    global _collection
+    _collection = MongoClient(mongo_url)[db_name].viewing_sessions
+
+
+def _flush(operations, stats):
+    try:
+        result = _collection.bulk_write(operations, ordered=False)
+        stats['inserted'] += result.upserted_count
+        stats['duplicates'] += len(operations) - result.upserted_count
+    except BulkWriteError as e:
+        # Concurrent upserts of the same id race on the unique index; the loser is a duplicate
+        details = e.details
+        stats['inserted'] += details.get('nUpserted', 0)
+        stats['duplicates'] += len(operations) - details.get('nUpserted', 0)
+        if any(error.get('code') != 11000 for error in details.get('writeErrors', [])):
+            raise
+
+
+def ingest_file(path, chunk_size=5000):
+    """Parse, validate and upsert one log file; runs in a worker process"""
+    started = time.perf_counter()
+    ingested_at = datetime.utcnow()
+    stats = {'records': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+    operations = []
+    for line_number, raw in iter_raw_records(path):
+        stats['records'] += 1
+        try:
+            if raw is None:
+                raise ValueError("not a JSON object")
+            session = parse_record(raw, ingested_at)
+        except (ValueError, TypeError, OverflowError) as e:
+            stats['rejected'] += 1
+            if len(stats['errors']) < MAX_ERROR_SAMPLES:
+                stats['errors'].append(f"line {line_number}: {e}")
+            continue
+        # Sessions are immutable: the first copy of an id wins, replays are no-ops
+        operations.append(UpdateOne({'id': session['id']}, {'$setOnInsert': session}, upsert=True))
+        if len(operations) >= chunk_size:
+            _flush(operations, stats)
+            operations = []
+    if operations:
+        _flush(operations, stats)
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+async def ingest_directory(db, directory, mongo_url, db_name, workers=None, chunk_size=5000):
+    """Ingest every not-yet-ingested log file in directory with a process pool.
+
+    Files are tracked in the ingested_files collection by content
+    fingerprint, so rerunning over the same (or rotated) files is a no-op;
+    a file interrupted mid-way is simply ingested again, and the upserts on
+    the unique session id drop the rows it already wrote.
+    """
+    started = time.perf_counter()
+    paths = discover_log_files(directory)
+    fingerprints = {str(path): file_fingerprint(path) for path in paths}
+    done = set(await db.ingested_files.distinct('id', {'id': {'$in': list(fingerprints.values())}}))
+    pending = [path for path, fingerprint in fingerprints.items() if fingerprint not in done]
+    logger.info(f"{len(paths)} log files in {directory}, {len(pending)} not yet ingested")
+
+    totals = {'files': 0, 'records': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0}
+    if not pending:
+        return totals
+
+    loop = asyncio.get_running_loop()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(mongo_url, db_name)) as pool:
+        async def run(path):
+            try:
+                return path, await loop.run_in_executor(pool, ingest_file, path, chunk_size)
+            except Exception as e:
+                logger.error(f"Ingesting {path} failed: {e}")
+                return path, None
+
+        for future in asyncio.as_completed([run(path) for path in pending]):
+            path, stats = await future
+            if stats is None:
+                failed += 1
+                continue
+            await db.ingested_files.update_one(
+                {'id': fingerprints[path]},
+                {'$set': {'path': path, 'ingested_at': datetime.utcnow(), **stats}},
+                upsert=True
+            )
+            totals['files'] += 1
+            for key in ('records', 'inserted', 'duplicates', 'rejected'):
+                totals[key] += stats[key]
+            if stats['rejected']:
+                logger.warning(f"{path}: rejected {stats['rejected']} records, e.g. {stats['errors'][0]}")
+
+    elapsed = time.perf_counter() - started
+    totals['seconds'] = round(elapsed, 3)
+    totals['records_per_sec'] = round(totals['records'] / elapsed, 1) if elapsed > 0 else 0.0
+    logger.info(
+        f"Ingested {totals['files']} files: {totals['inserted']} new sessions, "
+        f"{totals['duplicates']} duplicates, {totals['rejected']} rejected "
+        f"({totals['records_per_sec']} records/sec)"
+    )
+    if totals['inserted']:
+        await bump_ingest_version(db.etl_state)
+    if failed:
+        # Files that failed are not marked as ingested, so the next run retries them
+        raise RuntimeError(f"{failed} of {len(pending)} log files failed to ingest")
+    return totals
+
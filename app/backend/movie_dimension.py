@@ -0,0 +1,47 @@
+"""In-process cache of the movies dimension table"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+MOVIE_FIELDS = {'_id': 0, 'id': 1, 'title': 1, 'genre': 1, 'avg_rating': 1}
+
+
+class MovieDimensionCache:
+    """Holds the small movies dimension in memory, keyed by movie id.
+
+    Aggregations group the fact table by movie_id first and join the few
+    hundred resulting rows here instead of running a $lookup per session.
+    The cache reloads when the ETL publishes a new data version (movies are
+    only written by the ETL) or after max_age_seconds as a safety net.
+    """
+
+    def __init__(self, collection, data_version, max_age_seconds=300.0):
+        self.collection = collection
+        self.data_version = data_version
+        self.max_age_seconds = max_age_seconds
+        self._movies = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_stale(self, version):
+        return (
+            self._movies is None
+            or version != self._version
+            or time.monotonic() - self._loaded_at >= self.max_age_seconds
+        )
+
+    async def get(self):
+        """Return {movie_id: {id, title, genre, avg_rating}}"""
+        version = await self.data_version.get()
+        if self._is_stale(version):
+            async with self._lock:
+                if self._is_stale(version):
+                    docs = await self.collection.find({}, MOVIE_FIELDS).to_list(None)
+                    self._movies = {doc['id']: doc for doc in docs}
+                    self._version = version
+                    self._loaded_at = time.monotonic()
+                    logger.info(f"Loaded {len(self._movies)} movies into dimension cache")
+        return self._movies
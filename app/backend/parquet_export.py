@@ -0,0 +1,216 @@
+"""Parallel columnar export of the MongoDB collections to partitioned Parquet files
+
+Usage:
+    python parquet_export.py --output /data/export --since 2026-01-01 --concurrency 8
+
+Writes the same layout as generate_dataset.py (see dataset_schemas), so Spark
+jobs read an export and a generated benchmark dataset the same way. Each
+session day and each rating month is a separate range query, served by the
+start_time / rating_date indexes, and up to --concurrency ranges are read
+and written at once.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from dataset_schemas import ARROW_SCHEMAS, PARTITIONS, clear_dataset
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Documents converted to Arrow at a time
+BATCH_SIZE = 10000
+
+COLLECTIONS = {'movies': 'movies', 'users': 'users', 'sessions': 'viewing_sessions', 'ratings': 'ratings'}
+
+
+def projection(table: str) -> dict:
+    return {'_id': 0, **{name: 1 for name in ARROW_SCHEMAS[table].names}}
+
+
+async def write_cursor(cursor, table: str, path_for_part, rows_per_file: Optional[int] = None) -> tuple:
+    """Stream a cursor into Parquet files of at most rows_per_file rows; returns (rows, files)"""
+    schema = ARROW_SCHEMAS[table]
+    rows = files = in_file = 0
+    writer = None
+    batch = []
+
+    async def flush():
+        nonlocal writer, files, in_file
+        if writer is None:
+            path = path_for_part(files)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            writer = pq.ParquetWriter(path, schema, compression='snappy')
+            files += 1
+        table_batch = await asyncio.to_thread(pa.Table.from_pylist, batch, schema)
+        await asyncio.to_thread(writer.write_table, table_batch)
+        in_file += len(batch)
+        if rows_per_file and in_file >= rows_per_file:
+            writer.close()
+            writer = None
+            in_file = 0
+
+    try:
+        async for doc in cursor:
+            batch.append(doc)
+            rows += 1
+            if len(batch) >= BATCH_SIZE or (rows_per_file and in_file + len(batch) >= rows_per_file):
+                await flush()
+                batch = []
+        if batch:
+            await flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows, files
+
+
+async def session_days(collection, since: Optional[datetime], until: Optional[datetime]) -> list:
+    """Start of every day between the first and last session in the window"""
+    query = time_window('start_time', since, until)
+    first = await collection.find_one(query, {'_id': 0, 'start_time': 1}, sort=[('start_time', 1)])
+    last = await collection.find_one(query, {'_id': 0, 'start_time': 1}, sort=[('start_time', -1)])
+    if not first:
+        return []
+    day = datetime.combine(first['start_time'].date(), datetime.min.time())
+    days = []
+    while day <= last['start_time']:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+async def rating_months(collection) -> list:
+    """Every 'YYYY-MM' between the first and last rating_date"""
+    first = await collection.find_one({}, {'_id': 0, 'rating_date': 1}, sort=[('rating_date', 1)])
+    last = await collection.find_one({}, {'_id': 0, 'rating_date': 1}, sort=[('rating_date', -1)])
+    if not first:
+        return []
+    year, month = int(first['rating_date'][:4]), int(first['rating_date'][5:7])
+    months = []
+    while f"{year:04d}-{month:02d}" <= last['rating_date'][:7]:
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def next_month(month: str) -> str:
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + 1:04d}-01" if number == 12 else f"{year:04d}-{number + 1:02d}"
+
+
+def time_window(field: str, since: Optional[datetime], until: Optional[datetime]) -> dict:
+    window = {}
+    if since:
+        window['$gte'] = since
+    if until:
+        window['$lt'] = until
+    return {field: window} if window else {}
+
+
+async def export_dataset(
+    db,
+    output: Path,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    concurrency: int = 8,
+    rows_per_file: int = 500000,
+    tables: tuple = tuple(COLLECTIONS)
+) -> dict:
+    """Export movies, users, sessions (by day) and ratings (by month) as Parquet
+
+    tables limits the export to a subset of them.
+    """
+    started = time.perf_counter()
+    output.mkdir(parents=True, exist_ok=True)
+    clear_dataset(output)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def export(table, query, path_for_part, limit_rows=True):
+        async with semaphore:
+            cursor = db[COLLECTIONS[table]].find(query, projection(table), batch_size=BATCH_SIZE)
+            rows, files = await write_cursor(cursor, table, path_for_part, rows_per_file if limit_rows else None)
+            return table, rows, files
+
+    tasks = [
+        export(table, {}, lambda part, table=table: output / f"{table}.parquet", limit_rows=False)
+        for table in ('movies', 'users') if table in tables
+    ]
+    days = await session_days(db.viewing_sessions, since, until) if 'sessions' in tables else []
+    months = await rating_months(db.ratings) if 'ratings' in tables else []
+    for day in days:
+        start = max(day, since) if since else day
+        end = min(day + timedelta(days=1), until) if until else day + timedelta(days=1)
+        directory = output / 'sessions' / f"{PARTITIONS['sessions']}={day.strftime('%Y-%m-%d')}"
+        tasks.append(export(
+            'sessions',
+            time_window('start_time', start, end),
+            lambda part, directory=directory: directory / f"part-{part:05d}.parquet"
+        ))
+    for month in months:
+        directory = output / 'ratings' / f"{PARTITIONS['ratings']}={month}"
+        tasks.append(export(
+            'ratings',
+            {'rating_date': {'$gte': month, '$lt': next_month(month)}},
+            lambda part, directory=directory: directory / f"part-{part:05d}.parquet"
+        ))
+
+    written = {'movies': 0, 'users': 0, 'sessions': 0, 'ratings': 0}
+    files = 0
+    for table, rows, table_files in await asyncio.gather(*tasks):
+        written[table] += rows
+        files += table_files
+
+    elapsed = time.perf_counter() - started
+    manifest = {
+        'source': 'mongodb',
+        'exported_at': datetime.utcnow().isoformat(),
+        'since': since.isoformat() if since else None,
+        'until': until.isoformat() if until else None,
+        'format': 'parquet',
+        'rows': written,
+        'files': files,
+        'partitioning': PARTITIONS,
+        'seconds': round(elapsed, 1)
+    }
+    (output / '_manifest.json').write_text(json.dumps(manifest, indent=2))
+    logger.info(
+        f"Exported {sum(written.values())} rows in {files} files to {output} in {elapsed:.1f}s "
+        f"({written['sessions'] / elapsed:.0f} sessions/sec)"
+    )
+    return manifest
+
+
+app = typer.Typer(add_completion=False, help="Export the MongoDB collections to partitioned Parquet files")
+
+
+@app.command()
+def export(
+    output: Path = typer.Option(Path("export"), "--output", "-o", help="Output directory"),
+    since: Optional[datetime] = typer.Option(None, "--since", help="First session start_time to export (UTC)"),
+    until: Optional[datetime] = typer.Option(None, "--until", help="Export sessions starting before this time (UTC)"),
+    concurrency: int = typer.Option(8, "--concurrency", "-c", min=1, help="Ranges read and written at once"),
+    rows_per_file: int = typer.Option(500000, "--rows-per-file", min=1000, help="Maximum rows per Parquet file")
+):
+    """Write movies, users, sessions and ratings from MongoDB as date-partitioned Parquet"""
+    mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+    db_name = os.environ.get('DB_NAME', 'streaming_analytics')
+    client = AsyncIOMotorClient(mongo_url)
+    try:
+        asyncio.run(export_dataset(client[db_name], output, since, until, concurrency, rows_per_file))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    app()
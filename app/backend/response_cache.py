@@ -0,0 +1,150 @@
+"""In-process response cache for the analytics API"""
+import asyncio
+import functools
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+# Parameter types that identify a cached response; anything else (requests,
+# credentials) is left out of the cache key unless it provides cache_key().
+_KEY_TYPES = (str, int, float, bool, type(None), date, datetime)
+
+_MISS = object()
+
+
+def _key_part(value):
+    if isinstance(value, _KEY_TYPES):
+        return value
+    cache_key = getattr(value, 'cache_key', None)
+    return cache_key() if callable(cache_key) else _MISS
+
+
+async def bump_ingest_version(collection):
+    """Record that new sessions were written outside the ETL (changes DataVersion.tag(), not get())"""
+    await collection.update_one({'id': 'data_version'}, {'$inc': {'ingest_version': 1}}, upsert=True)
+
+
+class DataVersion:
+    """Tracks the analytics data version the ETL stamps into etl_state.
+
+    The version document is re-read at most once per refresh interval, so a
+    cache lookup normally costs no database round-trip at all. The same
+    document counts session ingests (API batches, log files) in
+    ingest_version, which only tag() includes.
+    """
+
+    def __init__(self, collection, refresh_interval=5.0):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self._version = 0
+        self._ingest_version = 0
+        self._checked_at = None
+
+    async def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.refresh_interval:
+            doc = await self.collection.find_one({'id': 'data_version'}, {'_id': 0, 'version': 1, 'ingest_version': 1})
+            self._version = doc.get('version', 0) if doc else 0
+            self._ingest_version = doc.get('ingest_version', 0) if doc else 0
+            self._checked_at = now
+
+    async def get(self):
+        await self._refresh()
+        return self._version
+
+    async def tag(self):
+        """The data version and the ingest counter, for responses that also read raw sessions"""
+        await self._refresh()
+        return f"{self._version}.{self._ingest_version}"
+
+    def invalidate(self):
+        """Force the next get() to re-read the version (e.g. after an in-process ETL run)"""
+        self._checked_at = None
+
+
+class ResponseCache:
+    """TTL + LRU cache of endpoint results stamped with the data version.
+
+    An entry is served only while it is younger than ttl_seconds and was
+    computed against the current DataVersion.tag(), so an ETL run or a
+    session ingest invalidates every entry at once without having to walk
+    the cache. It is the tag the ETags are built from: a response is never
+    served under a newer tag than the data it was computed from.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISS
+        entry_version, expires_at, value = entry
+        if entry_version != version or time.monotonic() >= expires_at:
+            del self._entries[key]
+            return _MISS
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, version, value):
+        self._entries[key] = (version, time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+    def cached(self, name, data_version):
+        """Decorate an async endpoint so its result is cached per query parameters.
+
+        Concurrent misses for the same key share a single computation.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                version = await data_version.tag()
+                parts = ((k, _key_part(v)) for k, v in kwargs.items())
+                key = (name, tuple(sorted((k, v) for k, v in parts if v is not _MISS)))
+
+                value = self.get(key, version)
+                if value is not _MISS:
+                    self.hits += 1
+                    return value
+                self.misses += 1
+
+                inflight = self._inflight.get(key)
+                if inflight is not None:
+                    return await asyncio.shield(inflight)
+
+                future = asyncio.ensure_future(func(*args, **kwargs))
+                self._inflight[key] = future
+                try:
+                    value = await asyncio.shield(future)
+                finally:
+                    self._inflight.pop(key, None)
+                self.set(key, version, value)
+                return value
+            # Marks the endpoint as versioned (see conditional_get)
+            wrapper.cache_name = name
+            return wrapper
+        return decorator
@@ -1,33 +1,90 @@
-"from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends, Body, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
+from contextlib import aclosing
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
-import uuid
-from datetime import datetime, timezone, timedelta
+from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Awaitable, Callable, Union
+from datetime import datetime, timedelta
+from response_cache import DataVersion, ResponseCache, bump_ingest_version
+from movie_dimension import MovieDimensionCache
+from columnar_engine import ColumnarEngine
+from snapshot_store import SnapshotReader
+from session_ingest import LiveCounters, WriteBehindBuffer
+from live_broadcast import Broadcaster
+from fast_response import FastJSON
+from conditional_get import ConditionalGetMiddleware
+from telemetry import MongoCommandMetrics, RequestMetricsMiddleware, record_etl_run, render_metrics
+from log_ingestion import parse_record
+from hll import merge_sketches, merge_sketches_by
+from session_filter import SessionFilter, session_filter
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection; every command is timed for /metrics
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
-app = FastAPI(title=\"Movie Streaming Platform Analytics API\", version=\"1.0.0\")
+app = FastAPI(title="Movie Streaming Platform Analytics API", version="1.0.0")
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix=\"/api\")
+api_router = APIRouter(prefix="/api")
 
 # Security (RBAC Simulation)
 security = HTTPBearer(auto_error=False)
 
+# Response cache for analytics endpoints, invalidated whenever the ETL bumps the data version
+data_version = DataVersion(db.etl_state, refresh_interval=float(os.environ.get('DATA_VERSION_REFRESH_SECONDS', 5)))
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 512)),
+    ttl_seconds=float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 300))
+)
+
+# Opt-in fast path: analytics results are served pre-encoded (orjson, gzip/brotli)
+# without being re-validated against their response models
+fast_json = FastJSON(
+    enabled=os.environ.get('FAST_RESPONSES', '').lower() in ('1', 'true', 'yes'),
+    min_size=int(os.environ.get('FAST_RESPONSE_MIN_SIZE', 1024)),
+    max_entries=response_cache.max_entries
+)
+
+# Movies dimension kept in memory for joining per-movie aggregates
+movie_dimension = MovieDimensionCache(db.movies, data_version)
+
+# Optional in-memory columnar copy of viewing_sessions answering the analytics panels;
+# with SNAPSHOT_DIR it maps the snapshot published by the ETL, shared by all workers
+snapshot_dir = os.environ.get('SNAPSHOT_DIR')
+columnar = ColumnarEngine(
+    db.viewing_sessions,
+    refresh_interval=float(os.environ.get('COLUMNAR_REFRESH_SECONDS', 5)),
+    snapshots=SnapshotReader(snapshot_dir, float(os.environ.get('SNAPSHOT_CHECK_SECONDS', 5))) if snapshot_dir else None
+) if snapshot_dir or os.environ.get('COLUMNAR_ENGINE', '').lower() in ('1', 'true', 'yes') else None
+
+async def record_session_ingest(inserted: int):
+    """New sessions change what filtered and fallback queries return: retire their ETags"""
+    await bump_ingest_version(db.etl_state)
+    data_version.invalidate()
+
+# Sessions posted to the API are buffered and inserted in the background in batches
+session_buffer = WriteBehindBuffer(
+    db.viewing_sessions,
+    max_batch=int(os.environ.get('SESSION_BUFFER_BATCH', 1000)),
+    flush_interval=float(os.environ.get('SESSION_BUFFER_FLUSH_SECONDS', 0.25)),
+    max_pending=int(os.environ.get('SESSION_BUFFER_MAX_PENDING', 100000)),
+    timestamp_field='created_at',
+    on_insert=record_session_ingest
+)
+live_counters = LiveCounters()
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -38,24 +95,24 @@ logger = logging.getLogger(__name__)
 # ========== SECURITY & RBAC (Role-Based Access Control) ==========
 
 class UserRole:
-    \"\"\"Simulates RBAC roles\"\"\"
-    ADMIN = \"admin\"
-    ANALYST = \"analyst\"
-    VIEWER = \"viewer\"
+    """Simulates RBAC roles"""
+    ADMIN = "admin"
+    ANALYST = "analyst"
+    VIEWER = "viewer"
 
 def mask_sensitive_data(data: dict, fields: list) -> dict:
-    \"\"\"Data Masking implementation for security\"\"\"
+    """Data Masking implementation for security"""
     masked_data = data.copy()
     for field in fields:
         if field in masked_data:
             if isinstance(masked_data[field], str):
-                masked_data[field] = \"***MASKED***\"
+                masked_data[field] = "***MASKED***"
             elif isinstance(masked_data[field], (int, float)):
                 masked_data[field] = 0
     return masked_data
 
 async def get_current_user_role(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> str:
-    \"\"\"Simulates authentication and returns user role\"\"\"
+    """Simulates authentication and returns user role"""
     # In production, validate JWT token here
     # For demo, return analyst role
     return UserRole.ANALYST
@@ -83,10 +140,29 @@ class ViewingSession(BaseModel):
     id: str
     user_id: str
     movie_id: str
-    start_time: str
-    watch_duration_minutes: int
-    completion_rate: float
+    start_time: datetime
+    end_time: Optional[datetime] = None
+    watch_duration_minutes: int = Field(ge=0)
+    completion_rate: float = Field(ge=0.0, le=1.0)
     device_type: str
+    user_country: str
+    quality: Optional[str] = None
+    buffering_count: int = Field(0, ge=0)
+    subscription_type: Optional[str] = None
+
+class SessionIngestResult(BaseModel):
+    accepted: int
+    pending: int
+
+class LiveSessionCounters(BaseModel):
+    minutes: int
+    sessions: int
+    sessions_per_minute: float
+    watch_minutes: int
+    avg_completion_rate: float
+    devices: Dict[str, int]
+    countries: Dict[str, int]
+    pending_writes: int
 
 class DashboardMetrics(BaseModel):
     total_users: int
@@ -109,6 +185,7 @@ class GenreAnalytics(BaseModel):
     total_views: int
     avg_watch_time: float
     unique_users: int
+    unique_users_approximate: bool = False
 
 class DeviceAnalytics(BaseModel):
     device_type: str
@@ -120,390 +197,1043 @@ class GeographicData(BaseModel):
     total_views: int
     unique_users: int
     avg_completion_rate: float
+    unique_users_approximate: bool = False
+
+class UniqueUsers(BaseModel):
+    unique_users: int
+    approximate: bool
+    relative_error: float
+    sketches_merged: int
 
 class HourlyTrend(BaseModel):
     hour: int
     view_count: int
     avg_completion_rate: float
 
+class DashboardSnapshot(BaseModel):
+    metrics: DashboardMetrics
+    top_movies: List[TopMovie]
+    genres: List[GenreAnalytics]
+    devices: List[DeviceAnalytics]
+    geographic: List[GeographicData]
+    hourly_trends: List[HourlyTrend]
+    daily_trends: List[Dict[str, Any]]
+
+class LiveQuality(BaseModel):
+    window_start: datetime
+    window_end: datetime
+    quality: Optional[str] = None
+    device_type: str
+    session_count: int
+    avg_buffering: float
+    avg_completion: float
+
+class LiveGeo(BaseModel):
+    window_start: datetime
+    window_end: datetime
+    country: str
+    total_views: int
+    avg_engagement: float
+
+# ========== AGGREGATION PIPELINES ==========
+# One builder per dashboard panel, shared by the single-panel endpoints and
+# the combined snapshot endpoint so both always run the same query.
+
+def top_movies_pipeline() -> list:
+    """Per-movie view counts, most viewed first.
+
+    The fact table is grouped by movie_id before any join, so the result has
+    one row per distinct movie; titles are attached from the movie dimension
+    cache by join_top_movies.
+    """
+    return [
+        {
+            "$group": {
+                "_id": "$movie_id",
+                "total_views": {"$sum": 1},
+                "avg_completion_rate": {"$avg": "$completion_rate"}
+            }
+        },
+        {"$sort": {"total_views": -1, "_id": 1}}
+    ]
+
+def genre_pipeline() -> list:
+    """Per-movie genre inputs (fallback when genre_analytics is empty).
+
+    Grouped by movie_id before any join, so the result has one row per
+    distinct movie; join_genres maps each row to its genre through the movie
+    dimension cache and sums the measures per genre.
+    """
+    return [
+        {
+            "$group": {
+                "_id": "$movie_id",
+                "total_views": {"$sum": 1},
+                "total_watch_time": {"$sum": "$watch_duration_minutes"}
+            }
+        }
+    ]
+
+def genre_users_pipeline() -> list:
+    """Exact distinct users per genre, counted server-side.
+
+    Sessions are reduced to distinct (movie, user) pairs before the join, so
+    $lookup runs once per pair rather than once per session, and only one
+    row per genre comes back.
+    """
+    return [
+        {"$group": {"_id": {"movie_id": "$movie_id", "user_id": "$user_id"}}},
+        {"$lookup": {"from": "movies", "localField": "_id.movie_id", "foreignField": "id", "as": "movie"}},
+        {"$unwind": "$movie"},
+        {"$group": {"_id": {"genre": "$movie.genre", "user_id": "$_id.user_id"}}},
+        {"$group": {"_id": "$_id.genre", "unique_users": {"$sum": 1}}}
+    ]
+
+def join_top_movies(grouped: list, movies: dict, limit: int) -> list:
+    """Inner-join per-movie aggregates with the movie dimension, keeping the top `limit`"""
+    results = []
+    for row in grouped:
+        movie = movies.get(row["_id"])
+        if movie is None:
+            continue
+        results.append({
+            "title": movie["title"],
+            "genre": movie["genre"],
+            "total_views": row["total_views"],
+            "avg_completion_rate": round(row["avg_completion_rate"], 2),
+            "avg_rating": movie["avg_rating"]
+        })
+        if len(results) == limit:
+            break
+    return results
+
+def join_genres(grouped: list, movies: dict, users: list) -> list:
+    """Roll per-movie aggregates up to genres using the movie dimension; users holds genre_users_pipeline rows"""
+    unique_users = {row["_id"]: row["unique_users"] for row in users}
+    genres = {}
+    for row in grouped:
+        movie = movies.get(row["_id"])
+        if movie is None:
+            continue
+        genre = genres.setdefault(movie["genre"], {"total_views": 0, "total_watch_time": 0})
+        genre["total_views"] += row["total_views"]
+        genre["total_watch_time"] += row["total_watch_time"]
+    results = [
+        {
+            "genre": name,
+            "total_views": stats["total_views"],
+            "avg_watch_time": round(stats["total_watch_time"] / stats["total_views"], 2),
+            "unique_users": unique_users.get(name, 0),
+            "unique_users_approximate": False
+        }
+        for name, stats in genres.items()
+    ]
+    results.sort(key=lambda row: row["total_views"], reverse=True)
+    return results
+
+def measures(cube: bool = False) -> dict:
+    """Additive measures, read either from raw sessions or from the session_rollup cube.
+
+    The cube stores the same dimension field names as viewing_sessions, so a
+    panel pipeline only differs in how it sums its measures.
+    """
+    if cube:
+        return {
+            "sessions": {"$sum": "$session_count"},
+            "watch_minutes": {"$sum": "$watch_minutes"},
+            "completion_sum": {"$sum": "$completion_sum"}
+        }
+    return {
+        "sessions": {"$sum": 1},
+        "watch_minutes": {"$sum": "$watch_duration_minutes"},
+        "completion_sum": {"$sum": "$completion_rate"}
+    }
+
+AVG_COMPLETION = {"$round": [{"$divide": ["$completion_sum", "$sessions"]}, 2]}
+
+def device_pipeline(cube: bool = False) -> list:
+    """Sessions and completion by device type"""
+    return [
+        {"$group": {"_id": "$device_type", **measures(cube)}},
+        {
+            "$project": {
+                "_id": 0,
+                "device_type": "$_id",
+                "session_count": "$sessions",
+                "avg_completion_rate": AVG_COMPLETION
+            }
+        },
+        {"$sort": {"session_count": -1}}
+    ]
+
+def geographic_pipeline(cube: bool = False) -> list:
+    """Top 20 countries by views (unique users are attached by attach_sketch_users)"""
+    return [
+        {"$group": {"_id": "$user_country", **measures(cube)}},
+        {
+            "$project": {
+                "_id": 0,
+                "country": "$_id",
+                "total_views": "$sessions",
+                "avg_completion_rate": AVG_COMPLETION
+            }
+        },
+        {"$sort": {"total_views": -1}},
+        {"$limit": 20}
+    ]
+
+def hourly_trends_pipeline(cube: bool = False) -> list:
+    """Views and completion by hour of day"""
+    return [
+        {"$group": {"_id": "$hour_of_day", **measures(cube)}},
+        {
+            "$project": {
+                "_id": 0,
+                "hour": "$_id",
+                "view_count": "$sessions",
+                "avg_completion_rate": AVG_COMPLETION
+            }
+        },
+        {"$sort": {"hour": 1}}
+    ]
+
+def genre_cube_pipeline() -> list:
+    """Views and watch time by genre from the rollup cube"""
+    return [
+        {"$group": {"_id": "$genre", **measures(cube=True)}},
+        {
+            "$project": {
+                "_id": 0,
+                "genre": "$_id",
+                "total_views": "$sessions",
+                "avg_watch_time": {"$round": [{"$divide": ["$watch_minutes", "$sessions"]}, 2]}
+            }
+        },
+        {"$sort": {"total_views": -1}}
+    ]
+
+def daily_cube_pipeline(days: int) -> list:
+    """Daily views and watch time from the rollup cube"""
+    return [
+        {"$group": {"_id": "$day", **measures(cube=True)}},
+        {
+            "$project": {
+                "_id": 0,
+                "date": "$_id",
+                "total_views": "$sessions",
+                "total_watch_time": "$watch_minutes",
+                "avg_completion_rate": AVG_COMPLETION
+            }
+        },
+        {"$sort": {"date": -1}},
+        {"$limit": days}
+    ]
+
+def distinct_users_pipeline(field: Optional[str]) -> list:
+    """Exact distinct users per value of field (or overall when field is None), without collecting user ids into one document"""
+    return [
+        {"$group": {"_id": {"key": f"${field}" if field else None, "user_id": "$user_id"}}},
+        {"$group": {"_id": "$_id.key", "unique_users": {"$sum": 1}}}
+    ]
+
+def daily_trends_pipeline(days: int) -> list:
+    """Real-time daily trends (fallback when daily_analytics is empty)"""
+    return [
+        # Group per (day, user) first so distinct users are counted, not collected
+        {
+            "$group": {
+                "_id": {"day": "$day", "user_id": "$user_id"},
+                "total_views": {"$sum": 1},
+                "total_watch_time": {"$sum": "$watch_duration_minutes"}
+            }
+        },
+        {
+            "$group": {
+                "_id": "$_id.day",
+                "total_views": {"$sum": "$total_views"},
+                "unique_users": {"$sum": 1},
+                "total_watch_time": {"$sum": "$total_watch_time"}
+            }
+        },
+        {
+            "$project": {
+                "date": "$_id",
+                "total_views": 1,
+                "unique_users": 1,
+                "unique_users_approximate": {"$literal": False},
+                "total_watch_time": 1
+            }
+        },
+        {"$sort": {"_id": -1}},
+        {"$limit": days}
+    ]
+
+async def attach_sketch_users(
+    rows: list,
+    row_field: str,
+    sketch_field: str,
+    session_field: Optional[str] = None,
+    flt: SessionFilter = SessionFilter(),
+    exact_counts: Optional[Callable[[], Awaitable[dict]]] = None
+) -> list:
+    """Fill unique_users on per-dimension rows from the ETL's user sketches.
+
+    When the sketches cannot answer the filter (or none exist yet), falls back
+    to exact counts: exact_counts() when given, otherwise a two-stage distinct
+    count over the filtered sessions if the dimension lives on
+    viewing_sessions (session_field).
+    """
+    keys = [row[row_field] for row in rows]
+    sketch_query = flt.sketch_query()
+    sketches = {}
+    if sketch_query is not None:
+        query = {"$and": [sketch_query, {sketch_field: {"$in": keys}}]}
+        sketches = await merge_sketches_by(db.user_sketches, query, sketch_field)
+    if sketches or (session_field is None and exact_counts is None):
+        counts = {key: sketch.count() for key, sketch in sketches.items()}
+        approximate = True
+    elif exact_counts is not None:
+        counts = await exact_counts()
+        approximate = False
+    else:
+        exact = await db.viewing_sessions.aggregate(
+            flt.match() + distinct_users_pipeline(session_field), allowDiskUse=True, comment="distinct_users"
+        ).to_list(None)
+        counts = {row["_id"]: row["unique_users"] for row in exact}
+        approximate = False
+    for row in rows:
+        row["unique_users"] = counts.get(row[row_field], 0)
+        row["unique_users_approximate"] = approximate
+    return rows
+
+async def rollup_is_fresh() -> bool:
+    """Whether the session_rollup cube covers every session loaded so far"""
+    state, latest = await asyncio.gather(
+        db.etl_state.find_one({"id": "transform_watermark"}, {"_id": 0, "created_at": 1}),
+        db.viewing_sessions.find_one({}, {"_id": 0, "created_at": 1}, sort=[("created_at", -1)])
+    )
+    if not state:
+        return False
+    return latest is None or latest["created_at"] <= state["created_at"]
+
+async def use_rollup(flt: SessionFilter) -> bool:
+    """Whether a query with this filter can be answered from the rollup cube"""
+    return flt.hour_aligned() and await rollup_is_fresh()
+
+def panel_source(cube: bool):
+    """Collection a panel pipeline runs against"""
+    return db.session_rollup if cube else db.viewing_sessions
+
+# ========== COLUMNAR ENGINE ==========
+# With COLUMNAR_ENGINE=true the panels are answered by NumPy group-bys over
+# the in-memory columns instead of Mongo aggregations, once the engine has
+# loaded. Unique users still come from the sketches when they can answer the
+# filter, and from an exact in-memory distinct count otherwise. SNAPSHOT_DIR
+# also enables it, starting from the ETL's memory-mapped snapshot.
+
+def columnar_ready() -> bool:
+    """Whether the columnar engine is enabled and loaded (schedules its incremental refresh)"""
+    if columnar is None:
+        return False
+    columnar.ensure_fresh()
+    return columnar.loaded
+
+async def columnar_genres(flt: SessionFilter, movies: dict) -> list:
+    return await attach_sketch_users(
+        columnar.genres(flt, movies), "genre", "genre", flt=flt,
+        exact_counts=lambda: asyncio.to_thread(columnar.genre_distinct_users, flt, movies)
+    )
+
+async def columnar_geographic(flt: SessionFilter) -> list:
+    return await attach_sketch_users(
+        columnar.geographic(flt), "country", "country", "user_country", flt,
+        exact_counts=lambda: asyncio.to_thread(columnar.distinct_users, "country", flt)
+    )
+
+async def columnar_daily_trends(flt: SessionFilter, days: int) -> list:
+    return await attach_sketch_users(
+        columnar.daily_trends(flt, days), "date", "day", "day", flt,
+        exact_counts=lambda: asyncio.to_thread(columnar.distinct_users, "day", flt)
+    )
+
 # ========== API ENDPOINTS ==========
 
-@api_router.get(\"/\")
+@api_router.get("/")
 async def root():
     return {
-        \"message\": \"Movie Streaming Platform Analytics API\",
-        \"version\": \"1.0.0\",
-        \"status\": \"operational\"
+        "message": "Movie Streaming Platform Analytics API",
+        "version": "1.0.0",
+        "status": "operational"
     }
 
-@api_router.get(\"/health\")
+@api_router.get("/health")
 async def health_check():
-    \"\"\"Health check endpoint\"\"\"
+    """Health check endpoint"""
     try:
         await db.command('ping')
-        return {\"status\": \"healthy\", \"database\": \"connected\"}
+        return {"status": "healthy", "database": "connected"}
     except Exception as e:
-        raise HTTPException(status_code=503, detail=\"Database connection failed\")
+        raise HTTPException(status_code=503, detail="Database connection failed")
 
 # ========== DASHBOARD METRICS ==========
 
-@api_router.get(\"/dashboard/metrics\", response_model=DashboardMetrics)
-async def get_dashboard_metrics(role: str = Depends(get_current_user_role)):
-    \"\"\"Get high-level dashboard metrics\"\"\"
+def users_metrics_pipeline() -> list:
+    """User counters for the metric cards, computed in one pass over users"""
+    return [
+        {"$facet": {
+            "total_users": [{"$count": "count"}],
+            "active_users": [{"$match": {"is_active": True}}, {"$count": "count"}],
+            "premium_subscribers": [{"$match": {"subscription_type": "Premium"}}, {"$count": "count"}]
+        }}
+    ]
+
+def sessions_metrics_pipeline() -> list:
+    """Session counters for the metric cards, computed in one pass over viewing_sessions"""
+    return [
+        {"$group": {
+            "_id": None,
+            "total_views": {"$sum": 1},
+            "total_watch_time": {"$sum": "$watch_duration_minutes"},
+            "avg_completion": {"$avg": "$completion_rate"}
+        }}
+    ]
+
+def facet_count(facet: dict, name: str) -> int:
+    """Read a {"$count": "count"} sub-pipeline result out of a $facet document"""
+    return facet[name][0]["count"] if facet.get(name) else 0
+
+async def compute_dashboard_metrics(fast: bool = False) -> DashboardMetrics:
+    """Compute the high-level metric cards"""
+    if fast:
+        # Collection metadata counts plus the counters stored by the last ETL run
+        total_users, total_movies, total_views, etl_metrics = await asyncio.gather(
+            db.users.estimated_document_count(),
+            db.movies.estimated_document_count(),
+            db.viewing_sessions.estimated_document_count(),
+            db.etl_state.find_one({"id": "dashboard_metrics"}, {"_id": 0})
+        )
+        if etl_metrics:
+            return DashboardMetrics(
+                total_users=total_users,
+                active_users=etl_metrics["active_users"],
+                total_movies=total_movies,
+                total_views=total_views,
+                total_watch_time_hours=round(etl_metrics["total_watch_time"] / 60, 2),
+                avg_completion_rate=round(etl_metrics["avg_completion_rate"], 2),
+                premium_subscribers=etl_metrics["premium_subscribers"]
+            )
+        logger.info("No ETL dashboard metrics recorded yet, computing exact metrics")
+    
+    # One aggregation per collection, issued concurrently
+    user_stats, watch_stats, total_movies = await asyncio.gather(
+        db.users.aggregate(users_metrics_pipeline(), comment="users_metrics").to_list(1),
+        db.viewing_sessions.aggregate(sessions_metrics_pipeline(), comment="sessions_metrics").to_list(1),
+        db.movies.count_documents({})
+    )
+    user_stats = user_stats[0] if user_stats else {}
+    watch_stats = watch_stats[0] if watch_stats else {}
+    
+    return DashboardMetrics(
+        total_users=facet_count(user_stats, "total_users"),
+        active_users=facet_count(user_stats, "active_users"),
+        total_movies=total_movies,
+        total_views=watch_stats.get("total_views", 0),
+        total_watch_time_hours=round(watch_stats.get("total_watch_time", 0) / 60, 2),
+        avg_completion_rate=round(watch_stats.get("avg_completion") or 0, 2),
+        premium_subscribers=facet_count(user_stats, "premium_subscribers")
+    )
+
+@api_router.get("/dashboard/metrics", response_model=DashboardMetrics)
+@fast_json.endpoint()
+@response_cache.cached("dashboard-metrics", data_version)
+async def get_dashboard_metrics(
+    fast: bool = Query(False, description="Use collection metadata and ETL counters instead of full scans"),
+    role: str = Depends(get_current_user_role)
+):
+    """Get high-level dashboard metrics"""
     try:
-        # Use aggregation pipelines (advanced SQL equivalent)
-        total_users = await db.users.count_documents({})
-        active_users = await db.users.count_documents({\"is_active\": True})
-        total_movies = await db.movies.count_documents({})
-        total_views = await db.viewing_sessions.count_documents({})
+        return await compute_dashboard_metrics(fast)
+    except Exception as e:
+        logger.error(f"Error fetching dashboard metrics: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ========== DASHBOARD SNAPSHOT ==========
+
+@api_router.get("/dashboard/snapshot", response_model=DashboardSnapshot)
+@fast_json.endpoint()
+@response_cache.cached("dashboard-snapshot", data_version)
+async def get_dashboard_snapshot(
+    limit: int = Query(10, le=50),
+    days: int = Query(30, le=90),
+    fast: bool = Query(False, description="Use fast metric counters"),
+    flt: SessionFilter = Depends(session_filter),
+    role: str = Depends(get_current_user_role)
+):
+    """Get every dashboard panel in a single round-trip"""
+    try:
+        if columnar_ready():
+            metrics, movies = await asyncio.gather(compute_dashboard_metrics(fast), movie_dimension.get())
+            genres, geographic, daily_trends = await asyncio.gather(
+                columnar_genres(flt, movies), columnar_geographic(flt), columnar_daily_trends(flt, days)
+            )
+            return DashboardSnapshot(
+                metrics=metrics,
+                top_movies=join_top_movies(columnar.top_movies(flt), movies, limit),
+                genres=genres,
+                devices=columnar.devices(flt),
+                geographic=geographic,
+                hourly_trends=columnar.hourly_trends(flt),
+                daily_trends=daily_trends
+            )
         
-        # Calculate total watch time
-        pipeline = [
-            {\"$group\": {
-                \"_id\": None,
-                \"total_watch_time\": {\"$sum\": \"$watch_duration_minutes\"},
-                \"avg_completion\": {\"$avg\": \"$completion_rate\"}
-            }}
-        ]
-        watch_stats = await db.viewing_sessions.aggregate(pipeline).to_list(1)
+        # Every grouped panel shares one $facet scan, over the rollup cube when
+        # it is fresh and over the raw fact table otherwise. Metrics, the movie
+        # dimension and the remaining sources are fetched concurrently with it.
+        # Top movies run on their own: one row per movie would make the facet
+        # document grow with the catalogue, past the 16 MB document limit.
+        cube = await use_rollup(flt)
+        cube_genres = cube and flt.sketch_query() is not None
+        facet = {
+            "devices": device_pipeline(cube),
+            "geographic": geographic_pipeline(cube),
+            "hourly_trends": hourly_trends_pipeline(cube)
+        }
+        queries = {
+            "metrics": compute_dashboard_metrics(fast),
+            "movies": movie_dimension.get(),
+            "top_movies": db.viewing_sessions.aggregate(flt.match() + top_movies_pipeline(), comment="top_movies").to_list(None)
+        }
+        if cube:
+            facet["daily_trends"] = daily_cube_pipeline(days)
+        if cube_genres:
+            facet["genres"] = genre_cube_pipeline()
+        if flt.is_empty and not cube:
+            queries["genres"] = db.genre_analytics.find({}, {"_id": 0}).to_list(100)
+            queries["daily_trends"] = db.daily_analytics.find({}, {"_id": 0, "run_id": 0}).sort([("date", -1)]).limit(days).to_list(days)
+        queries["panels"] = panel_source(cube).aggregate(
+            flt.match(cube) + [{"$facet": facet}], allowDiskUse=True, comment="dashboard_panels"
+        ).to_list(1)
+        results = dict(zip(queries, await asyncio.gather(*queries.values())))
+        panels = results["panels"][0] if results["panels"] else {}
+        results.update(panels)
+        movies = results["movies"]
         
-        total_watch_time = watch_stats[0][\"total_watch_time\"] / 60 if watch_stats else 0
-        avg_completion = watch_stats[0][\"avg_completion\"] if watch_stats else 0
+        # Fallback to real-time aggregation for panels neither the cube nor the ETL tables answered
+        fallbacks = {}
+        if not cube_genres and not results.get("genres"):
+            fallbacks["genres"] = db.viewing_sessions.aggregate(flt.match() + genre_pipeline(), allowDiskUse=True, comment="genre").to_list(None)
+            fallbacks["genre_users"] = db.viewing_sessions.aggregate(flt.match() + genre_users_pipeline(), allowDiskUse=True, comment="genre_users").to_list(None)
+        if not cube and not results.get("daily_trends"):
+            fallbacks["daily_trends"] = db.viewing_sessions.aggregate(flt.match() + daily_trends_pipeline(days), allowDiskUse=True, comment="daily_trends").to_list(days)
+        if fallbacks:
+            fallback_results = dict(zip(fallbacks, await asyncio.gather(*fallbacks.values())))
+            if "genres" in fallback_results:
+                results["genres"] = join_genres(fallback_results["genres"], movies, fallback_results["genre_users"])
+            if "daily_trends" in fallback_results:
+                results["daily_trends"] = fallback_results["daily_trends"]
         
-        # Premium subscribers
-        premium_subs = await db.users.count_documents({\"subscription_type\": \"Premium\"})
+        sketched = [attach_sketch_users(results.get("geographic", []), "country", "country", "user_country", flt)]
+        if cube_genres:
+            sketched.append(attach_sketch_users(results.get("genres", []), "genre", "genre", flt=flt))
+        if cube:
+            sketched.append(attach_sketch_users(results.get("daily_trends", []), "date", "day", "day", flt))
+        await asyncio.gather(*sketched)
         
-        return DashboardMetrics(
-            total_users=total_users,
-            active_users=active_users,
-            total_movies=total_movies,
-            total_views=total_views,
-            total_watch_time_hours=round(total_watch_time, 2),
-            avg_completion_rate=round(avg_completion, 2),
-            premium_subscribers=premium_subs
+        return DashboardSnapshot(
+            metrics=results["metrics"],
+            top_movies=join_top_movies(results.get("top_movies", []), movies, limit),
+            genres=results.get("genres", []),
+            devices=results.get("devices", []),
+            geographic=results.get("geographic", []),
+            hourly_trends=results.get("hourly_trends", []),
+            daily_trends=results.get("daily_trends", [])
         )
     except Exception as e:
-        logger.error(f\"Error fetching dashboard metrics: {e}\")
+        logger.error(f"Error fetching dashboard snapshot: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ========== TOP CONTENT ANALYTICS ==========
 
-@api_router.get(\"/analytics/top-movies\", response_model=List[TopMovie])
-async def get_top_movies(limit: int = Query(10, le=50)):
-    \"\"\"Get top performing movies (using advanced aggregation - CTE equivalent)\"\"\"
+@api_router.get("/analytics/top-movies", response_model=List[TopMovie])
+@fast_json.endpoint(TopMovie)
+@response_cache.cached("top-movies", data_version)
+async def get_top_movies(
+    limit: int = Query(10, le=50),
+    flt: SessionFilter = Depends(session_filter)
+):
+    """Get top performing movies (using advanced aggregation - CTE equivalent)"""
     try:
-        # Complex aggregation pipeline (equivalent to SQL CTEs and Window Functions)
-        pipeline = [
-            # Join with movies collection
-            {
-                \"$lookup\": {
-                    \"from\": \"movies\",
-                    \"localField\": \"movie_id\",
-                    \"foreignField\": \"id\",
-                    \"as\": \"movie_info\"
-                }
-            },
-            {\"$unwind\": \"$movie_info\"},
-            # Group by movie
-            {
-                \"$group\": {
-                    \"_id\": \"$movie_id\",
-                    \"title\": {\"$first\": \"$movie_info.title\"},
-                    \"genre\": {\"$first\": \"$movie_info.genre\"},
-                    \"avg_rating\": {\"$first\": \"$movie_info.avg_rating\"},
-                    \"total_views\": {\"$sum\": 1},
-                    \"avg_completion_rate\": {\"$avg\": \"$completion_rate\"}
-                }
-            },
-            # Sort and limit
-            {\"$sort\": {\"total_views\": -1}},
-            {\"$limit\": limit},
-            # Project final fields
-            {
-                \"$project\": {
-                    \"_id\": 0,
-                    \"title\": 1,
-                    \"genre\": 1,
-                    \"total_views\": 1,
-                    \"avg_completion_rate\": {\"$round\": [\"$avg_completion_rate\", 2]},
-                    \"avg_rating\": 1
-                }
-            }
-        ]
+        if columnar_ready():
+            return join_top_movies(columnar.top_movies(flt), await movie_dimension.get(), limit)
         
-        results = await db.viewing_sessions.aggregate(pipeline).to_list(limit)
-        return results
+        grouped, movies = await asyncio.gather(
+            db.viewing_sessions.aggregate(flt.match() + top_movies_pipeline(), comment="top_movies").to_list(None),
+            movie_dimension.get()
+        )
+        return join_top_movies(grouped, movies, limit)
     except Exception as e:
-        logger.error(f\"Error fetching top movies: {e}\")
+        logger.error(f"Error fetching top movies: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ========== GENRE ANALYTICS ==========
 
-@api_router.get(\"/analytics/genres\", response_model=List[GenreAnalytics])
-async def get_genre_analytics():
-    \"\"\"Get analytics by genre\"\"\"
+@api_router.get("/analytics/genres", response_model=List[GenreAnalytics])
+@fast_json.endpoint(GenreAnalytics)
+@response_cache.cached("genres", data_version)
+async def get_genre_analytics(flt: SessionFilter = Depends(session_filter)):
+    """Get analytics by genre"""
     try:
-        results = await db.genre_analytics.find({}, {\"_id\": 0}).to_list(100)
+        if columnar_ready():
+            return await columnar_genres(flt, await movie_dimension.get())
+        
+        # Cube rows only carry additive measures; genre unique users need the sketches
+        if flt.sketch_query() is not None and await use_rollup(flt):
+            results = await db.session_rollup.aggregate(flt.match(cube=True) + genre_cube_pipeline(), comment="genre_cube").to_list(100)
+            return await attach_sketch_users(results, "genre", "genre", flt=flt)
+        
+        results = await db.genre_analytics.find({}, {"_id": 0}).to_list(100) if flt.is_empty else []
         if not results:
             # Fallback to real-time aggregation
-            pipeline = [
-                {
-                    \"$lookup\": {
-                        \"from\": \"movies\",
-                        \"localField\": \"movie_id\",
-                        \"foreignField\": \"id\",
-                        \"as\": \"movie_info\"
-                    }
-                },
-                {\"$unwind\": \"$movie_info\"},
-                {
-                    \"$group\": {
-                        \"_id\": \"$movie_info.genre\",
-                        \"total_views\": {\"$sum\": 1},
-                        \"avg_watch_time\": {\"$avg\": \"$watch_duration_minutes\"},
-                        \"unique_users\": {\"$addToSet\": \"$user_id\"}
-                    }
-                },
-                {
-                    \"$project\": {
-                        \"_id\": 0,
-                        \"genre\": \"$_id\",
-                        \"total_views\": 1,
-                        \"avg_watch_time\": {\"$round\": [\"$avg_watch_time\", 2]},
-                        \"unique_users\": {\"$size\": \"$unique_users\"}
-                    }
-                },
-                {\"$sort\": {\"total_views\": -1}}
-            ]
-            results = await db.viewing_sessions.aggregate(pipeline).to_list(100)
+            grouped, users, movies = await asyncio.gather(
+                db.viewing_sessions.aggregate(flt.match() + genre_pipeline(), allowDiskUse=True, comment="genre").to_list(None),
+                db.viewing_sessions.aggregate(flt.match() + genre_users_pipeline(), allowDiskUse=True, comment="genre_users").to_list(None),
+                movie_dimension.get()
+            )
+            results = join_genres(grouped, movies, users)
         
         return results
     except Exception as e:
-        logger.error(f\"Error fetching genre analytics: {e}\")
+        logger.error(f"Error fetching genre analytics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ========== DEVICE ANALYTICS ==========
 
-@api_router.get(\"/analytics/devices\", response_model=List[DeviceAnalytics])
-async def get_device_analytics():
-    \"\"\"Get analytics by device type\"\"\"
+@api_router.get("/analytics/devices", response_model=List[DeviceAnalytics])
+@fast_json.endpoint(DeviceAnalytics)
+@response_cache.cached("devices", data_version)
+async def get_device_analytics(flt: SessionFilter = Depends(session_filter)):
+    """Get analytics by device type"""
     try:
-        pipeline = [
-            {
-                \"$group\": {
-                    \"_id\": \"$device_type\",
-                    \"session_count\": {\"$sum\": 1},
-                    \"avg_completion_rate\": {\"$avg\": \"$completion_rate\"}
-                }
-            },
-            {
-                \"$project\": {
-                    \"_id\": 0,
-                    \"device_type\": \"$_id\",
-                    \"session_count\": 1,
-                    \"avg_completion_rate\": {\"$round\": [\"$avg_completion_rate\", 2]}
-                }
-            },
-            {\"$sort\": {\"session_count\": -1}}
-        ]
+        if columnar_ready():
+            return columnar.devices(flt)
         
-        results = await db.viewing_sessions.aggregate(pipeline).to_list(100)
+        cube = await use_rollup(flt)
+        results = await panel_source(cube).aggregate(flt.match(cube) + device_pipeline(cube), comment="device").to_list(100)
         return results
     except Exception as e:
-        logger.error(f\"Error fetching device analytics: {e}\")
+        logger.error(f"Error fetching device analytics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ========== GEOGRAPHIC ANALYTICS ==========
 
-@api_router.get(\"/analytics/geographic\", response_model=List[GeographicData])
-async def get_geographic_analytics():
-    \"\"\"Get geographic distribution analytics\"\"\"
+@api_router.get("/analytics/geographic", response_model=List[GeographicData])
+@fast_json.endpoint(GeographicData)
+@response_cache.cached("geographic", data_version)
+async def get_geographic_analytics(flt: SessionFilter = Depends(session_filter)):
+    """Get geographic distribution analytics"""
     try:
-        pipeline = [
-            {
-                \"$group\": {
-                    \"_id\": \"$user_country\",
-                    \"total_views\": {\"$sum\": 1},
-                    \"unique_users\": {\"$addToSet\": \"$user_id\"},
-                    \"avg_completion_rate\": {\"$avg\": \"$completion_rate\"}
-                }
-            },
-            {
-                \"$project\": {
-                    \"_id\": 0,
-                    \"country\": \"$_id\",
-                    \"total_views\": 1,
-                    \"unique_users\": {\"$size\": \"$unique_users\"},
-                    \"avg_completion_rate\": {\"$round\": [\"$avg_completion_rate\", 2]}
-                }
-            },
-            {\"$sort\": {\"total_views\": -1}},
-            {\"$limit\": 20}
-        ]
+        if columnar_ready():
+            return await columnar_geographic(flt)
         
-        results = await db.viewing_sessions.aggregate(pipeline).to_list(100)
-        return results
+        cube = await use_rollup(flt)
+        results = await panel_source(cube).aggregate(flt.match(cube) + geographic_pipeline(cube), comment="geographic").to_list(100)
+        return await attach_sketch_users(results, "country", "country", "user_country", flt)
     except Exception as e:
-        logger.error(f\"Error fetching geographic analytics: {e}\")
+        logger.error(f"Error fetching geographic analytics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ========== TIME-BASED ANALYTICS ==========
 
-@api_router.get(\"/analytics/hourly-trends\", response_model=List[HourlyTrend])
-async def get_hourly_trends():
-    \"\"\"Get viewing trends by hour (Peak hours analysis)\"\"\"
+async def compute_hourly_trends(flt: SessionFilter) -> list:
+    """Views and completion per hour of day from the fastest source available"""
+    if columnar_ready():
+        return columnar.hourly_trends(flt)
+    cube = await use_rollup(flt)
+    return await panel_source(cube).aggregate(flt.match(cube) + hourly_trends_pipeline(cube), comment="hourly_trends").to_list(24)
+
+@api_router.get("/analytics/hourly-trends", response_model=List[HourlyTrend])
+@fast_json.endpoint(HourlyTrend)
+@response_cache.cached("hourly-trends", data_version)
+async def get_hourly_trends(flt: SessionFilter = Depends(session_filter)):
+    """Get viewing trends by hour (Peak hours analysis)"""
     try:
-        pipeline = [
-            {
-                \"$addFields\": {
-                    \"start_datetime\": {\"$dateFromString\": {\"dateString\": \"$start_time\"}}
-                }
-            },
-            {
-                \"$group\": {
-                    \"_id\": {\"$hour\": \"$start_datetime\"},
-                    \"view_count\": {\"$sum\": 1},
-                    \"avg_completion_rate\": {\"$avg\": \"$completion_rate\"}
-                }
-            },
-            {
-                \"$project\": {
-                    \"_id\": 0,
-                    \"hour\": \"$_id\",
-                    \"view_count\": 1,
-                    \"avg_completion_rate\": {\"$round\": [\"$avg_completion_rate\", 2]}
-                }
-            },
-            {\"$sort\": {\"hour\": 1}}
-        ]
-        
-        results = await db.viewing_sessions.aggregate(pipeline).to_list(24)
-        return results
+        return await compute_hourly_trends(flt)
     except Exception as e:
-        logger.error(f\"Error fetching hourly trends: {e}\")
+        logger.error(f"Error fetching hourly trends: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ========== DAILY TRENDS ==========
 
-@api_router.get(\"/analytics/daily-trends\")
-async def get_daily_trends(days: int = Query(30, le=90)):
-    \"\"\"Get daily viewing trends over time\"\"\"
+@api_router.get("/analytics/daily-trends")
+@fast_json.endpoint()
+@response_cache.cached("daily-trends", data_version)
+async def get_daily_trends(
+    days: int = Query(30, le=90),
+    flt: SessionFilter = Depends(session_filter)
+):
+    """Get daily viewing trends over time"""
     try:
+        if columnar_ready():
+            return await columnar_daily_trends(flt, days)
+        
+        if await use_rollup(flt):
+            results = await db.session_rollup.aggregate(flt.match(cube=True) + daily_cube_pipeline(days), comment="daily_cube").to_list(days)
+            return await attach_sketch_users(results, "date", "day", "day", flt)
+        
         # Use cached daily analytics if available
-        results = await db.daily_analytics.find({}, {\"_id\": 0}).sort([(\"date\", -1)]).limit(days).to_list(days)
+        results = []
+        if flt.is_empty:
+            results = await db.daily_analytics.find({}, {"_id": 0, "run_id": 0}).sort([("date", -1)]).limit(days).to_list(days)
         
         if not results:
             # Fallback to real-time calculation
-            pipeline = [
-                {
-                    \"$addFields\": {
-                        \"date_obj\": {\"$dateFromString\": {\"dateString\": \"$start_time\"}}
-                    }
-                },
-                {
-                    \"$group\": {
-                        \"_id\": {
-                            \"$dateToString\": {\"format\": \"%Y-%m-%d\", \"date\": \"$date_obj\"}
-                        },
-                        \"total_views\": {\"$sum\": 1},
-                        \"unique_users\": {\"$addToSet\": \"$user_id\"},
-                        \"total_watch_time\": {\"$sum\": \"$watch_duration_minutes\"}
-                    }
-                },
-                {
-                    \"$project\": {
-                        \"date\": \"$_id\",
-                        \"total_views\": 1,
-                        \"unique_users\": {\"$size\": \"$unique_users\"},
-                        \"total_watch_time\": 1
-                    }
-                },
-                {\"$sort\": {\"_id\": -1}},
-                {\"$limit\": days}
-            ]
-            results = await db.viewing_sessions.aggregate(pipeline).to_list(days)
+            results = await db.viewing_sessions.aggregate(flt.match() + daily_trends_pipeline(days), allowDiskUse=True, comment="daily_trends").to_list(days)
         
         return results
     except Exception as e:
-        logger.error(f\"Error fetching daily trends: {e}\")
+        logger.error(f"Error fetching daily trends: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ========== DISTINCT USERS (HyperLogLog sketches) ==========
+
+@api_router.get("/analytics/unique-users", response_model=UniqueUsers)
+@fast_json.endpoint()
+@response_cache.cached("unique-users", data_version)
+async def get_unique_users(
+    flt: SessionFilter = Depends(session_filter),
+    genre: Optional[str] = Query(None)
+):
+    """Approximate distinct users for any time window and genre/country/device combination.
+
+    Day-aligned windows without a device filter merge the stored sketches; any
+    other filter, or one no stored sketch matches (the ETL has not run yet, or
+    the filter selects nothing), is answered exactly from viewing_sessions.
+    """
+    try:
+        sketch_query = flt.sketch_query()
+        sketches_merged = 0
+        if sketch_query is not None:
+            if genre:
+                sketch_query["genre"] = genre
+            sketch, sketches_merged = await merge_sketches(db.user_sketches, sketch_query)
+        if not sketches_merged:
+            pipeline = flt.match()
+            if genre:
+                movies = await movie_dimension.get()
+                pipeline.append({"$match": {"movie_id": {"$in": [movie_id for movie_id, movie in movies.items() if movie["genre"] == genre]}}})
+            counted = await db.viewing_sessions.aggregate(
+                pipeline + distinct_users_pipeline(None), allowDiskUse=True, comment="distinct_users"
+            ).to_list(1)
+            return UniqueUsers(
+                unique_users=counted[0]["unique_users"] if counted else 0,
+                approximate=False,
+                relative_error=0.0,
+                sketches_merged=0
+            )
+        return UniqueUsers(
+            unique_users=sketch.count(),
+            approximate=True,
+            relative_error=round(sketch.relative_error, 4),
+            sketches_merged=sketches_merged
+        )
+    except Exception as e:
+        logger.error(f"Error fetching unique users: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ========== LIVE ANALYTICS (Structured Streaming) ==========
+
+async def latest_windows(collection, minutes: int, sort: List[tuple]) -> List[Dict[str, Any]]:
+    """Windows ending within `minutes` of the newest window the streaming job wrote"""
+    latest = await collection.find_one({}, {"_id": 0, "window_end": 1}, sort=[("window_end", -1)])
+    if not latest:
+        return []
+    since = latest["window_end"] - timedelta(minutes=minutes)
+    return await collection.find(
+        {"window_end": {"$gt": since}},
+        {"_id": 0, "id": 0, "updated_at": 0}
+    ).sort(sort).to_list(None)
+
+@api_router.get("/analytics/live/quality", response_model=List[LiveQuality])
+async def get_live_quality(minutes: int = Query(15, ge=1, le=1440)):
+    """Per-minute QoE by quality and device from the streaming job (not cached)"""
+    try:
+        return await latest_windows(db.live_quality, minutes, [("window_start", -1), ("session_count", -1)])
+    except Exception as e:
+        logger.error(f"Error fetching live quality: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/analytics/live/geo", response_model=List[LiveGeo])
+async def get_live_geo(minutes: int = Query(15, ge=1, le=1440)):
+    """Sliding 5-minute views by country from the streaming job (not cached)"""
+    try:
+        return await latest_windows(db.live_geo, minutes, [("window_start", -1), ("total_views", -1)])
+    except Exception as e:
+        logger.error(f"Error fetching live geo: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ========== SESSION INGESTION ==========
+# Player events are acknowledged once buffered; session_buffer inserts them in
+# unordered batches. Live counters are per worker process.
+
+MAX_SESSIONS_PER_REQUEST = 5000
+
+@api_router.post("/sessions", response_model=SessionIngestResult, status_code=202)
+async def ingest_sessions(sessions: Union[List[ViewingSession], ViewingSession] = Body(...)):
+    """Accept one session or a batch for write-behind insertion (429 when the buffer is full)"""
+    if isinstance(sessions, ViewingSession):
+        sessions = [sessions]
+    if len(sessions) > MAX_SESSIONS_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_SESSIONS_PER_REQUEST} sessions per request")
+    received_at = datetime.utcnow()
+    try:
+        docs = [parse_record(session.model_dump(), received_at) for session in sessions]
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not session_buffer.offer(docs):
+        raise HTTPException(status_code=429, detail="Session buffer is full, retry later", headers={"Retry-After": "1"})
+    live_counters.add(docs)
+    return SessionIngestResult(accepted=len(docs), pending=session_buffer.pending)
+
+@api_router.get("/sessions/live", response_model=LiveSessionCounters)
+async def get_live_sessions(minutes: int = Query(5, ge=1, le=60)):
+    """Sessions accepted by this worker over the last minutes (not cached)"""
+    return LiveSessionCounters(**live_counters.summary(minutes), pending_writes=session_buffer.pending)
+
+# ========== LIVE DASHBOARD STREAM ==========
+# One computation per tick is shared by every connected dashboard; clients
+# receive the full state once, then only the values that changed.
+
+async def compute_live_dashboard() -> dict:
+    """State pushed to the live dashboard stream"""
+    metrics, hourly = await asyncio.gather(compute_dashboard_metrics(fast=True), compute_hourly_trends(SessionFilter()))
+    return {
+        "metrics": metrics.model_dump(),
+        "hourly_trends": [HourlyTrend(**row).model_dump() for row in hourly],
+        "ingest": {**live_counters.summary(5), "pending_writes": session_buffer.pending}
+    }
+
+live_dashboard = Broadcaster(compute_live_dashboard, interval=float(os.environ.get('LIVE_TICK_SECONDS', 2)))
+
+@api_router.get("/dashboard/stream")
+async def stream_dashboard(request: Request):
+    """Server-sent events: a snapshot of the live dashboard, then per-tick deltas"""
+    async def events():
+        # aclosing unsubscribes as soon as the client goes away
+        async with aclosing(live_dashboard.subscribe()) as frames:
+            async for event, sequence, data in frames:
+                if await request.is_disconnected():
+                    break
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"event: {event}\nid: {sequence}\ndata: {data}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ========== USER ANALYTICS (with Data Masking) ==========
 
-@api_router.get(\"/analytics/users\")
+@api_router.get("/analytics/users")
+@response_cache.cached("users", data_version)
 async def get_user_analytics(
     apply_masking: bool = Query(True),
     role: str = Depends(get_current_user_role)
 ):
-    \"\"\"Get user analytics with optional data masking for security\"\"\"
+    """Get user analytics with optional data masking for security"""
     try:
         pipeline = [
             {
-                \"$group\": {
-                    \"_id\": \"$subscription_type\",
-                    \"user_count\": {\"$sum\": 1},
-                    \"active_count\": {
-                        \"$sum\": {\"$cond\": [{\"$eq\": [\"$is_active\", True]}, 1, 0]}
+                "$group": {
+                    "_id": "$subscription_type",
+                    "user_count": {"$sum": 1},
+                    "active_count": {
+                        "$sum": {"$cond": [{"$eq": ["$is_active", True]}, 1, 0]}
                     }
                 }
             },
             {
-                \"$project\": {
-                    \"_id\": 0,
-                    \"subscription_type\": \"$_id\",
-                    \"user_count\": 1,
-                    \"active_count\": 1
+                "$project": {
+                    "_id": 0,
+                    "subscription_type": "$_id",
+                    "user_count": 1,
+                    "active_count": 1
                 }
             }
         ]
         
-        results = await db.users.aggregate(pipeline).to_list(100)
+        results = await db.users.aggregate(pipeline, comment="subscription_users").to_list(100)
         
         # Apply data masking for non-admin roles
         if apply_masking and role != UserRole.ADMIN:
-            logger.info(\"Applying data masking for non-admin user\")
+            logger.info("Applying data masking for non-admin user")
             # In production, mask specific sensitive fields
         
         return results
     except Exception as e:
-        logger.error(f\"Error fetching user analytics: {e}\")
+        logger.error(f"Error fetching user analytics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ========== ETL PIPELINE TRIGGER ==========
 
-@api_router.post(\"/admin/run-etl\")
-async def trigger_etl_pipeline(role: str = Depends(get_current_user_role)):
-    \"\"\"Trigger ETL pipeline (Admin only)\"\"\"
+@api_router.post("/admin/run-etl")
+async def trigger_etl_pipeline(
+    incremental: bool = Query(False, description="Only aggregate sessions created since the last run"),
+    engine: str = Query("mongo", pattern="^(mongo|spark)$", description="Transform engine"),
+    role: str = Depends(get_current_user_role)
+):
+    """Trigger ETL pipeline (Admin only)"""
     if role != UserRole.ADMIN:
-        raise HTTPException(status_code=403, detail=\"Admin access required\")
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    from etl_pipeline import StreamingETLPipeline
+    try:
+        StreamingETLPipeline.check_engine(engine)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     try:
-        from etl_pipeline import StreamingETLPipeline
-        import asyncio
-        
         mongo_url = os.environ.get('MONGO_URL')
         db_name = os.environ.get('DB_NAME')
         
         pipeline = StreamingETLPipeline(mongo_url, db_name)
-        await pipeline.run_full_pipeline()
+        await pipeline.run_full_pipeline(
+            incremental=incremental, engine=engine, snapshot_dir=os.environ.get('SNAPSHOT_DIR')
+        )
+        data_version.invalidate()
         
-        return {\"status\": \"success\", \"message\": \"ETL pipeline completed\"}
+        return {"status": "success", "message": "ETL pipeline completed"}
     except Exception as e:
-        logger.error(f\"ETL pipeline failed: {e}\")
+        logger.error(f"ETL pipeline failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(role: str = Depends(get_current_user_role)):
+    """Response cache statistics"""
+    return {"data_version": await data_version.get(), **response_cache.stats(), "fast_responses": fast_json.stats()}
+
+@api_router.get("/admin/ingest-stats")
+async def get_ingest_stats(role: str = Depends(get_current_user_role)):
+    """Write-behind session buffer statistics"""
+    return session_buffer.stats()
+
+@api_router.get("/admin/stream-stats")
+async def get_stream_stats(role: str = Depends(get_current_user_role)):
+    """Live dashboard stream ticks, subscribers and coalesced frames"""
+    return live_dashboard.stats()
+
+# ========== QUERY PLANS ==========
+
+def plan_summary(node, summary: dict) -> dict:
+    """Collect index usage and execution stats from an explain() document"""
+    if isinstance(node, dict):
+        if node.get("stage") == "IXSCAN" and node.get("indexName"):
+            summary["indexes_used"].add(node["indexName"])
+        if node.get("stage") == "COLLSCAN":
+            summary["collection_scan"] = True
+        if "executionStats" in node and "execution_stats" not in summary:
+            stats = node["executionStats"]
+            summary["execution_stats"] = {
+                key: stats.get(key)
+                for key in ("nReturned", "totalKeysExamined", "totalDocsExamined", "executionTimeMillis")
+            }
+        for value in node.values():
+            plan_summary(value, summary)
+    elif isinstance(node, list):
+        for value in node:
+            plan_summary(value, summary)
+    return summary
+
+@api_router.get("/admin/explain")
+async def explain_analytics_query(
+    panel: str = Query("devices", description="top-movies, genres, devices, geographic, hourly-trends or daily-trends"),
+    days: int = Query(30, le=90),
+    flt: SessionFilter = Depends(session_filter),
+    role: str = Depends(get_current_user_role)
+):
+    """Query plan of the aggregation an analytics panel runs for the given filters (Admin only)"""
+    if role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    cube = await use_rollup(flt)
+    cube_genres = cube and flt.sketch_query() is not None
+    pipelines = {
+        "top-movies": (False, top_movies_pipeline()),
+        "genres": (cube_genres, genre_cube_pipeline() if cube_genres else genre_pipeline()),
+        "devices": (cube, device_pipeline(cube)),
+        "geographic": (cube, geographic_pipeline(cube)),
+        "hourly-trends": (cube, hourly_trends_pipeline(cube)),
+        "daily-trends": (cube, daily_cube_pipeline(days) if cube else daily_trends_pipeline(days))
+    }
+    if panel not in pipelines:
+        raise HTTPException(status_code=400, detail=f"Unknown panel '{panel}'")
+    
+    try:
+        from_cube, pipeline = pipelines[panel]
+        pipeline = flt.match(from_cube) + pipeline
+        collection = panel_source(from_cube)
+        plan = await db.command(
+            "explain",
+            {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}},
+            verbosity="executionStats"
+        )
+        summary = plan_summary(plan, {"indexes_used": set(), "collection_scan": False})
+        return {
+            "panel": panel,
+            "collection": collection.name,
+            "pipeline": pipeline,
+            "indexes_used": sorted(summary["indexes_used"]),
+            "collection_scan": summary["collection_scan"],
+            "execution_stats": summary.get("execution_stats")
+        }
+    except Exception as e:
+        logger.error(f"Explain failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ========== TELEMETRY ==========
+
+@app.get("/metrics", include_in_schema=False)
+async def get_prometheus_metrics():
+    """Prometheus scrape endpoint: request and MongoDB command latency histograms, ETL stage timings"""
+    try:
+        record_etl_run(await db.etl_state.find_one({"id": "etl_run"}, {"_id": 0}))
+    except Exception as e:
+        # Request and command metrics are still worth serving without the ETL gauges
+        logger.error(f"Error reading ETL run stats: {e}")
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# ETag / 304 for every endpoint behind the response cache: they only change with the data version
+app.add_middleware(
+    ConditionalGetMiddleware,
+    data_version=data_version,
+    paths=[route.path for route in api_router.routes if hasattr(route.endpoint, "cache_name")],
+    max_age=int(os.environ.get('HTTP_CACHE_MAX_AGE', 30))
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=[\"*\"],
-    allow_headers=[\"*\"],
+    allow_methods=["*"],
+    allow_headers=["*"],
 )
 
-@app.on_event(\"shutdown\")
+# Outermost, so latency includes every middleware (and 304s answered before routing)
+app.add_middleware(RequestMetricsMiddleware, routes_app=app)
+
+@app.on_event("startup")
+async def start_columnar_engine():
+    """Load the columnar engine in the background; endpoints use Mongo until it is ready"""
+    if columnar is not None:
+        columnar.ensure_fresh()
+
+@app.on_event("shutdown")
 async def shutdown_db_client():
+    await session_buffer.close()
     client.close()
-"
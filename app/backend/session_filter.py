@@ -0,0 +1,88 @@
+"""Time window and dimension filters shared by the analytics endpoints"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel, ConfigDict
+
+
+class SessionFilter(BaseModel):
+    """Time window (start inclusive, end exclusive) plus device and country filters"""
+    model_config = ConfigDict(frozen=True)
+
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    device_type: Optional[str] = None
+    country: Optional[str] = None
+
+    def cache_key(self) -> tuple:
+        return tuple(self.model_dump().values())
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.start or self.end or self.device_type or self.country)
+
+    def match(self, cube: bool = False) -> list:
+        """Leading $match stage, served by the (device_type|user_country, time) and time indexes"""
+        query = {}
+        if self.device_type:
+            query['device_type'] = self.device_type
+        if self.country:
+            query['user_country'] = self.country
+        if self.start or self.end:
+            window = {}
+            if self.start:
+                window['$gte'] = self.start
+            if self.end:
+                window['$lt'] = self.end
+            query['hour_start' if cube else 'start_time'] = window
+        return [{'$match': query}] if query else []
+
+    def hour_aligned(self) -> bool:
+        """Whether the window can be answered from the hourly rollup cube"""
+        return all(
+            bound is None or bound == bound.replace(minute=0, second=0, microsecond=0)
+            for bound in (self.start, self.end)
+        )
+
+    def sketch_query(self) -> Optional[dict]:
+        """user_sketches query for the same filter, or None when sketches cannot answer it.
+
+        Sketches are kept per day, genre and country, so the window must fall on
+        day boundaries and there must be no device filter.
+        """
+        if self.device_type or not all(
+            bound is None or bound.time() == datetime.min.time()
+            for bound in (self.start, self.end)
+        ):
+            return None
+        query = {}
+        if self.start or self.end:
+            query['day'] = {}
+            if self.start:
+                query['day']['$gte'] = self.start.strftime('%Y-%m-%d')
+            if self.end:
+                query['day']['$lt'] = self.end.strftime('%Y-%m-%d')
+        if self.country:
+            query['country'] = self.country
+        return query
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Naive UTC datetime, matching how session timestamps are stored"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def session_filter(
+    start: Optional[datetime] = Query(None, alias='from', description='Sessions starting at or after (ISO 8601, UTC if no offset)'),
+    end: Optional[datetime] = Query(None, alias='to', description='Sessions starting before (ISO 8601, UTC if no offset)'),
+    device_type: Optional[str] = Query(None),
+    country: Optional[str] = Query(None)
+) -> SessionFilter:
+    """Query-parameter dependency for SessionFilter"""
+    start, end = as_utc(start), as_utc(end)
+    if start and end and start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be earlier than 'to'")
+    return SessionFilter(start=start, end=end, device_type=device_type, country=country)
@@ -0,0 +1,213 @@
+"""Write-behind buffering and live counters for sessions posted to the API"""
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+import pymongo
+from pymongo.errors import (
+    BulkWriteError, ConnectionFailure, ExecutionTimeout, PyMongoError, WriteConcernError, WTimeoutError
+)
+
+logger = logging.getLogger(__name__)
+
+# Readers following the timestamp of buffered sessions (created_at) re-read,
+# or wait out, this many seconds below their watermark: concurrent writers
+# commit out of order, but never later than write_timeout after stamping
+INGEST_SETTLE_SECONDS = 10.0
+
+# Write error codes worth retrying: timeouts, network errors, elections and shutdowns
+TRANSIENT_WRITE_CODES = frozenset({
+    6, 7, 50, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436
+})
+
+
+def is_transient(error):
+    """Whether a failed write may succeed when retried unchanged"""
+    return (
+        isinstance(error, (ConnectionFailure, ExecutionTimeout, WTimeoutError, WriteConcernError))
+        or error.has_error_label('RetryableWriteError')
+        or getattr(error, 'timeout', False)
+    )
+
+
+class WriteBehindBuffer:
+    """Accepts documents immediately and inserts them in the background.
+
+    `writers` tasks send unordered insert_many batches of up to max_batch
+    documents, as soon as a full batch is waiting or at most flush_interval
+    seconds after a document arrived. Documents accepted but not yet written
+    (queued or in flight) are capped at max_pending: offer() refuses a batch
+    that does not fit, so the caller can push back on the client.
+
+    Duplicate keys are dropped (the first copy wins). Documents failing with
+    a transient error (network, timeout, election) are queued again and
+    retried after retry_delay; any other failure (e.g. document validation)
+    would fail again, so those documents are dropped.
+
+    With timestamp_field, every document gets the flush time just before
+    it is inserted. Batches of several writers (and workers) commit in any
+    order, so an insert that does not commit within write_timeout of its
+    stamp is abandoned and retried with a new stamp: a reader re-reading
+    INGEST_SETTLE_SECONDS below its watermark never skips a batch that
+    committed after a later-stamped one. on_insert, a coroutine function,
+    is awaited with the number of documents after every batch that
+    inserted any.
+    """
+
+    def __init__(self, collection, max_batch=1000, flush_interval=0.25, max_pending=100000, writers=4,
+                 retry_delay=1.0, timestamp_field=None, on_insert=None, write_timeout=INGEST_SETTLE_SECONDS / 2):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.writers = writers
+        self.retry_delay = retry_delay
+        self.timestamp_field = timestamp_field
+        self.on_insert = on_insert
+        self.write_timeout = write_timeout
+        self.pending = 0
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._closing = False
+        self._stats = {'accepted': 0, 'rejected': 0, 'inserted': 0, 'duplicates': 0, 'batches': 0, 'retries': 0, 'dropped': 0}
+
+    def offer(self, docs):
+        """Queue all of docs, or none of them when the buffer is full; returns whether they were queued"""
+        if self._closing or self.pending + len(docs) > self.max_pending:
+            self._stats['rejected'] += len(docs)
+            return False
+        self._queue.extend(docs)
+        self.pending += len(docs)
+        self._stats['accepted'] += len(docs)
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._writer()) for _ in range(self.writers)]
+        if len(self._queue) >= self.max_batch:
+            self._wakeup.set()
+        return True
+
+    async def _writer(self):
+        while True:
+            if len(self._queue) < self.max_batch and not self._closing:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            # Cleared on every pass: a wakeup for a batch already taken must not flush the next one early
+            self._wakeup.clear()
+            if not self._queue:
+                if self._closing:
+                    return
+                continue
+            batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            await self._insert(batch)
+
+    async def _insert(self, batch):
+        if self.timestamp_field:
+            now = datetime.utcnow()
+            for doc in batch:
+                doc[self.timestamp_field] = now
+        failed = []
+        try:
+            # Client-side operation timeout, also sent to the server as maxTimeMS
+            with pymongo.timeout(self.write_timeout):
+                result = await self.collection.insert_many(batch, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details.get('nInserted', 0)
+            errors = e.details.get('writeErrors', [])
+            self._stats['duplicates'] += sum(1 for error in errors if error.get('code') == 11000)
+            failed = [batch[error['index']] for error in errors if error.get('code') in TRANSIENT_WRITE_CODES]
+            permanent = [error for error in errors if error.get('code') not in TRANSIENT_WRITE_CODES | {11000}]
+            if permanent:
+                logger.error(
+                    f"Write-behind dropped {len(permanent)} documents that cannot be written, "
+                    f"e.g. {permanent[0].get('errmsg')}"
+                )
+                self._stats['dropped'] += len(permanent)
+        except PyMongoError as e:
+            inserted = 0
+            if is_transient(e):
+                logger.error(f"Write-behind insert of {len(batch)} documents failed, retrying: {e}")
+                failed = batch
+            else:
+                logger.error(f"Write-behind dropped {len(batch)} documents that cannot be written: {e}")
+                self._stats['dropped'] += len(batch)
+        self._stats['inserted'] += inserted
+        self._stats['batches'] += 1
+        if inserted and self.on_insert is not None:
+            try:
+                await self.on_insert(inserted)
+            except Exception as e:
+                logger.error(f"Write-behind insert callback failed: {e}")
+        self.pending -= len(batch) - len(failed)
+        if failed:
+            if self._closing:
+                logger.error(f"Dropping {len(failed)} documents that could not be written at shutdown")
+                self._stats['dropped'] += len(failed)
+                self.pending -= len(failed)
+                return
+            # Still counted as pending, so a struggling database fills the buffer and clients back off
+            self._stats['retries'] += len(failed)
+            await asyncio.sleep(self.retry_delay)
+            self._queue.extendleft(reversed(failed))
+
+    async def close(self):
+        """Write everything still buffered, then stop the writers"""
+        self._closing = True
+        self._wakeup.set()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+            self._tasks = []
+
+    def stats(self):
+        return {**self._stats, 'pending': self.pending, 'max_pending': self.max_pending}
+
+
+class LiveCounters:
+    """Per-minute counters of the sessions accepted by this process, kept for retention_minutes"""
+
+    def __init__(self, retention_minutes=60):
+        self.retention_minutes = retention_minutes
+        self._minutes = {}
+
+    def _bucket(self, minute):
+        bucket = self._minutes.get(minute)
+        if bucket is None:
+            bucket = self._minutes[minute] = {
+                'sessions': 0, 'watch_minutes': 0, 'completion_sum': 0.0,
+                'devices': Counter(), 'countries': Counter()
+            }
+            for old in [m for m in self._minutes if m <= minute - self.retention_minutes]:
+                del self._minutes[old]
+        return bucket
+
+    def add(self, sessions):
+        bucket = self._bucket(int(time.time() // 60))
+        for session in sessions:
+            bucket['sessions'] += 1
+            bucket['watch_minutes'] += session['watch_duration_minutes']
+            bucket['completion_sum'] += session['completion_rate']
+            bucket['devices'][session['device_type']] += 1
+            bucket['countries'][session['user_country']] += 1
+
+    def summary(self, minutes):
+        """Totals over the last `minutes` minutes, the current one included"""
+        first = int(time.time() // 60) - min(minutes, self.retention_minutes) + 1
+        buckets = [bucket for minute, bucket in self._minutes.items() if minute >= first]
+        sessions = sum(bucket['sessions'] for bucket in buckets)
+        devices, countries = Counter(), Counter()
+        for bucket in buckets:
+            devices.update(bucket['devices'])
+            countries.update(bucket['countries'])
+        return {
+            'minutes': minutes,
+            'sessions': sessions,
+            'sessions_per_minute': round(sessions / minutes, 2),
+            'watch_minutes': sum(bucket['watch_minutes'] for bucket in buckets),
+            'avg_completion_rate': round(sum(bucket['completion_sum'] for bucket in buckets) / sessions, 2) if sessions else 0.0,
+            'devices': dict(devices.most_common()),
+            'countries': dict(countries.most_common())
+        }
@@ -0,0 +1,188 @@
+"""Versioned, memory-mapped snapshot files shared by the API workers
+
+File layout (little endian):
+    magic (8 bytes) | header offset (8) | header length (8) | padding
+    arrays, each starting on a 64-byte boundary
+    header: JSON describing the arrays, string tables and metadata
+
+A string table is stored as two arrays, '<name>.offsets' (int64, n + 1)
+and '<name>.data' (utf-8 bytes), and is decoded one value at a time.
+
+Publishing writes snapshot-<version>.snap under a temporary name, renames it
+into place and then atomically replaces the CURRENT pointer file, so a
+reader only ever sees complete snapshots. Readers map files read-only:
+every worker shares the same page cache instead of holding its own copy.
+"""
+import json
+import logging
+import mmap
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MSASNAP1'
+ALIGNMENT = 64
+POINTER = 'CURRENT'
+
+# Snapshot files kept besides the current one (workers may still map them)
+KEEP_PREVIOUS = 1
+
+
+def snapshot_name(version):
+    return f"snapshot-{version:08d}.snap"
+
+
+class MappedStrings:
+    """Read-only sequence of strings stored as offsets + utf-8 data"""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        for start, stop in zip(offsets, offsets[1:]):
+            yield data[start:stop].decode('utf-8')
+
+
+def encode_strings(values):
+    encoded = [str(value).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _aligned(position):
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(directory, version, arrays, strings=None, meta=None):
+    """Write and publish a snapshot; returns its path.
+
+    arrays: {name: ndarray}, strings: {name: list of str}, meta: JSON-able dict.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+
+    arrays = dict(arrays)
+    for name, values in (strings or {}).items():
+        arrays[f"{name}.offsets"], arrays[f"{name}.data"] = encode_strings(values)
+
+    path = directory / snapshot_name(version)
+    temporary = path.with_suffix('.tmp')
+    layout = {}
+    with open(temporary, 'wb') as f:
+        f.write(b'\0' * ALIGNMENT)
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            position = _aligned(f.tell())
+            f.write(b'\0' * (position - f.tell()))
+            f.write(memoryview(array).cast('B'))
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position}
+        header = json.dumps({
+            'version': version,
+            'created_at': datetime.utcnow().isoformat(),
+            'arrays': layout,
+            'strings': sorted(strings or {}),
+            'meta': meta or {}
+        }).encode('utf-8')
+        header_offset = f.tell()
+        f.write(header)
+        f.seek(0)
+        f.write(MAGIC + header_offset.to_bytes(8, 'little') + len(header).to_bytes(8, 'little'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+    pointer = directory / f"{POINTER}.tmp"
+    pointer.write_text(path.name)
+    os.replace(pointer, directory / POINTER)
+
+    # Unlinking a file another worker still maps is safe; its pages live until unmapped
+    published = sorted(directory.glob('snapshot-*.snap'))
+    for old in published[:-(KEEP_PREVIOUS + 1)]:
+        old.unlink(missing_ok=True)
+
+    logger.info(
+        f"Published snapshot v{version} ({path.stat().st_size / 1e6:.1f} MB) "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    return path
+
+
+class Snapshot:
+    """A snapshot file mapped read-only; arrays are zero-copy views of the mapping"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mapping[:8] != MAGIC:
+            raise ValueError(f"{self.path} is not a snapshot file")
+        header_offset = int.from_bytes(self._mapping[8:16], 'little')
+        header_length = int.from_bytes(self._mapping[16:24], 'little')
+        header = json.loads(self._mapping[header_offset:header_offset + header_length])
+        self.version = header['version']
+        self.created_at = header['created_at']
+        self.meta = header['meta']
+        self.arrays = {
+            name: np.frombuffer(
+                self._mapping, dtype=np.dtype(spec['dtype']),
+                count=int(np.prod(spec['shape'], dtype=np.int64)), offset=spec['offset']
+            ).reshape(spec['shape'])
+            for name, spec in header['arrays'].items()
+        }
+        self.strings = {
+            name: MappedStrings(self.arrays[f"{name}.offsets"], self.arrays[f"{name}.data"])
+            for name in header['strings']
+        }
+
+
+class SnapshotReader:
+    """Follows the CURRENT snapshot of a directory.
+
+    The pointer file is re-read at most once per check_interval; a new
+    version is mapped and returned from then on, and the previous mapping
+    is released once nothing references its arrays any more.
+    """
+
+    def __init__(self, directory, check_interval=5.0):
+        self.directory = Path(directory)
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._name = None
+        self._checked_at = None
+
+    def latest(self):
+        """The current Snapshot, or None when nothing has been published yet"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._snapshot
+        self._checked_at = now
+        try:
+            name = (self.directory / POINTER).read_text().strip()
+        except FileNotFoundError:
+            return self._snapshot
+        if name != self._name:
+            try:
+                self._snapshot = Snapshot(self.directory / name)
+                self._name = name
+                logger.info(f"Mapped snapshot v{self._snapshot.version} from {self._snapshot.path}")
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not map snapshot {name}: {e}")
+        return self._snapshot
@@ -1,58 +1,286 @@
 """Apache Spark Batch Processing for Movie Streaming Analytics"""
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, avg, sum, count, window, desc, hour, dayofweek
-from pyspark.sql.types import StructType, StructField, StringType, IntegerType, FloatType, TimestampType
+from pyspark.sql import DataFrame, SparkSession
+from pyspark.sql.functions import (
+    col, avg, count, window, desc, hour, broadcast, coalesce, concat_ws, date_format, date_trunc, lit,
+    round as spark_round, sum as spark_sum
+)
+from pyspark.sql.types import (
+    StructType, StructField, StringType, IntegerType, LongType, DoubleType, BooleanType, ArrayType, TimestampType
+)
+from pymongo import MongoClient, ReplaceOne
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import logging
+import os
+import re
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Declared schemas of the Parquet dataset layout (see dataset_schemas.py), so
+# reads never infer types. Partition columns (day, month) come from the paths.
+SESSION_SCHEMA = StructType([
+    StructField("id", StringType()),
+    StructField("user_id", StringType()),
+    StructField("movie_id", StringType()),
+    StructField("start_time", TimestampType()),
+    StructField("end_time", TimestampType()),
+    StructField("hour_of_day", IntegerType()),
+    StructField("watch_duration_minutes", IntegerType()),
+    StructField("completion_rate", DoubleType()),
+    StructField("device_type", StringType()),
+    StructField("quality", StringType()),
+    StructField("buffering_count", IntegerType()),
+    StructField("user_country", StringType()),
+    StructField("subscription_type", StringType()),
+    StructField("created_at", TimestampType()),
+    StructField("day", StringType())
+])
+
+MOVIE_SCHEMA = StructType([
+    StructField("id", StringType()),
+    StructField("title", StringType()),
+    StructField("genre", StringType()),
+    StructField("sub_genres", ArrayType(StringType())),
+    StructField("duration_minutes", IntegerType()),
+    StructField("release_date", StringType()),
+    StructField("rating", StringType()),
+    StructField("director", StringType()),
+    StructField("cast", ArrayType(StringType())),
+    StructField("production_budget", LongType()),
+    StructField("description", StringType()),
+    StructField("language", StringType()),
+    StructField("country", StringType()),
+    StructField("avg_rating", DoubleType()),
+    StructField("total_views", LongType()),
+    StructField("created_at", StringType())
+])
+
+USER_SCHEMA = StructType([
+    StructField("id", StringType()),
+    StructField("username", StringType()),
+    StructField("email", StringType()),
+    StructField("age", IntegerType()),
+    StructField("gender", StringType()),
+    StructField("country", StringType()),
+    StructField("subscription_type", StringType()),
+    StructField("signup_date", StringType()),
+    StructField("is_active", BooleanType()),
+    StructField("preferred_genres", ArrayType(StringType())),
+    StructField("created_at", StringType())
+])
+
+RATING_SCHEMA = StructType([
+    StructField("id", StringType()),
+    StructField("user_id", StringType()),
+    StructField("movie_id", StringType()),
+    StructField("rating", IntegerType()),
+    StructField("review_text", StringType()),
+    StructField("helpful_count", IntegerType()),
+    StructField("rating_date", StringType()),
+    StructField("created_at", StringType()),
+    StructField("month", StringType())
+])
+
+SCHEMAS = {
+    'sessions': SESSION_SCHEMA,
+    'movies': MOVIE_SCHEMA,
+    'users': USER_SCHEMA,
+    'ratings': RATING_SCHEMA
+}
+
+# Tables stored as a directory of partitions rather than a single file
+PARTITIONED_TABLES = ('sessions', 'ratings')
+
+# Session events dropped as NDJSON files (the log_ingestion record format)
+# into the streaming input directory
+EVENT_SCHEMA = StructType([field for field in SESSION_SCHEMA.fields if field.name != "day"])
+
+# Collections the streaming job keeps up to date for the live API panels
+LIVE_QUALITY_COLLECTION = "live_quality"
+LIVE_GEO_COLLECTION = "live_geo"
+
+# Live windows expire this long after their last update
+LIVE_RETENTION_SECONDS = 24 * 3600
+
+# Dimensions of the session_rollup cube besides hour and genre (see etl_pipeline)
+ROLLUP_DIMENSIONS = ("device_type", "user_country", "subscription_type", "quality")
+
+
+def utc_datetime(seconds):
+    """Epoch seconds -> naive UTC datetime, as stored in MongoDB"""
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+
+def plan_stats(plan):
+    """Shuffles, broadcasts and cached-relation reads in an executed plan's text"""
+    return {
+        "shuffles": len(re.findall(r"\bExchange\b", plan)),
+        "broadcasts": len(re.findall(r"\bBroadcastExchange\b", plan)),
+        "cache_reads": len(re.findall(r"\bInMemoryTableScan\b", plan))
+    }
+
+
+def format_rows(columns, rows):
+    """Plain-text table of collected rows, for logging without re-running the query"""
+    lines = [" | ".join(columns)]
+    lines += [" | ".join(str(row[column]) for column in columns) for row in rows]
+    return "\n".join(lines)
+
+
+def live_window_operations(rows, keys):
+    """ReplaceOne upserts for windowed aggregate rows, keyed by window start and group keys.
+
+    Rows carry window_start/window_end as epoch seconds. Replaying a
+    micro-batch rewrites the same documents, so the sink is idempotent.
+    """
+    updated_at = datetime.utcnow()
+    operations = []
+    for row in rows:
+        doc = row.asDict() if hasattr(row, "asDict") else dict(row)
+        doc["window_start"] = utc_datetime(doc["window_start"])
+        doc["window_end"] = utc_datetime(doc["window_end"])
+        doc["id"] = "|".join([doc["window_start"].isoformat(), *(str(doc[key]) for key in keys)])
+        doc["updated_at"] = updated_at
+        operations.append(ReplaceOne({"id": doc["id"]}, doc, upsert=True))
+    return operations
+
+
+class LiveAggregateSink:
+    """foreachBatch sink upserting each micro-batch of window aggregates into MongoDB"""
+    
+    def __init__(self, mongo_url, db_name, collection, keys):
+        self.collection = MongoClient(mongo_url)[db_name][collection]
+        self.keys = keys
+        self.collection.create_index("id", unique=True)
+        self.collection.create_index([("window_end", -1)])
+        self.collection.create_index("updated_at", expireAfterSeconds=LIVE_RETENTION_SECONDS)
+    
+    def __call__(self, batch_df, batch_id):
+        # Update mode only emits the windows this batch changed, so results stay small
+        operations = live_window_operations(batch_df.collect(), self.keys)
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        logger.info(f"{self.collection.name}: batch {batch_id} upserted {len(operations)} windows")
+
 class SparkStreamingProcessor:
     """Simulates Apache Spark Batch and Streaming Processing"""
     
-    def __init__(self):
+    def __init__(self, dataset_path=None):
+        """dataset_path: directory written by parquet_export.py or generate_dataset.py"""
+        self.dataset_path = dataset_path
         self.spark = SparkSession.builder \
             .appName("MovieStreamingAnalytics") \
-            .master("local[*]") \
-            .config("spark.driver.memory", "2g") \
+            .master(os.environ.get("SPARK_MASTER", "local[*]")) \
+            .config("spark.driver.memory", os.environ.get("SPARK_DRIVER_MEMORY", "2g")) \
+            .config("spark.sql.session.timeZone", "UTC") \
             .getOrCreate()
         
         self.spark.sparkContext.setLogLevel("WARN")
+        
+        # Source DataFrames built and cached once per session: table -> (data, frame)
+        self.sources = {}
+        self.source_hits = {}
+        # Materialized outputs: name -> row count, timing and executed plan
+        self.results = {}
         logger.info("Spark Session initialized")
     
-    def batch_process_viewing_patterns(self, sessions_data):
+    def read_table(self, table, path=None):
+        """Read one table of a Parquet dataset with its declared schema (executors read the files)"""
+        if path is None:
+            name = table if table in PARTITIONED_TABLES else f"{table}.parquet"
+            path = os.path.join(self.dataset_path, name)
+        return self.spark.read.schema(SCHEMAS[table]).parquet(str(path))
+    
+    def load(self, data, table):
+        """DataFrame for a table given a DataFrame, a Parquet path, a list of rows,
+        or None for the processor's dataset_path"""
+        if isinstance(data, DataFrame):
+            return data
+        if data is None:
+            return self.read_table(table) if self.dataset_path else None
+        if isinstance(data, (str, os.PathLike)):
+            return self.read_table(table, data)
+        if not data:
+            return None
+        # In-memory rows still go through the driver, but with the declared schema
+        return self.spark.createDataFrame(data, schema=SCHEMAS[table])
+    
+    def source(self, table, data=None):
+        """Registered DataFrame for a table, built and cached once per session.
+
+        data is anything load() accepts. Passing None, or the same data again,
+        reuses the registered frame; passing different data replaces it.
+        """
+        entry = self.sources.get(table)
+        if entry is not None and (data is None or data is entry[0]):
+            self.source_hits[table] += 1
+            return entry[1]
+        if entry is not None:
+            entry[1].unpersist()
+        
+        frame = self.load(data, table)
+        if frame is None:
+            return None
+        frame = frame.persist()
+        self.sources[table] = (data, frame)
+        self.source_hits[table] = 0
+        return frame
+    
+    def materialize(self, name, frame, preview=20):
+        """Results sink: run an output's lineage exactly once.
+
+        The rows are collected a single time; the logged preview is taken
+        from them rather than from a second .show() job.
+        """
+        started = time.perf_counter()
+        rows = frame.collect()
+        self.results[name] = {
+            "rows": len(rows),
+            "seconds": round(time.perf_counter() - started, 3),
+            "plan": frame._jdf.queryExecution().executedPlan().toString()
+        }
+        logger.info(f"{name} ({len(rows)} rows):\n{format_rows(frame.columns, rows[:preview])}")
+        return rows
+    
+    def plan_report(self):
+        """Shuffles and cache reads of every materialized output, plus source registry hits"""
+        report = {
+            "outputs": {
+                name: {"rows": result["rows"], "seconds": result["seconds"], **plan_stats(result["plan"])}
+                for name, result in self.results.items()
+            },
+            "sources": {table: {"reuses": hits} for table, hits in self.source_hits.items()}
+        }
+        for name, stats in report["outputs"].items():
+            logger.info(
+                f"{name}: {stats['shuffles']} shuffles, {stats['broadcasts']} broadcasts, "
+                f"{stats['cache_reads']} cached reads, {stats['rows']} rows in {stats['seconds']}s"
+            )
+        for table, stats in report["sources"].items():
+            logger.info(f"source {table}: built once, reused {stats['reuses']} times")
+        return report
+    
+    def batch_process_viewing_patterns(self, sessions_data=None):
         """Batch processing: Analyze viewing patterns"""
         logger.info("Starting Spark batch processing for viewing patterns...")
         
-        if not sessions_data:
+        df = self.source('sessions', sessions_data)
+        if df is None:
             logger.warning("No session data provided")
             return None
         
-        # Create DataFrame
-        df = self.spark.createDataFrame(sessions_data)
-        
-        # Window function example: Ranking movies by views
-        from pyspark.sql.window import Window
-        from pyspark.sql.functions import rank, row_number
-        
-        window_spec = Window.partitionBy("device_type").orderBy(desc("watch_duration_minutes"))
-        
-        ranked_df = df.withColumn("rank", rank().over(window_spec)) \
-                      .withColumn("row_num", row_number().over(window_spec))
-        
         # Aggregate by device type
         device_analytics = df.groupBy("device_type") \
             .agg(
                 count("*").alias("total_sessions"),
                 avg("watch_duration_minutes").alias("avg_watch_duration"),
                 avg("completion_rate").alias("avg_completion_rate"),
-                sum("buffering_count").alias("total_buffering")
+                spark_sum("buffering_count").alias("total_buffering")
             ) \
             .orderBy(desc("total_sessions"))
         
-        logger.info("Device Analytics:")
-        device_analytics.show()
-        
         # Time-based analysis (CTE equivalent using temp views)
         df.createOrReplaceTempView("sessions")
         
@@ -79,30 +307,26 @@ class SparkStreamingProcessor:
             ORDER BY popularity_rank
         """)
         
-        logger.info("Peak Viewing Hours:")
-        time_analysis.show()
-        
         return {
-            'device_analytics': device_analytics.collect(),
-            'time_analysis': time_analysis.collect()
+            'device_analytics': self.materialize("Device Analytics", device_analytics),
+            'time_analysis': self.materialize("Peak Viewing Hours", time_analysis)
         }
     
-    def batch_process_content_performance(self, movies_data, ratings_data, sessions_data):
+    def batch_process_content_performance(self, movies_data=None, ratings_data=None, sessions_data=None):
         """Batch processing: Content performance analysis"""
         logger.info("Analyzing content performance with Spark...")
         
-        if not movies_data or not sessions_data:
+        movies_df = self.source('movies', movies_data)
+        sessions_df = self.source('sessions', sessions_data)
+        if movies_df is None or sessions_df is None:
             return None
         
-        movies_df = self.spark.createDataFrame(movies_data)
-        sessions_df = self.spark.createDataFrame(sessions_data)
-        
         # Join operations (similar to Snowflake joins)
         content_performance = sessions_df.groupBy("movie_id") \
             .agg(
                 count("*").alias("view_count"),
                 avg("completion_rate").alias("avg_completion"),
-                sum("watch_duration_minutes").alias("total_watch_time")
+                spark_sum("watch_duration_minutes").alias("total_watch_time")
             ) \
             .join(movies_df, sessions_df.movie_id == movies_df.id, "inner") \
             .select(
@@ -115,20 +339,126 @@ class SparkStreamingProcessor:
             .orderBy(desc("view_count")) \
             .limit(20)
         
-        logger.info("Top Performing Content:")
-        content_performance.show()
+        return self.materialize("Top Performing Content", content_performance)
+    
+    def compute_transform_aggregates(self, high_water=None, sessions_data=None, movies_data=None):
+        """ETL transform engine: every aggregate collection of etl_pipeline, computed by Spark.
+
+        Returns {'movie_statistics', 'daily_analytics', 'genre_analytics',
+        'session_rollup'} -> list of dicts with the fields the Mongo transform
+        writes. Only sessions created at or before high_water (naive UTC) are
+        counted. The filtered sessions, their genre join and the per-movie
+        totals feed several outputs, so they are persisted once, and the four
+        outputs are collected as concurrent Spark jobs.
+        """
+        logger.info("Computing transform aggregates with Spark...")
+        
+        sessions_df = self.load(sessions_data, 'sessions')
+        movies_df = self.source('movies', movies_data)
+        if sessions_df is None or movies_df is None:
+            return None
+        
+        if high_water is not None:
+            # Compare in the session time zone (UTC), not the driver's local one
+            sessions_df = sessions_df.where(col("created_at") <= lit(high_water.isoformat()).cast("timestamp"))
+        
+        genres = broadcast(movies_df.select(col("id").alias("movie_id"), "genre"))
+        sessions_df = sessions_df.persist()
+        enriched = sessions_df.join(genres, "movie_id").persist()
+        per_movie = sessions_df.groupBy("movie_id") \
+            .agg(
+                count("*").alias("total_views"),
+                spark_sum("completion_rate").alias("completion_sum"),
+                spark_sum("watch_duration_minutes").alias("total_watch_time")
+            ) \
+            .persist()
+        
+        movie_statistics = per_movie.select(
+            col("movie_id").alias("id"),
+            "total_views",
+            "completion_sum",
+            spark_round(col("completion_sum") / col("total_views"), 2).alias("avg_completion_rate"),
+            col("total_watch_time").alias("total_watch_time_minutes")
+        )
         
-        return content_performance.collect()
+        daily_analytics = sessions_df.groupBy("day") \
+            .agg(
+                count("*").alias("total_views"),
+                spark_sum("watch_duration_minutes").alias("total_watch_time"),
+                spark_round(avg("completion_rate"), 2).alias("avg_completion_rate")
+            ) \
+            .select(col("day").alias("id"), col("day").alias("date"), "total_views", "total_watch_time", "avg_completion_rate")
+        
+        genre_analytics = per_movie.join(genres, "movie_id") \
+            .groupBy("genre") \
+            .agg(
+                spark_sum("total_views").alias("total_views"),
+                spark_sum("total_watch_time").alias("total_watch_time"),
+                spark_sum("completion_sum").alias("completion_sum")
+            ) \
+            .select(
+                col("genre").alias("id"),
+                "genre",
+                "total_views",
+                "total_watch_time",
+                "completion_sum",
+                spark_round(col("total_watch_time") / col("total_views"), 2).alias("avg_watch_time"),
+                spark_round(col("completion_sum") / col("total_views"), 2).alias("avg_completion_rate")
+            )
+        
+        hour_start = date_trunc("hour", col("start_time"))
+        session_rollup = enriched.groupBy(hour_start.alias("hour_ts"), "genre", *ROLLUP_DIMENSIONS) \
+            .agg(
+                count("*").alias("session_count"),
+                spark_sum("watch_duration_minutes").alias("watch_minutes"),
+                spark_sum("completion_rate").alias("completion_sum"),
+                spark_sum(coalesce(col("buffering_count"), lit(0))).alias("buffering_sum")
+            ) \
+            .select(
+                concat_ws(
+                    "|",
+                    date_format("hour_ts", "yyyy-MM-dd'T'HH"),
+                    *[coalesce(col(name).cast("string"), lit("")) for name in ("genre",) + ROLLUP_DIMENSIONS]
+                ).alias("id"),
+                col("hour_ts").cast("long").alias("hour_start"),
+                date_format("hour_ts", "yyyy-MM-dd").alias("day"),
+                hour("hour_ts").alias("hour_of_day"),
+                "genre",
+                *ROLLUP_DIMENSIONS,
+                "session_count",
+                "watch_minutes",
+                "completion_sum",
+                "buffering_sum"
+            )
+        
+        outputs = {
+            'movie_statistics': movie_statistics,
+            'daily_analytics': daily_analytics,
+            'genre_analytics': genre_analytics,
+            'session_rollup': session_rollup
+        }
+        try:
+            # Actions submitted from separate threads run as concurrent Spark jobs
+            with ThreadPoolExecutor(max_workers=len(outputs)) as pool:
+                collected = dict(zip(outputs, pool.map(lambda frame: frame.collect(), outputs.values())))
+        finally:
+            for frame in (per_movie, enriched, sessions_df):
+                frame.unpersist()
+        
+        results = {name: [row.asDict() for row in rows] for name, rows in collected.items()}
+        for doc in results['session_rollup']:
+            doc['hour_start'] = utc_datetime(doc['hour_start'])
+        logger.info("Spark aggregates: " + ", ".join(f"{name}={len(rows)}" for name, rows in results.items()))
+        return results
     
-    def simulate_streaming_analytics(self, sessions_data):
+    def simulate_streaming_analytics(self, sessions_data=None):
         """Simulates streaming processing for real-time analytics"""
         logger.info("Simulating Spark Streaming for real-time analytics...")
         
-        if not sessions_data:
+        df = self.source('sessions', sessions_data)
+        if df is None:
             return None
         
-        df = self.spark.createDataFrame(sessions_data)
-        
         # Simulate streaming window aggregations
         # In real streaming, this would process micro-batches
         
@@ -141,9 +471,6 @@ class SparkStreamingProcessor:
             ) \
             .orderBy(desc("session_count"))
         
-        logger.info("Real-time Quality Monitoring:")
-        quality_monitoring.show()
-        
         # Geographic distribution
         geo_distribution = df.groupBy("user_country") \
             .agg(
@@ -152,21 +479,92 @@ class SparkStreamingProcessor:
             ) \
             .orderBy(desc("total_views"))
         
-        logger.info("Geographic Distribution:")
-        geo_distribution.show()
-        
         return {
-            'quality_monitoring': quality_monitoring.collect(),
-            'geo_distribution': geo_distribution.collect()
+            'quality_monitoring': self.materialize("Real-time Quality Monitoring", quality_monitoring),
+            'geo_distribution': self.materialize("Geographic Distribution", geo_distribution)
         }
     
+    def start_streaming_analytics(self, input_dir, mongo_url, db_name, checkpoint_dir,
+                                  trigger_seconds=5, watermark="10 minutes"):
+        """Structured Streaming: live QoE and geographic windows from session event files.
+
+        Reads NDJSON session events dropped into input_dir (a stand-in for a
+        broker topic) and maintains, with an event-time watermark:
+        - 1 minute tumbling windows of quality by (quality, device_type)
+        - 5 minute windows sliding every minute of views by country
+        Each micro-batch upserts the changed windows into the live_quality /
+        live_geo collections served by /api/analytics/live/*. Returns the
+        started StreamingQuery objects.
+        """
+        logger.info(f"Starting Structured Streaming from {input_dir}...")
+        
+        events = self.spark.readStream \
+            .schema(EVENT_SCHEMA) \
+            .option("maxFilesPerTrigger", 1000) \
+            .json(input_dir) \
+            .withWatermark("start_time", watermark)
+        
+        quality = events.groupBy(window("start_time", "1 minute"), "quality", "device_type") \
+            .agg(
+                count("*").alias("session_count"),
+                avg("buffering_count").alias("avg_buffering"),
+                avg("completion_rate").alias("avg_completion")
+            )
+        
+        geo = events.groupBy(window("start_time", "5 minutes", "1 minute"), col("user_country").alias("country")) \
+            .agg(
+                count("*").alias("total_views"),
+                avg("completion_rate").alias("avg_engagement")
+            )
+        
+        queries = []
+        for name, frame, keys in (
+            (LIVE_QUALITY_COLLECTION, quality, ("quality", "device_type")),
+            (LIVE_GEO_COLLECTION, geo, ("country",))
+        ):
+            measures = [column for column in frame.columns if column != "window"]
+            query = frame.select(
+                    col("window.start").cast("long").alias("window_start"),
+                    col("window.end").cast("long").alias("window_end"),
+                    *measures
+                ) \
+                .writeStream \
+                .queryName(name) \
+                .outputMode("update") \
+                .foreachBatch(LiveAggregateSink(mongo_url, db_name, name, keys)) \
+                .option("checkpointLocation", os.path.join(checkpoint_dir, name)) \
+                .trigger(processingTime=f"{trigger_seconds} seconds") \
+                .start()
+            queries.append(query)
+        
+        return queries
+    
     def close(self):
         """Close Spark session"""
+        for _, frame in self.sources.values():
+            frame.unpersist()
+        self.sources.clear()
         self.spark.stop()
         logger.info("Spark session closed")
 
 
 if __name__ == "__main__":
-    processor = SparkStreamingProcessor()
+    # DATASET_PATH: output of parquet_export.py / generate_dataset.py
+    processor = SparkStreamingProcessor(os.environ.get("DATASET_PATH"))
     logger.info("Spark processor initialized for batch and streaming analytics")
+    if os.environ.get("STREAM_INPUT_DIR"):
+        # STREAM_INPUT_DIR: directory session event NDJSON files are dropped into
+        processor.start_streaming_analytics(
+            os.environ["STREAM_INPUT_DIR"],
+            os.environ.get("MONGO_URL", "mongodb://localhost:27017"),
+            os.environ.get("DB_NAME", "streaming_analytics"),
+            os.environ.get("STREAM_CHECKPOINT_DIR", "/tmp/streaming-checkpoints"),
+            trigger_seconds=int(os.environ.get("STREAM_TRIGGER_SECONDS", 5))
+        )
+        processor.spark.streams.awaitAnyTermination()
+    elif processor.dataset_path:
+        processor.batch_process_viewing_patterns()
+        processor.batch_process_content_performance()
+        processor.simulate_streaming_analytics()
+        processor.plan_report()
     processor.close()
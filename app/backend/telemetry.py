@@ -0,0 +1,179 @@
+"""Prometheus metrics for the analytics API: request latency, MongoDB command timings and ETL stages
+
+Request latency is labeled by route template (not the concrete path), so
+each analytics panel gets its own histogram and p99. MongoDB commands are
+timed through pymongo command monitoring and labeled by collection and
+pipeline name; the pipeline name is the command's comment, or the route
+of the request that issued it when the command carries none.
+
+With PROMETHEUS_MULTIPROC_DIR set (several API worker processes), every
+process writes its samples there and /metrics aggregates all of them.
+"""
+import contextvars
+import os
+import time
+from datetime import datetime, timezone
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Gauge, Histogram, generate_latest, multiprocess
+from pymongo import monitoring
+from starlette.routing import Match
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time from request start to the last body byte sent',
+    ['method', 'route', 'status']
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'Requests being processed', ['method', 'route'], multiprocess_mode='livesum'
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command round-trip time as reported by the driver',
+    ['command', 'collection', 'pipeline', 'status'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+ETL_STAGE_SECONDS = Gauge(
+    'etl_stage_duration_seconds', 'Duration of each stage of the last ETL run', ['stage'], multiprocess_mode='max'
+)
+ETL_STAGE_ROWS = Gauge(
+    'etl_stage_rows', 'Rows processed by each stage of the last ETL run', ['stage'], multiprocess_mode='max'
+)
+ETL_LAST_RUN = Gauge(
+    'etl_last_run_timestamp_seconds', 'Unix time the last ETL run finished', multiprocess_mode='max'
+)
+ETL_LAST_RUN_SUCCESS = Gauge(
+    'etl_last_run_success', '1 when the last ETL run completed, 0 when it failed', multiprocess_mode='max'
+)
+
+# Driver chatter that would only add noise to the command histograms
+_IGNORED_COMMANDS = frozenset({
+    'hello', 'ismaster', 'isMaster', 'ping', 'buildinfo', 'buildInfo', 'endSessions',
+    'saslStart', 'saslContinue', 'authenticate', 'getnonce'
+})
+
+# Route of the request being served; motor copies the context into its
+# executor threads, so the command listener sees it too
+_current_route = contextvars.ContextVar('current_route', default='')
+
+
+def route_template(app, scope):
+    """Path template of the route serving scope (e.g. /api/movies/{movie_id}), or 'unmatched'"""
+    route = scope.get('route')
+    if route is None:
+        # Not routed (yet), e.g. answered by a middleware: match the way the router would
+        for candidate in app.routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, 'path', None) or 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    """Latency histogram and in-progress gauge per (method, route); add it last so it times the whole stack"""
+
+    def __init__(self, app, routes_app):
+        self.app = app
+        # The application whose routes label the metrics (middleware wrap it, so it is passed separately)
+        self.routes_app = routes_app
+        self._templates = {}
+
+    def _route(self, scope):
+        key = (scope['method'], scope['path'])
+        template = self._templates.get(key)
+        if template is None:
+            template = route_template(self.routes_app, scope)
+            # Concrete paths of templated routes are unbounded: only exact routes are remembered
+            if '{' not in template and template != 'unmatched':
+                self._templates[key] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        route = self._route(scope)
+        status = 500
+        started = time.perf_counter()
+        observed = False
+
+        def observe():
+            nonlocal observed
+            if not observed:
+                observed = True
+                REQUEST_LATENCY.labels(method, route, str(status)).observe(time.perf_counter() - started)
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                observe()
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        token = _current_route.set(route)
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _current_route.reset(token)
+            in_progress.dec()
+            # Also covers failed requests and streams the client closed
+            observe()
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding MONGO_COMMAND_LATENCY; pass it in the client's event_listeners"""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore names its collection separately; database-level commands have none
+            collection = command.get('collection', '')
+        pipeline = command.get('comment')
+        if pipeline is None:
+            pipeline = _current_route.get()
+        self._pending[(event.connection_id, event.request_id)] = (event.command_name, collection, str(pipeline))
+
+    def _finish(self, event, status):
+        labels = self._pending.pop((event.connection_id, event.request_id), None)
+        if labels is not None:
+            MONGO_COMMAND_LATENCY.labels(*labels, status).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, 'ok')
+
+    def failed(self, event):
+        self._finish(event, 'error')
+
+
+def record_etl_run(run):
+    """Set the ETL gauges from the etl_run document the pipeline stores in etl_state"""
+    if not run:
+        return
+    # Stages of earlier runs (e.g. of another transform engine) are not carried over
+    ETL_STAGE_SECONDS.clear()
+    ETL_STAGE_ROWS.clear()
+    for stage in run.get('stages', []):
+        ETL_STAGE_SECONDS.labels(stage['stage']).set(stage['seconds'])
+        if stage.get('rows') is not None:
+            ETL_STAGE_ROWS.labels(stage['stage']).set(stage['rows'])
+    if run.get('finished_at'):
+        ETL_LAST_RUN.set(datetime.fromisoformat(run['finished_at']).replace(tzinfo=timezone.utc).timestamp())
+    ETL_LAST_RUN_SUCCESS.set(1 if run.get('status') == 'success' else 0)
+
+
+def render_metrics():
+    """(body, content type) of the Prometheus text exposition, across workers in multiprocess mode"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
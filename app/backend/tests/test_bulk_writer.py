@@ -0,0 +1,109 @@
+"""Chunked bulk writes and the bounded batch loader: batching, concurrency bounds and totals"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pymongo import UpdateOne
+
+from bulk_writer import bulk_write_chunked, insert_batches
+
+
+class BulkCollection:
+    name = 'movie_statistics'
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.chunks = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def bulk_write(self, operations, ordered=True):
+        assert ordered is False
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        self.chunks.append(list(operations))
+        return SimpleNamespace(
+            inserted_count=0, matched_count=len(operations), modified_count=len(operations) - 1, upserted_count=1
+        )
+
+    async def insert_many(self, documents, ordered=True):
+        assert ordered is False
+        if self.fail_on is not None and documents[0]['n'] == self.fail_on:
+            raise RuntimeError('insert failed')
+        await asyncio.sleep(0.001)
+        self.chunks.append(list(documents))
+        return SimpleNamespace(inserted_ids=[doc['n'] for doc in documents])
+
+
+def upserts(count):
+    return [UpdateOne({'movie_id': i}, {'$set': {'views': i}}, upsert=True) for i in range(count)]
+
+
+def test_operations_are_written_in_bounded_chunks():
+    collection = BulkCollection()
+    stats = asyncio.run(bulk_write_chunked(collection, upserts(2_500), chunk_size=1_000, max_in_flight=2))
+
+    assert sorted(len(chunk) for chunk in collection.chunks) == [500, 1_000, 1_000]
+    assert collection.peak_in_flight <= 2
+    assert stats['operations'] == 2_500
+    assert stats['matched'] == 2_500
+    assert stats['modified'] == 2_497
+    assert stats['upserted'] == 3
+
+
+def test_async_iterables_are_streamed():
+    async def operations():
+        for operation in upserts(30):
+            yield operation
+
+    collection = BulkCollection()
+    stats = asyncio.run(bulk_write_chunked(collection, operations(), chunk_size=10))
+    assert len(collection.chunks) == 3
+    assert stats['operations'] == 30
+
+
+def test_nothing_is_sent_without_operations():
+    collection = BulkCollection()
+    stats = asyncio.run(bulk_write_chunked(collection, []))
+    assert collection.chunks == []
+    assert stats['operations'] == 0
+
+
+def batches(count, size):
+    for start in range(0, count, size):
+        yield [{'n': n} for n in range(start, min(start + size, count))]
+
+
+def test_sync_batches_are_inserted_by_concurrent_writers():
+    collection = BulkCollection()
+    stats = asyncio.run(insert_batches(collection, batches(1_050, 100), writers=3, queue_depth=2))
+
+    inserted = sorted(doc['n'] for chunk in collection.chunks for doc in chunk)
+    assert inserted == list(range(1_050))
+    assert stats['operations'] == stats['inserted'] == 1_050
+    assert stats['batches'] == 11
+
+
+def test_async_batches_skip_empty_ones():
+    async def generate():
+        yield [{'n': 0}]
+        yield []
+        yield [{'n': 1}, {'n': 2}]
+
+    collection = BulkCollection()
+    stats = asyncio.run(insert_batches(collection, generate(), writers=2))
+    assert stats['batches'] == 2
+    assert stats['inserted'] == 3
+
+
+def test_a_failed_writer_does_not_hang_the_loader():
+    collection = BulkCollection(fail_on=300)
+
+    async def run():
+        # Small queue: without cancellation the producer would block on put() forever
+        await asyncio.wait_for(insert_batches(collection, batches(5_000, 100), writers=2, queue_depth=1), 5)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
@@ -0,0 +1,214 @@
+"""Columnar engine: dictionary publishing, incremental loads and panels against brute-force grouping"""
+import asyncio
+import random
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+import pytest
+
+import columnar_engine
+from columnar_engine import ColumnarEngine, Dictionary
+
+BASE = datetime(2024, 3, 1)
+
+
+class Filter(NamedTuple):
+    """The attributes of server.SessionFilter the engine reads"""
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    device_type: Optional[str] = None
+    country: Optional[str] = None
+
+    @property
+    def is_empty(self):
+        return not (self.start or self.end or self.device_type or self.country)
+
+
+class SessionCollection:
+    """viewing_sessions stand-in answering the engine's created_at range reads"""
+
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+
+    def find(self, query, projection=None, batch_size=None):
+        since = query.get('created_at', {}).get('$gte')
+
+        async def cursor():
+            for doc in sorted(self.docs, key=lambda doc: doc['created_at']):
+                if since is None or doc['created_at'] >= since:
+                    yield dict(doc)
+        return cursor()
+
+    async def estimated_document_count(self):
+        return len(self.docs)
+
+
+def make_sessions(count, seed, first_id=0, created_at=BASE):
+    rng = random.Random(seed)
+    return [
+        {
+            'id': f's{first_id + n}',
+            'user_id': f'u{rng.randrange(40)}',
+            'movie_id': f'm{rng.randrange(12)}',
+            'start_time': BASE + timedelta(minutes=rng.randrange(7 * 24 * 60)),
+            'watch_duration_minutes': rng.randrange(1, 120),
+            'completion_rate': round(rng.random(), 2),
+            'device_type': rng.choice(['tv', 'mobile', 'desktop']),
+            'user_country': rng.choice(['US', 'DE', 'IN', 'BR']),
+            'created_at': created_at
+        }
+        for n in range(count)
+    ]
+
+
+def matches(doc, flt):
+    return (
+        (flt.start is None or doc['start_time'] >= flt.start)
+        and (flt.end is None or doc['start_time'] < flt.end)
+        and (flt.device_type is None or doc['device_type'] == flt.device_type)
+        and (flt.country is None or doc['user_country'] == flt.country)
+    )
+
+
+def expected_devices(docs, flt):
+    views, completion = Counter(), defaultdict(float)
+    for doc in docs:
+        if matches(doc, flt):
+            views[doc['device_type']] += 1
+            completion[doc['device_type']] += doc['completion_rate']
+    return {device: (count, round(completion[device] / count, 2)) for device, count in views.items()}
+
+
+def expected_users(docs, flt, field):
+    users = defaultdict(set)
+    for doc in docs:
+        if matches(doc, flt):
+            users[doc[field]].add(doc['user_id'])
+    return {value: len(ids) for value, ids in users.items()}
+
+
+FILTERS = [
+    Filter(),
+    Filter(device_type='tv'),
+    Filter(country='DE'),
+    Filter(device_type='mobile', country='US'),
+    Filter(start=BASE + timedelta(days=2), end=BASE + timedelta(days=4, hours=3)),
+    Filter(start=BASE + timedelta(days=1), device_type='desktop'),
+    Filter(country='FR'),
+]
+
+
+def assert_panels_match(engine, docs):
+    for flt in FILTERS:
+        devices = {row['device_type']: (row['session_count'], row['avg_completion_rate']) for row in engine.devices(flt)}
+        assert devices == expected_devices(docs, flt), flt
+
+        hours = Counter(doc['start_time'].hour for doc in docs if matches(doc, flt))
+        assert {row['hour']: row['view_count'] for row in engine.hourly_trends(flt)} == dict(hours), flt
+
+        movies = Counter(doc['movie_id'] for doc in docs if matches(doc, flt))
+        assert {row['_id']: row['total_views'] for row in engine.top_movies(flt)} == dict(movies), flt
+
+        assert engine.distinct_users('country', flt) == expected_users(docs, flt, 'user_country'), flt
+
+
+def test_encode_with_added_leaves_the_dictionary_untouched():
+    dictionary = Dictionary(['a', 'b'])
+    added = {}
+    codes = dictionary.encode(['b', 'c', 'a', 'c', 'd'], added=added)
+
+    assert codes.tolist() == [1, 2, 0, 2, 3]
+    assert added == {'c': 2, 'd': 3}
+    assert len(dictionary) == 2
+    assert dictionary.code('c') is None
+
+    # A second batch of the same load continues from the recorded codes
+    assert dictionary.encode(['d', 'e'], added=added).tolist() == [3, 4]
+    dictionary.extend(added)
+    assert list(dictionary) == ['a', 'b', 'c', 'd', 'e']
+    assert dictionary.code('e') == 4
+    assert dictionary[3] == 'd'
+
+
+def test_encode_without_added_publishes_immediately():
+    dictionary = Dictionary()
+    assert dictionary.encode(['x', 'y', 'x']).tolist() == [0, 1, 0]
+    assert dictionary.code('y') == 1
+
+
+def test_panels_match_brute_force_grouping():
+    docs = make_sessions(3000, seed=1)
+    engine = ColumnarEngine(SessionCollection(docs), batch_size=700)
+    asyncio.run(engine.refresh())
+
+    assert engine.size == len(docs)
+    assert_panels_match(engine, docs)
+
+
+def test_incremental_refreshes_add_only_new_sessions(monkeypatch):
+    monkeypatch.setattr(columnar_engine, 'MAX_SEGMENTS', 2)
+    docs = make_sessions(1000, seed=2)
+    collection = SessionCollection(docs)
+    engine = ColumnarEngine(collection, batch_size=300)
+
+    async def run():
+        await engine.refresh()
+        for round_number in range(1, 4):
+            created_at = BASE + timedelta(hours=round_number)
+            new = make_sessions(400, seed=10 + round_number, first_id=len(collection.docs), created_at=created_at)
+            collection.docs += new
+            await engine.refresh()
+            # Nothing new: sessions sharing the watermark are not read twice
+            assert await engine._load_new() == 0
+
+    asyncio.run(run())
+    assert engine.size == len(collection.docs)
+    assert len(engine.segments) <= 2
+    assert_panels_match(engine, collection.docs)
+
+
+def test_shrunk_collection_is_reloaded():
+    collection = SessionCollection(make_sessions(500, seed=3))
+    engine = ColumnarEngine(collection)
+
+    async def run():
+        await engine.refresh()
+        collection.docs = collection.docs[:200]
+        await engine.refresh()
+
+    asyncio.run(run())
+    assert engine.size == 200
+    assert_panels_match(engine, collection.docs)
+
+
+def test_genres_map_movies_through_the_dimension():
+    docs = make_sessions(800, seed=4)
+    engine = ColumnarEngine(SessionCollection(docs))
+    asyncio.run(engine.refresh())
+    movies = {f'm{n}': {'genre': 'Drama' if n % 2 else 'Comedy'} for n in range(10)}
+
+    flt = Filter(country='IN')
+    known = [doc for doc in docs if doc['movie_id'] in movies]
+    views = Counter(movies[doc['movie_id']]['genre'] for doc in known if matches(doc, flt))
+    assert {row['genre']: row['total_views'] for row in engine.genres(flt, movies)} == dict(views)
+
+    users = defaultdict(set)
+    for doc in known:
+        if matches(doc, flt):
+            users[movies[doc['movie_id']]['genre']].add(doc['user_id'])
+    assert engine.genre_distinct_users(flt, movies) == {genre: len(ids) for genre, ids in users.items()}
+
+
+@pytest.mark.parametrize('days', [1, 3])
+def test_daily_trends_are_newest_first(days):
+    docs = make_sessions(600, seed=5)
+    engine = ColumnarEngine(SessionCollection(docs))
+    asyncio.run(engine.refresh())
+
+    per_day = Counter(doc['start_time'].strftime('%Y-%m-%d') for doc in docs)
+    expected = sorted(per_day.items(), reverse=True)[:days]
+    rows = engine.daily_trends(Filter(), days)
+    assert [(row['date'], row['total_views']) for row in rows] == expected
+    assert all(isinstance(row['total_watch_time'], int) for row in rows)
+    assert sum(row['total_views'] for row in engine.daily_trends(Filter(), 30)) == len(docs)
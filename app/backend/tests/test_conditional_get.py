@@ -0,0 +1,161 @@
+"""ETag / 304 handling of the conditional GET middleware"""
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from conditional_get import ConditionalGetMiddleware, parse_if_none_match
+from response_cache import DataVersion, ResponseCache, bump_ingest_version
+
+
+class StaticVersion:
+    def __init__(self, tag='3.0'):
+        self.value = tag
+
+    async def tag(self):
+        return self.value
+
+
+def make_client(version, calls):
+    async def panel(request):
+        calls.append(request.url.path)
+        return JSONResponse({'limit': request.query_params.get('limit')})
+
+    async def large(request):
+        calls.append(request.url.path)
+        return PlainTextResponse('x' * 5000)
+
+    async def missing(request):
+        return JSONResponse({'detail': 'not found'}, status_code=404)
+
+    app = Starlette(
+        routes=[Route('/panel', panel), Route('/large', large), Route('/missing', missing), Route('/other', panel)],
+        middleware=[
+            Middleware(ConditionalGetMiddleware, data_version=version, paths=['/panel', '/large', '/missing'], max_age=30),
+            Middleware(GZipMiddleware, minimum_size=1000)
+        ]
+    )
+    return TestClient(app)
+
+
+def test_if_none_match_lists_are_parsed():
+    assert parse_if_none_match('"a", W/"b" ,, "c-gzip"') == {'"a"', '"b"', '"c-gzip"'}
+    assert parse_if_none_match('*') == {'*'}
+
+
+def test_matching_tag_is_answered_without_running_the_endpoint():
+    calls = []
+    client = make_client(StaticVersion(), calls)
+
+    response = client.get('/panel?limit=5')
+    assert response.status_code == 200
+    etag = response.headers['etag']
+    assert etag.startswith('"3.0-')
+    assert response.headers['cache-control'] == 'public, max-age=30, must-revalidate'
+
+    response = client.get('/panel?limit=5', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == etag
+    assert calls == ['/panel']
+
+    assert client.get('/panel?limit=5', headers={'If-None-Match': f'W/{etag}, "other"'}).status_code == 304
+    assert client.get('/panel?limit=5', headers={'If-None-Match': '*'}).status_code == 304
+
+
+def test_tag_covers_the_query_but_not_its_order():
+    client = make_client(StaticVersion(), [])
+    tag = client.get('/panel?limit=5&genre=Drama').headers['etag']
+    assert client.get('/panel?genre=Drama&limit=5').headers['etag'] == tag
+    assert client.get('/panel?limit=6&genre=Drama').headers['etag'] != tag
+    assert client.get('/panel?limit=5&genre=Drama', headers={'If-None-Match': tag}).status_code == 304
+    assert client.get('/panel?limit=6&genre=Drama', headers={'If-None-Match': tag}).status_code == 200
+
+
+def test_new_data_version_invalidates_the_tag():
+    version = StaticVersion('3.0')
+    calls = []
+    client = make_client(version, calls)
+    etag = client.get('/panel').headers['etag']
+
+    # An ingest outside the ETL bumps the second part of the version
+    version.value = '3.1'
+    response = client.get('/panel', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'].startswith('"3.1-')
+    assert len(calls) == 2
+
+
+def test_compressed_representations_get_their_own_tag():
+    client = make_client(StaticVersion(), [])
+    compressed = client.get('/large', headers={'Accept-Encoding': 'gzip'})
+    plain = client.get('/large', headers={'Accept-Encoding': 'identity'})
+
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert compressed.headers['etag'] == plain.headers['etag'][:-1] + '-gzip"'
+    assert compressed.headers['vary'] == 'Accept-Encoding, Authorization'
+    # Either coding of the current version revalidates
+    response = client.get('/large', headers={'If-None-Match': compressed.headers['etag'], 'Accept-Encoding': 'identity'})
+    assert response.status_code == 304
+    assert response.headers['etag'] == compressed.headers['etag']
+
+
+def test_other_requests_are_passed_through():
+    client = make_client(StaticVersion(), [])
+    assert 'etag' not in client.get('/other').headers
+    assert 'etag' not in client.get('/missing').headers
+    assert client.post('/panel').status_code == 405
+
+
+class StateCollection:
+    """etl_state stand-in holding the data_version document"""
+
+    def __init__(self):
+        self.doc = {'id': 'data_version', 'version': 1}
+
+    async def find_one(self, query, projection=None):
+        return dict(self.doc)
+
+    async def update_one(self, query, update, upsert=False):
+        for field, amount in update['$inc'].items():
+            self.doc[field] = self.doc.get(field, 0) + amount
+
+
+def test_ingest_between_cache_fill_and_revalidation_serves_fresh_data():
+    state = StateCollection()
+    version = DataVersion(state, refresh_interval=0)
+    cache = ResponseCache(ttl_seconds=300)
+    sessions = ['s1']
+
+    @cache.cached('sessions', version)
+    async def count_sessions():
+        return {'sessions': len(sessions)}
+
+    async def endpoint(request):
+        return JSONResponse(await count_sessions())
+
+    app = Starlette(
+        routes=[Route('/sessions', endpoint)],
+        middleware=[Middleware(ConditionalGetMiddleware, data_version=version, paths=['/sessions'])]
+    )
+    client = TestClient(app)
+
+    first = client.get('/sessions')
+    assert first.json() == {'sessions': 1}
+
+    # A session posted to the API: inserted, then the ingest counter is bumped
+    sessions.append('s2')
+    asyncio.run(bump_ingest_version(state))
+
+    second = client.get('/sessions', headers={'If-None-Match': first.headers['etag']})
+    assert second.status_code == 200
+    assert second.json() == {'sessions': 2}
+    assert second.headers['etag'] != first.headers['etag']
+
+    third = client.get('/sessions', headers={'If-None-Match': second.headers['etag']})
+    assert third.status_code == 304
+    assert cache.stats()['misses'] == 2
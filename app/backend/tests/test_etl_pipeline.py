@@ -0,0 +1,135 @@
+"""Transform window and watermark bookkeeping of the ETL pipeline"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from etl_pipeline import StreamingETLPipeline
+
+T0 = datetime(2024, 3, 1, 12, 0)
+
+
+class SessionCollection:
+    """viewing_sessions stand-in answering the newest-created_at lookup"""
+
+    def __init__(self, created=()):
+        self.docs = [{'id': f's{n}', 'created_at': created_at} for n, created_at in enumerate(created)]
+
+    async def find_one(self, query, projection=None, sort=None):
+        assert sort == [('created_at', -1)]
+        docs = [doc for doc in self.docs if doc.get('created_at') is not None]
+        return {'created_at': max(doc['created_at'] for doc in docs)} if docs else None
+
+
+class StateCollection:
+    """etl_state stand-in keyed by id"""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, query, projection=None):
+        doc = self.docs.get(query['id'])
+        return dict(doc) if doc else None
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query['id'], {'id': query['id']})
+        doc.update(update.get('$set', {}))
+
+
+class Database:
+    def __init__(self, sessions):
+        self.viewing_sessions = sessions
+        self.etl_state = StateCollection()
+
+    def __getattr__(self, name):
+        raise AssertionError(f"the transform should not touch {name}")
+
+
+def make_pipeline(sessions):
+    pipeline = StreamingETLPipeline('mongodb://localhost:27017', 'test')
+    pipeline.db = Database(sessions)
+    return pipeline
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_no_sessions_means_no_window():
+    pipeline = make_pipeline(SessionCollection())
+    assert run(pipeline.get_transform_window()) == (None, None, None)
+    assert run(pipeline.get_transform_window(incremental=True)) == (None, None, None)
+
+
+def test_sessions_without_created_at_are_not_a_high_water_mark():
+    sessions = SessionCollection()
+    sessions.docs.append({'id': 'legacy'})
+    pipeline = make_pipeline(sessions)
+    assert run(pipeline.get_transform_window()) == (None, None, None)
+
+
+def test_empty_collection_transform_does_nothing():
+    pipeline = make_pipeline(SessionCollection())
+    run(pipeline.transform_and_aggregate())
+    run(pipeline.transform_and_aggregate(incremental=True))
+    assert pipeline.db.etl_state.docs == {}
+
+
+def test_full_window_covers_everything_up_to_the_newest_session():
+    pipeline = make_pipeline(SessionCollection([T0, T0 + timedelta(minutes=5)]))
+    window, low_water, high_water = run(pipeline.get_transform_window())
+    assert window == {'created_at': {'$lte': T0 + timedelta(minutes=5)}}
+    assert low_water is None
+    assert high_water == T0 + timedelta(minutes=5)
+
+
+def test_incremental_window_starts_after_the_saved_watermark():
+    sessions = SessionCollection([T0, T0 + timedelta(minutes=5)])
+    pipeline = make_pipeline(sessions)
+
+    # Nothing recorded yet: the first incremental run is a full one
+    window, low_water, high_water = run(pipeline.get_transform_window(incremental=True))
+    assert low_water is None
+    assert window == {'created_at': {'$lte': high_water}}
+
+    run(pipeline.save_transform_watermark(high_water))
+    sessions.docs.append({'id': 'new', 'created_at': T0 + timedelta(minutes=9)})
+    window, low_water, high_water = run(pipeline.get_transform_window(incremental=True))
+    assert low_water == T0 + timedelta(minutes=5)
+    assert high_water == T0 + timedelta(minutes=9)
+    assert window == {'created_at': {'$gt': low_water, '$lte': high_water}}
+
+    # A full run ignores the watermark
+    assert run(pipeline.get_transform_window())[1] is None
+
+
+def test_incremental_transform_without_new_sessions_keeps_the_watermark():
+    pipeline = make_pipeline(SessionCollection([T0]))
+    run(pipeline.save_transform_watermark(T0))
+    saved = dict(pipeline.db.etl_state.docs['transform_watermark'])
+
+    run(pipeline.transform_and_aggregate(incremental=True))
+    assert pipeline.db.etl_state.docs['transform_watermark'] == saved
+
+
+def test_unknown_engines_are_rejected_before_reading_anything():
+    pipeline = make_pipeline(SessionCollection([T0]))
+    with pytest.raises(ValueError):
+        run(pipeline.transform_and_aggregate(engine='duckdb'))
+
+
+def test_window_waits_for_recent_sessions_to_settle():
+    pipeline = make_pipeline(SessionCollection([datetime.utcnow()]))
+    pipeline.ingest_settle_seconds = 0.2
+
+    started = time.perf_counter()
+    window, _, high_water = run(pipeline.get_transform_window())
+    # A batch stamped just before high_water could still be committing until then
+    assert time.perf_counter() - started >= 0.15
+    assert window == {'created_at': {'$lte': high_water}}
+
+    # Sessions older than the settle time are used at once
+    started = time.perf_counter()
+    run(make_pipeline(SessionCollection([T0])).get_transform_window())
+    assert time.perf_counter() - started < 0.1
@@ -0,0 +1,175 @@
+"""Fast response path: content negotiation, projection, body memo and parity with the standard path"""
+import gzip
+import json
+from datetime import datetime
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+import fast_response
+from fast_response import FastJSON, accepted_encodings, choose_encoding, dumps, project
+
+
+class Trend(BaseModel):
+    date: str
+    total_views: int
+    avg_completion_rate: float
+    updated_at: datetime
+
+
+ROWS = [
+    {
+        'date': f'2024-03-{day:02d}', 'total_views': day * 100, 'avg_completion_rate': round(day / 40, 2),
+        'updated_at': datetime(2024, 3, day, 12, 30, 15, 250000), '_id': f'2024-03-{day:02d}', 'internal': [day]
+    }
+    for day in range(1, 31)
+]
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(fast_response, 'orjson', None)
+    elif fast_response.orjson is None:
+        pytest.skip('orjson is not installed')
+    return request.param
+
+
+@pytest.fixture
+def fake_brotli(monkeypatch):
+    monkeypatch.setattr(fast_response, 'brotli', SimpleNamespace(compress=lambda body, quality: b'br:' + body))
+
+
+def test_accept_encoding_qualities_are_parsed():
+    assert accepted_encodings('gzip, br;q=0.8, identity;q=0, *;q=0.1') == {
+        'gzip': 1.0, 'br': 0.8, 'identity': 0.0, '*': 0.1
+    }
+    assert accepted_encodings('GZIP ; q=0.5,, deflate;q=bad') == {'gzip': 0.5, 'deflate': 0.0}
+    assert accepted_encodings('') == {}
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip, br', 'br'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('gzip;q=0, br;q=0', None),
+    ('*', 'br'),
+    ('*, br;q=0', 'gzip'),
+    ('*;q=0', None),
+    ('deflate', None),
+    ('gzip;q=0.5, identity', None),
+    ('gzip;q=0.5, identity;q=0', 'gzip'),
+])
+def test_preferred_coding_is_chosen(header, expected):
+    assert choose_encoding(header, ('br', 'gzip')) == expected
+
+
+def test_brotli_is_not_offered_unless_installed():
+    assert choose_encoding('br, gzip;q=0.5', ('gzip',)) == 'gzip'
+    assert choose_encoding('br', ('gzip',)) is None
+
+
+def test_rows_are_projected_onto_the_model_fields():
+    fields = tuple(Trend.model_fields)
+    assert project(ROWS[:1], fields) == [
+        {key: ROWS[0][key] for key in ('date', 'total_views', 'avg_completion_rate', 'updated_at')}
+    ]
+    assert project({'date': 'd', 'extra': 1}, fields) == {'date': 'd'}
+    assert project([{'date': 'd'}, 'raw'], fields) == [{'date': 'd'}, 'raw']
+    assert project(42, fields) == 42
+
+
+def test_encoders_agree(encoder):
+    content = {'n': 1, 'x': 0.25, 'when': datetime(2024, 3, 1, 12, 0, 0, 5), 'nested': [Trend(**ROWS[0])]}
+    assert json.loads(dumps(content)) == {
+        'n': 1, 'x': 0.25, 'when': '2024-03-01T12:00:00.000005',
+        'nested': [Trend(**ROWS[0]).model_dump(mode='json')]
+    }
+
+
+def test_bodies_are_memoized_per_live_object():
+    fast = FastJSON(enabled=True, max_entries=2)
+    value = [{'a': 1}]
+    body = fast.encode(value)
+    assert fast.encode(value) is body
+    # An equal but distinct object (a new cache entry) is encoded again
+    assert fast.encode([{'a': 1}]) is not body
+    assert fast.stats()['hits'] == 1
+
+
+def test_evicted_ids_never_return_another_objects_body():
+    fast = FastJSON(enabled=True, max_entries=1)
+    for n in range(200):
+        # Short-lived objects: CPython reuses their ids as soon as they are freed
+        assert json.loads(fast.encode({'n': n}).body) == {'n': n}
+    assert fast.stats()['encoded_bodies'] == 1
+
+
+def test_compressed_variants_are_computed_once():
+    body = FastJSON(enabled=True).encode(ROWS)
+    compressed = body.compressed('gzip')
+    assert body.compressed('gzip') is compressed
+    assert json.loads(gzip.decompress(compressed)) == json.loads(body.body)
+
+
+def make_app(fast):
+    app = FastAPI()
+
+    @app.get('/standard', response_model=List[Trend])
+    async def standard():
+        return ROWS
+
+    @app.get('/fast', response_model=List[Trend])
+    @fast.endpoint(Trend)
+    async def fast_rows():
+        return ROWS
+
+    @app.get('/small')
+    @fast.endpoint()
+    async def small():
+        return {'ok': True}
+
+    return TestClient(app)
+
+
+def test_fast_bodies_decode_to_the_standard_json(encoder):
+    client = make_app(FastJSON(enabled=True, min_size=1024))
+    standard = client.get('/standard', headers={'Accept-Encoding': 'identity'})
+    fast = client.get('/fast', headers={'Accept-Encoding': 'identity'})
+
+    assert fast.headers['content-type'] == 'application/json'
+    assert 'content-encoding' not in fast.headers
+    assert fast.json() == standard.json()
+
+    compressed = client.get('/fast', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert compressed.headers['vary'] == 'Accept-Encoding'
+    assert compressed.json() == standard.json()
+
+
+def test_brotli_is_used_when_preferred_and_installed(fake_brotli):
+    client = make_app(FastJSON(enabled=True, min_size=1024))
+    response = client.get('/fast', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['content-encoding'] == 'br'
+
+
+def test_small_bodies_are_not_compressed():
+    client = make_app(FastJSON(enabled=True, min_size=1024))
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert response.json() == {'ok': True}
+    assert 'content-encoding' not in response.headers
+
+
+def test_disabled_path_leaves_the_endpoint_alone():
+    fast = FastJSON(enabled=False)
+
+    async def endpoint():
+        return ROWS
+
+    assert fast.endpoint(Trend)(endpoint) is endpoint
@@ -0,0 +1,55 @@
+"""Scale-factor dataset CLI: sizes, layout and reproducibility"""
+import json
+
+from typer.testing import CliRunner
+
+from generate_dataset import app, split_evenly, table_rows
+
+runner = CliRunner()
+
+
+def generate(output, *args):
+    result = runner.invoke(app, [
+        '--scale-factor', '0.02', '--format', 'ndjson', '--end-date', '2024-03-31', '--output', str(output), *args
+    ])
+    assert result.exit_code == 0, result.output
+    return json.loads((output / '_manifest.json').read_text())
+
+
+def read_table(output, table):
+    rows = []
+    for path in sorted(output.glob(f'{table}/*/*.ndjson')):
+        rows += [json.loads(line) for line in path.read_text().splitlines()]
+    return rows
+
+
+def test_table_sizes_scale_linearly():
+    assert table_rows(1) == {'movies': 200, 'users': 5000, 'sessions': 50000, 'ratings': 20000}
+    assert table_rows(0.0001)['movies'] == 1
+    assert split_evenly(10, 3) == [4, 3, 3]
+
+
+def test_dataset_layout_and_manifest(tmp_path):
+    manifest = generate(tmp_path, '--workers', '1')
+
+    assert manifest['rows'] == {'movies': 4, 'users': 100, 'sessions': 1000, 'ratings': 400}
+    sessions = read_table(tmp_path, 'sessions')
+    ratings = read_table(tmp_path, 'ratings')
+    assert len(sessions) == 1000
+    assert len(ratings) == 400
+    assert all(path.name.startswith('day=2024-') for path in (tmp_path / 'sessions').iterdir())
+    assert len({(row['user_id'], row['movie_id']) for row in ratings}) == len(ratings)
+
+
+def test_output_does_not_depend_on_workers(tmp_path):
+    generate(tmp_path / 'one', '--workers', '1')
+    generate(tmp_path / 'two', '--workers', '2')
+    for table in ('sessions', 'ratings'):
+        assert read_table(tmp_path / 'one', table) == read_table(tmp_path / 'two', table)
+
+
+def test_existing_dataset_needs_overwrite(tmp_path):
+    generate(tmp_path, '--workers', '1')
+    result = runner.invoke(app, ['--scale-factor', '0.02', '--output', str(tmp_path)])
+    assert result.exit_code != 0
+    generate(tmp_path, '--workers', '1', '--overwrite')
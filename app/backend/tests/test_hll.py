@@ -0,0 +1,84 @@
+"""HyperLogLog accuracy, merging and storage round trips"""
+import asyncio
+
+import pytest
+
+from hll import HyperLogLog, merge_sketches, merge_sketches_by
+
+
+class SketchCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        async def cursor():
+            for doc in self.docs:
+                yield doc
+        return cursor()
+
+
+def sketch_of(values, precision=11):
+    sketch = HyperLogLog(precision)
+    sketch.update(values)
+    return sketch
+
+
+@pytest.mark.parametrize('cardinality', [10, 1_000, 50_000])
+def test_count_is_within_the_error_bound(cardinality):
+    sketch = sketch_of(f'user_{i}' for i in range(cardinality))
+    # Three standard errors; small cardinalities are answered by linear counting
+    assert abs(sketch.count() - cardinality) <= 3 * sketch.relative_error * cardinality + 1
+
+
+def test_duplicates_do_not_change_the_count():
+    sketch = sketch_of(f'user_{i}' for i in range(1_000))
+    before = sketch.count()
+    sketch.update(f'user_{i}' for i in range(1_000))
+    sketch.add('user_1')
+    assert sketch.count() == before
+
+
+def test_merge_counts_the_union():
+    left = sketch_of(f'user_{i}' for i in range(0, 30_000))
+    right = sketch_of(f'user_{i}' for i in range(20_000, 50_000))
+    union = sketch_of(f'user_{i}' for i in range(50_000))
+    assert left.merge(right) is left
+    assert left.count() == union.count()
+
+
+def test_merge_rejects_another_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(11).merge(HyperLogLog(12))
+
+
+def test_precision_is_bounded():
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+    with pytest.raises(ValueError):
+        HyperLogLog(17)
+
+
+def test_binary_round_trip_keeps_registers():
+    sketch = sketch_of(range(5_000), precision=12)
+    restored = HyperLogLog.from_binary(sketch.to_binary(), precision=12)
+    assert (restored.registers == sketch.registers).all()
+    assert restored.count() == sketch.count()
+    # The restored registers are writable, so the sketch can keep merging
+    restored.merge(sketch)
+
+
+def test_stored_sketches_merge_per_field():
+    docs = [
+        {'genre': 'Drama', 'registers': sketch_of(range(0, 100)).to_binary()},
+        {'genre': 'Drama', 'registers': sketch_of(range(50, 150)).to_binary()},
+        {'genre': 'Comedy', 'registers': sketch_of(range(10)).to_binary(), 'precision': 11},
+    ]
+    collection = SketchCollection(docs)
+
+    merged, merged_count = asyncio.run(merge_sketches(collection, {}))
+    assert merged_count == 3
+    assert merged.count() == sketch_of(range(150)).count()
+
+    by_genre = asyncio.run(merge_sketches_by(collection, {}, 'genre'))
+    assert by_genre['Drama'].count() == sketch_of(range(150)).count()
+    assert by_genre['Comedy'].count() == sketch_of(range(10)).count()
@@ -0,0 +1,198 @@
+"""Live dashboard fan-out: state diffs, frame coalescing and the shared tick"""
+import asyncio
+import json
+
+from live_broadcast import Broadcaster, Subscriber, diff, merge
+
+
+def test_diff_keeps_only_changed_keys_at_every_level():
+    previous = {'sessions': 10, 'devices': {'tv': 4, 'mobile': 6}, 'countries': {'US': 10}}
+    current = {'sessions': 12, 'devices': {'tv': 6, 'mobile': 6}, 'countries': {'US': 10}, 'new': [1]}
+
+    changes = diff(previous, current)
+    assert changes == {'sessions': 12, 'devices': {'tv': 6}, 'new': [1]}
+    assert merge(previous, changes) == current
+    assert diff(current, current) == {}
+
+
+def test_merge_does_not_modify_its_inputs():
+    base = {'devices': {'tv': 1}}
+    merged = merge(base, {'devices': {'mobile': 2}, 'sessions': 3})
+    assert merged == {'devices': {'tv': 1, 'mobile': 2}, 'sessions': 3}
+    assert base == {'devices': {'tv': 1}}
+
+
+def test_pending_frames_are_coalesced():
+    async def scenario():
+        subscriber = Subscriber()
+        assert subscriber.push('snapshot', 1, {'a': 1, 'b': {'x': 1}}, '{"a":1,"b":{"x":1}}') is False
+        assert subscriber.push('delta', 2, {'b': {'y': 2}}, '{"b":{"y":2}}') is True
+        event, sequence, text = await subscriber.take(1)
+        # Still a snapshot: the merged frame is the whole state
+        assert (event, sequence) == ('snapshot', 2)
+        assert json.loads(text) == {'a': 1, 'b': {'x': 1, 'y': 2}}
+
+        assert subscriber.push('delta', 3, {'a': 5}, '{"a":5}') is False
+        assert await subscriber.take(1) == ('delta', 3, '{"a":5}')
+        assert await subscriber.take(0.01) is None
+
+    asyncio.run(scenario())
+
+
+class LiveState:
+    """compute() stand-in: the session count grows by one on every tick"""
+
+    def __init__(self, fail_on=()):
+        self.calls = 0
+        self.fail_on = fail_on
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls in self.fail_on:
+            raise RuntimeError('database unavailable')
+        return {'sessions': self.calls, 'devices': {'tv': 1}}
+
+
+async def frames(stream, count):
+    return [await stream.__anext__() for _ in range(count)]
+
+
+def test_one_computation_per_tick_is_shared_by_all_subscribers():
+    compute = LiveState()
+    broadcaster = Broadcaster(compute, interval=0.02)
+
+    async def scenario():
+        streams = [broadcaster.subscribe(keepalive=1) for _ in range(3)]
+        received = await asyncio.gather(*(frames(stream, 3) for stream in streams))
+        ticks = broadcaster.stats()['ticks']
+        for stream in streams:
+            await stream.aclose()
+        await asyncio.sleep(0.05)
+        return received, ticks
+
+    received, ticks = asyncio.run(scenario())
+    assert compute.calls == ticks
+    assert ticks <= 5
+    for stream_frames in received:
+        assert [event for event, _, _ in stream_frames] == ['snapshot', 'delta', 'delta']
+        assert json.loads(stream_frames[0][2]) == {'sessions': 1, 'devices': {'tv': 1}}
+        # Unchanged keys are left out of deltas
+        assert json.loads(stream_frames[1][2]) == {'sessions': 2}
+        assert [sequence for _, sequence, _ in stream_frames] == [1, 2, 3]
+    # Nobody subscribed any more: the ticking stops
+    assert broadcaster.stats()['subscribers'] == 0
+    assert broadcaster._task is None
+
+
+def test_slow_subscribers_get_merged_frames():
+    compute = LiveState()
+    broadcaster = Broadcaster(compute, interval=0.01)
+
+    async def scenario():
+        stream = broadcaster.subscribe(keepalive=1)
+        first = await stream.__anext__()
+        await asyncio.sleep(0.1)
+        second = await stream.__anext__()
+        await stream.aclose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first[0] == 'snapshot'
+    assert second[0] == 'delta'
+    # Several ticks were folded into one frame carrying the latest value
+    assert second[1] > first[1] + 1
+    assert json.loads(second[2]) == {'sessions': second[1]}
+    assert broadcaster.stats()['coalesced'] >= 1
+
+
+def test_late_subscribers_start_from_the_current_state():
+    broadcaster = Broadcaster(LiveState(), interval=0.01)
+
+    async def scenario():
+        early = broadcaster.subscribe(keepalive=1)
+        await frames(early, 3)
+        late = broadcaster.subscribe(keepalive=1)
+        event, sequence, text = await late.__anext__()
+        await early.aclose()
+        await late.aclose()
+        return event, sequence, json.loads(text)
+
+    event, sequence, state = asyncio.run(scenario())
+    assert event == 'snapshot'
+    assert state['sessions'] >= 3
+    assert state['devices'] == {'tv': 1}
+
+
+def test_failed_ticks_are_skipped_and_keepalives_sent():
+    compute = LiveState(fail_on={2, 3, 4, 5, 6, 7, 8, 9, 10})
+    broadcaster = Broadcaster(compute, interval=0.01)
+
+    async def scenario():
+        stream = broadcaster.subscribe(keepalive=0.03)
+        received = await frames(stream, 2)
+        await stream.aclose()
+        return received
+
+    snapshot, keepalive = asyncio.run(scenario())
+    assert snapshot[0] == 'snapshot'
+    assert keepalive == (None, None, None)
+    assert broadcaster.stats()['errors'] >= 1
+
+
+def test_removed_keys_are_sent_as_tombstones():
+    previous = {'ingest': {'devices': {'tv': 2, 'mobile': 1}, 'sessions': 3}, 'old': 1}
+    current = {'ingest': {'devices': {'tv': 2}, 'sessions': 2}}
+
+    changes = diff(previous, current)
+    assert changes == {'ingest': {'devices': {'mobile': None}, 'sessions': 2}, 'old': None}
+    assert merge(previous, changes) == current
+
+
+def test_coalesced_deltas_keep_tombstones():
+    async def scenario():
+        client_state = {'devices': {'tv': 2, 'mobile': 1}}
+        subscriber = Subscriber()
+        subscriber.started = True
+        subscriber.push('delta', 1, {'devices': {'tv': 3}}, None)
+        subscriber.push('delta', 2, {'devices': {'mobile': None}}, None)
+        event, _, text = await subscriber.take(1)
+        assert event == 'delta'
+        assert json.loads(text) == {'devices': {'tv': 3, 'mobile': None}}
+        return merge(client_state, json.loads(text))
+
+    assert asyncio.run(scenario()) == {'devices': {'tv': 3}}
+
+
+def test_a_pending_snapshot_drops_removed_keys():
+    async def scenario():
+        subscriber = Subscriber()
+        subscriber.push('snapshot', 1, {'devices': {'tv': 2, 'mobile': 1}}, None)
+        subscriber.push('delta', 2, {'devices': {'mobile': None}}, None)
+        return await subscriber.take(1)
+
+    event, _, text = asyncio.run(scenario())
+    assert event == 'snapshot'
+    assert json.loads(text) == {'devices': {'tv': 2}}
+
+
+def test_devices_aging_out_of_the_window_leave_every_client():
+    states = iter([
+        {'ingest': {'devices': {'tv': 1, 'mobile': 1}}},
+        {'ingest': {'devices': {'tv': 1}}},
+    ])
+    last = {'ingest': {'devices': {'tv': 1}}}
+
+    async def compute():
+        return next(states, last)
+
+    broadcaster = Broadcaster(compute, interval=0.01)
+
+    async def scenario():
+        stream = broadcaster.subscribe(keepalive=1)
+        received = await frames(stream, 2)
+        await stream.aclose()
+        return received
+
+    snapshot, delta = asyncio.run(scenario())
+    client_state = merge(json.loads(snapshot[2]), json.loads(delta[2]))
+    assert client_state == {'ingest': {'devices': {'tv': 1}}}
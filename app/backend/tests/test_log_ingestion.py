@@ -0,0 +1,102 @@
+"""Log record validation and parsing of NDJSON/CSV session logs"""
+import gzip
+from datetime import datetime
+
+import pytest
+
+from log_ingestion import discover_log_files, file_fingerprint, iter_raw_records, parse_record, parse_timestamp
+
+INGESTED_AT = datetime(2024, 3, 2, 12, 0)
+
+
+def raw_record(**overrides):
+    record = {
+        'id': 's1', 'user_id': 7, 'movie_id': 'm3', 'start_time': '2024-03-01T22:30:00',
+        'watch_duration_minutes': '45', 'completion_rate': '0.456', 'device_type': 'tv', 'user_country': 'US'
+    }
+    record.update(overrides)
+    return record
+
+
+@pytest.mark.parametrize('value', [
+    '2024-03-01T22:30:00',
+    '2024-03-01T22:30:00+00:00',
+    '2024-03-02T00:30:00+02:00',
+    1709332200,
+    '1709332200',
+    1709332200.0,
+    datetime(2024, 3, 1, 22, 30),
+])
+def test_timestamps_are_normalized_to_naive_utc(value):
+    assert parse_timestamp(value) == datetime(2024, 3, 1, 22, 30)
+
+
+def test_record_is_normalized_to_the_session_schema():
+    session = parse_record(raw_record(), INGESTED_AT)
+    assert session['id'] == 's1'
+    assert session['user_id'] == '7'
+    assert session['start_time'] == datetime(2024, 3, 1, 22, 30)
+    assert session['end_time'] == datetime(2024, 3, 1, 23, 15)
+    assert session['day'] == '2024-03-01'
+    assert session['hour_of_day'] == 22
+    assert session['watch_duration_minutes'] == 45
+    assert session['completion_rate'] == 0.46
+    assert session['buffering_count'] == 0
+    assert session['quality'] is None
+    assert session['created_at'] == INGESTED_AT
+
+
+def test_explicit_end_time_and_optional_fields_are_kept():
+    session = parse_record(
+        raw_record(end_time='2024-03-01T23:00:00Z', buffering_count='2', quality='HD', subscription_type=''),
+        INGESTED_AT
+    )
+    assert session['end_time'] == datetime(2024, 3, 1, 23, 0)
+    assert session['buffering_count'] == 2
+    assert session['quality'] == 'HD'
+    assert session['subscription_type'] is None
+
+
+@pytest.mark.parametrize('overrides, message', [
+    ({'user_id': None}, 'missing user_id'),
+    ({'movie_id': '', 'device_type': None}, 'missing movie_id, device_type'),
+    ({'watch_duration_minutes': '-1'}, 'negative watch_duration_minutes'),
+    ({'completion_rate': '1.5'}, r'completion_rate outside \[0, 1\]'),
+    ({'completion_rate': -0.1}, r'completion_rate outside \[0, 1\]'),
+])
+def test_invalid_records_are_rejected(overrides, message):
+    with pytest.raises(ValueError, match=message):
+        parse_record(raw_record(**overrides), INGESTED_AT)
+
+
+@pytest.mark.parametrize('overrides', [
+    {'start_time': 'yesterday'},
+    {'watch_duration_minutes': 'long'},
+    {'completion_rate': 'n/a'},
+])
+def test_unparseable_values_raise_value_error(overrides):
+    with pytest.raises(ValueError):
+        parse_record(raw_record(**overrides), INGESTED_AT)
+
+
+def test_ndjson_and_csv_logs_are_read(tmp_path):
+    ndjson = tmp_path / 'sessions.ndjson.1'
+    ndjson.write_text('{"id": "a"}\n\nnot json\n[1, 2]\n')
+    csv_log = tmp_path / 'sessions.csv.gz'
+    with gzip.open(csv_log, 'wt', encoding='utf-8') as f:
+        f.write('id,user_id\nb,1\nc,2\n')
+    (tmp_path / 'notes.txt').write_text('ignored')
+
+    assert discover_log_files(tmp_path) == [csv_log, ndjson]
+    assert list(iter_raw_records(ndjson)) == [(1, {'id': 'a'}), (3, None), (4, None)]
+    assert list(iter_raw_records(csv_log)) == [(2, {'id': 'b', 'user_id': '1'}), (3, {'id': 'c', 'user_id': '2'})]
+
+
+def test_renamed_file_keeps_its_fingerprint(tmp_path):
+    log = tmp_path / 'sessions.ndjson'
+    log.write_text('{"id": "a"}\n' * 20000)
+    fingerprint = file_fingerprint(log)
+    log.rename(tmp_path / 'sessions.ndjson.1')
+    assert file_fingerprint(tmp_path / 'sessions.ndjson.1') == fingerprint
+    (tmp_path / 'sessions.ndjson.1').write_text('{"id": "b"}\n' * 20000)
+    assert file_fingerprint(tmp_path / 'sessions.ndjson.1') != fingerprint
@@ -0,0 +1,130 @@
+"""ResponseCache TTL/LRU/in-flight behaviour and DataVersion refreshes"""
+import asyncio
+
+from response_cache import _MISS, DataVersion, ResponseCache, bump_ingest_version
+
+
+class StaticVersion:
+    def __init__(self, version=1):
+        self.version = version
+
+    async def tag(self):
+        return f'{self.version}.0'
+
+
+class VersionCollection:
+    """etl_state stand-in holding the data_version document"""
+
+    def __init__(self, doc=None):
+        self.doc = doc
+        self.reads = 0
+
+    async def find_one(self, query, projection=None):
+        self.reads += 1
+        return dict(self.doc) if self.doc else None
+
+    async def update_one(self, query, update, upsert=False):
+        self.doc = self.doc or {'id': query['id']}
+        for field, amount in update['$inc'].items():
+            self.doc[field] = self.doc.get(field, 0) + amount
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('response_cache.time.monotonic', lambda: now[0])
+    cache = ResponseCache(ttl_seconds=10)
+    cache.set('key', 1, 'value')
+    now[0] += 9.9
+    assert cache.get('key', 1) == 'value'
+    now[0] += 0.2
+    assert cache.get('key', 1) is _MISS
+    assert cache.stats()['entries'] == 0
+
+
+def test_entry_of_another_version_is_a_miss():
+    cache = ResponseCache()
+    cache.set('key', 1, 'value')
+    assert cache.get('key', 2) is _MISS
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set('a', 1, 'A')
+    cache.set('b', 1, 'B')
+    cache.get('a', 1)
+    cache.set('c', 1, 'C')
+    assert cache.get('a', 1) == 'A'
+    assert cache.get('c', 1) == 'C'
+    assert cache.get('b', 1) is _MISS
+
+
+def test_cached_endpoint_keys_on_parameters_and_version():
+    cache = ResponseCache()
+    version = StaticVersion()
+    calls = []
+
+    @cache.cached('panel', version)
+    async def endpoint(limit=10):
+        calls.append(limit)
+        return {'limit': limit, 'call': len(calls)}
+
+    async def run():
+        first = await endpoint(limit=10)
+        assert await endpoint(limit=10) is first
+        await endpoint(limit=20)
+        version.version = 2
+        await endpoint(limit=10)
+
+    asyncio.run(run())
+    assert calls == [10, 20, 10]
+    assert cache.stats()['hits'] == 1
+    assert endpoint.cache_name == 'panel'
+
+
+def test_concurrent_misses_share_one_computation():
+    cache = ResponseCache()
+    calls = []
+
+    @cache.cached('panel', StaticVersion())
+    async def endpoint(limit=10):
+        calls.append(limit)
+        await asyncio.sleep(0.01)
+        return [limit]
+
+    async def run():
+        return await asyncio.gather(*(endpoint(limit=10) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert calls == [10]
+    assert all(result is results[0] for result in results)
+
+
+def test_data_version_is_reread_once_per_interval(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('response_cache.time.monotonic', lambda: now[0])
+    collection = VersionCollection({'id': 'data_version', 'version': 3})
+    version = DataVersion(collection, refresh_interval=5)
+
+    async def run():
+        assert await version.get() == 3
+        collection.doc['version'] = 4
+        assert await version.get() == 3
+        now[0] += 5
+        assert await version.get() == 4
+        version.invalidate()
+        await version.get()
+
+    asyncio.run(run())
+    assert collection.reads == 3
+
+
+def test_ingests_change_the_tag_but_not_the_version():
+    collection = VersionCollection()
+    version = DataVersion(collection, refresh_interval=0)
+
+    async def run():
+        assert (await version.get(), await version.tag()) == (0, '0.0')
+        await bump_ingest_version(collection)
+        return await version.get(), await version.tag()
+
+    assert asyncio.run(run()) == (0, '0.1')
@@ -0,0 +1,84 @@
+"""SessionFilter matching, sketch-query mapping and from/to parsing"""
+from datetime import datetime
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from session_filter import SessionFilter, as_utc, session_filter
+
+
+def make_client():
+    app = FastAPI()
+
+    @app.get('/window')
+    async def window(flt: SessionFilter = Depends(session_filter)):
+        return {'start': flt.start, 'end': flt.end, 'device_type': flt.device_type, 'country': flt.country}
+
+    return TestClient(app)
+
+
+def test_empty_filter_matches_everything():
+    flt = SessionFilter()
+    assert flt.is_empty
+    assert flt.match() == []
+    assert flt.match(cube=True) == []
+    assert flt.sketch_query() == {}
+
+
+def test_match_window_is_start_inclusive_end_exclusive():
+    flt = SessionFilter(start=datetime(2024, 3, 1), end=datetime(2024, 3, 2), device_type='tv', country='US')
+    assert not flt.is_empty
+    assert flt.match() == [{'$match': {
+        'device_type': 'tv',
+        'user_country': 'US',
+        'start_time': {'$gte': datetime(2024, 3, 1), '$lt': datetime(2024, 3, 2)}
+    }}]
+
+
+def test_cube_match_uses_hour_start():
+    flt = SessionFilter(end=datetime(2024, 3, 2, 5))
+    assert flt.match(cube=True) == [{'$match': {'hour_start': {'$lt': datetime(2024, 3, 2, 5)}}}]
+
+
+def test_hour_aligned():
+    assert SessionFilter().hour_aligned()
+    assert SessionFilter(start=datetime(2024, 3, 1, 5), end=datetime(2024, 3, 1, 7)).hour_aligned()
+    assert not SessionFilter(start=datetime(2024, 3, 1, 5, 30)).hour_aligned()
+    assert not SessionFilter(end=datetime(2024, 3, 1, 5, 0, 1)).hour_aligned()
+
+
+def test_sketch_query_maps_day_bounds():
+    flt = SessionFilter(start=datetime(2024, 3, 1), end=datetime(2024, 3, 8), country='DE')
+    assert flt.sketch_query() == {'day': {'$gte': '2024-03-01', '$lt': '2024-03-08'}, 'country': 'DE'}
+    assert SessionFilter(end=datetime(2024, 3, 8)).sketch_query() == {'day': {'$lt': '2024-03-08'}}
+
+
+def test_sketch_query_rejects_partial_days_and_device_filters():
+    assert SessionFilter(start=datetime(2024, 3, 1, 1)).sketch_query() is None
+    assert SessionFilter(end=datetime(2024, 3, 8, 0, 30)).sketch_query() is None
+    assert SessionFilter(start=datetime(2024, 3, 1), device_type='tv').sketch_query() is None
+
+
+def test_cache_key_distinguishes_filters():
+    assert SessionFilter(country='US').cache_key() == SessionFilter(country='US').cache_key()
+    assert SessionFilter(country='US').cache_key() != SessionFilter(device_type='US').cache_key()
+
+
+def test_as_utc():
+    assert as_utc(None) is None
+    assert as_utc(datetime(2024, 3, 1, 10)) == datetime(2024, 3, 1, 10)
+    assert as_utc(datetime.fromisoformat('2024-03-01T10:00:00+02:00')) == datetime(2024, 3, 1, 8)
+
+
+def test_dependency_parses_dates_and_offsets():
+    client = make_client()
+    response = client.get('/window', params={'from': '2024-03-01', 'to': '2024-03-02T02:00:00+02:00', 'country': 'US'})
+    assert response.status_code == 200
+    assert response.json() == {'start': '2024-03-01T00:00:00', 'end': '2024-03-02T00:00:00', 'device_type': None, 'country': 'US'}
+
+
+def test_dependency_rejects_malformed_and_empty_windows():
+    client = make_client()
+    assert client.get('/window', params={'from': '2024-3-1'}).status_code == 422
+    assert client.get('/window', params={'from': '2024-03-02', 'to': '2024-03-02'}).status_code == 400
+    assert client.get('/window', params={'from': '2024-03-02', 'to': '2024-03-01'}).status_code == 400
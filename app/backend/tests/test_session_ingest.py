@@ -0,0 +1,309 @@
+"""Write-behind buffer batching, back-pressure, duplicate and retry handling, and the live counters"""
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from pymongo import _csot
+from pymongo.errors import AutoReconnect, BulkWriteError, NetworkTimeout, OperationFailure
+
+from columnar_engine import ColumnarEngine
+from session_ingest import LiveCounters, WriteBehindBuffer
+
+
+class SessionCollection:
+    """insert_many stand-in with a unique id index; failures are scripted per call"""
+
+    def __init__(self, failures=(), commit_delays=None):
+        self.failures = list(failures)
+        self.commit_delays = commit_delays or {}
+        self.docs = {}
+        self.calls = []
+        self.timeouts = []
+
+    async def insert_many(self, docs, ordered=True):
+        assert ordered is False
+        self.calls.append([doc['id'] for doc in docs])
+        self.timeouts.append(_csot.get_timeout())
+        await asyncio.sleep(max(self.commit_delays.get(doc['id'], 0) for doc in docs))
+        failure = self.failures.pop(0) if self.failures else None
+        if failure == 'down':
+            raise AutoReconnect('connection refused')
+        if failure == 'slow':
+            raise NetworkTimeout('timed out')
+        if failure == 'denied':
+            raise OperationFailure('not authorized', code=13)
+        errors, inserted = [], []
+        for index, doc in enumerate(docs):
+            if doc['id'] in self.docs:
+                errors.append({'index': index, 'code': 11000, 'errmsg': 'duplicate key'})
+            elif failure == 'reject' and index == 0:
+                errors.append({'index': index, 'code': 50, 'errmsg': 'exceeded time limit'})
+            elif failure == 'invalid' and index == 0:
+                errors.append({'index': index, 'code': 121, 'errmsg': 'Document failed validation'})
+            else:
+                self.docs[doc['id']] = dict(doc)
+                inserted.append(doc['id'])
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted)
+
+    def find(self, query, projection=None, batch_size=None):
+        since = query.get('created_at', {}).get('$gte')
+
+        async def cursor():
+            for doc in list(self.docs.values()):
+                if since is None or doc['created_at'] >= since:
+                    yield dict(doc)
+        return cursor()
+
+    async def estimated_document_count(self):
+        return len(self.docs)
+
+
+def sessions(*ids):
+    return [{'id': session_id, 'watch_duration_minutes': 10} for session_id in ids]
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+
+def test_full_batches_are_written_without_waiting_for_the_interval():
+    collection = SessionCollection()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=3, flush_interval=60, writers=1)
+        assert buffer.offer(sessions('a', 'b', 'c', 'd'))
+        await asyncio.sleep(0.05)
+        # The partial batch waits for the interval (or for close)
+        assert collection.calls == [['a', 'b', 'c']]
+        await buffer.close()
+        return buffer.stats()
+
+    stats = run(scenario())
+    assert collection.calls == [['a', 'b', 'c'], ['d']]
+    assert stats['inserted'] == 4
+    assert stats['pending'] == 0
+
+
+def test_partial_batches_are_flushed_after_the_interval():
+    collection = SessionCollection()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=100, flush_interval=0.01, writers=2, timestamp_field='created_at')
+        buffer.offer(sessions('a'))
+        await asyncio.sleep(0.1)
+        assert list(collection.docs) == ['a']
+        await buffer.close()
+
+    run(scenario())
+    assert 'created_at' in collection.docs['a']
+
+
+def test_offers_beyond_max_pending_are_refused_whole():
+    collection = SessionCollection()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=10, flush_interval=60, max_pending=3, writers=1)
+        assert buffer.offer(sessions('a', 'b'))
+        assert not buffer.offer(sessions('c', 'd'))
+        assert buffer.offer(sessions('c'))
+        stats = buffer.stats()
+        await buffer.close()
+        assert not buffer.offer(sessions('e'))
+        return stats, buffer.stats()
+
+    before_close, after_close = run(scenario())
+    assert before_close['pending'] == 3
+    assert before_close['rejected'] == 2
+    assert after_close['rejected'] == 3
+    assert sorted(collection.docs) == ['a', 'b', 'c']
+
+
+def test_duplicates_are_counted_and_not_retried():
+    collection = SessionCollection()
+    collection.docs['b'] = {'id': 'b', 'original': True}
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=10, flush_interval=0.01, writers=1, retry_delay=0)
+        buffer.offer(sessions('a', 'b', 'a'))
+        await buffer.close()
+        return buffer.stats()
+
+    stats = run(scenario())
+    assert len(collection.calls) == 1
+    assert collection.docs['b'] == {'id': 'b', 'original': True}
+    assert stats['inserted'] == 1
+    assert stats['duplicates'] == 2
+    assert stats['retries'] == 0
+    assert stats['pending'] == 0
+
+
+def test_failed_documents_are_retried_after_the_delay():
+    collection = SessionCollection(failures=['down', 'reject'])
+    inserted = []
+
+    async def on_insert(count):
+        inserted.append(count)
+
+    async def scenario():
+        buffer = WriteBehindBuffer(
+            collection, max_batch=10, flush_interval=0.01, writers=1, retry_delay=0.01, on_insert=on_insert
+        )
+        buffer.offer(sessions('a', 'b', 'c'))
+        # Retried documents stay pending until they are written
+        await asyncio.sleep(0.005)
+        assert buffer.stats()['pending'] == 3
+        while len(collection.docs) < 3:
+            await asyncio.sleep(0.01)
+        await buffer.close()
+        return buffer.stats()
+
+    stats = run(scenario())
+    # All three after the outage, then only the one the server rejected
+    assert collection.calls == [['a', 'b', 'c'], ['a', 'b', 'c'], ['a']]
+    assert stats['retries'] == 4
+    assert stats['inserted'] == 3
+    assert stats['pending'] == 0
+    assert inserted == [2, 1]
+
+
+def test_permanent_write_errors_are_dropped_not_retried():
+    collection = SessionCollection(failures=['invalid', 'denied', 'slow'])
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=10, flush_interval=0.01, writers=1, retry_delay=0.01)
+        # The first document fails validation; the rest of its batch is written
+        buffer.offer(sessions('poison', 'a', 'b'))
+        while len(collection.calls) < 1:
+            await asyncio.sleep(0.01)
+        # Not authorized: the whole batch fails for good
+        buffer.offer(sessions('c', 'd'))
+        while len(collection.calls) < 2:
+            await asyncio.sleep(0.01)
+        # A network timeout is retried
+        buffer.offer(sessions('e'))
+        while 'e' not in collection.docs:
+            await asyncio.sleep(0.01)
+        await buffer.close()
+        return buffer.stats()
+
+    stats = run(scenario())
+    assert collection.calls == [['poison', 'a', 'b'], ['c', 'd'], ['e'], ['e']]
+    assert sorted(collection.docs) == ['a', 'b', 'e']
+    assert stats['dropped'] == 3
+    assert stats['retries'] == 1
+    # Nothing that cannot be written stays pending and fills the buffer
+    assert stats['pending'] == 0
+
+
+def test_failures_at_shutdown_are_dropped():
+    collection = SessionCollection(failures=['down'])
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=10, flush_interval=60, writers=1)
+        buffer.offer(sessions('a', 'b'))
+        await buffer.close()
+        return buffer.stats()
+
+    stats = run(scenario())
+    assert collection.docs == {}
+    assert stats['dropped'] == 2
+    assert stats['pending'] == 0
+
+
+def test_insert_callback_errors_do_not_stop_the_writer():
+    collection = SessionCollection()
+
+    async def on_insert(count):
+        raise RuntimeError('cache unavailable')
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=1, flush_interval=60, writers=1, on_insert=on_insert)
+        buffer.offer(sessions('a', 'b'))
+        await buffer.close()
+
+    run(scenario())
+    assert sorted(collection.docs) == ['a', 'b']
+
+
+def viewing_sessions(*ids):
+    return [
+        {
+            'id': session_id, 'user_id': 'u1', 'movie_id': 'm1', 'start_time': datetime(2024, 3, 1, 20, 0),
+            'watch_duration_minutes': 10, 'completion_rate': 0.5, 'device_type': 'tv', 'user_country': 'US'
+        }
+        for session_id in ids
+    ]
+
+
+def test_inserts_run_under_the_write_timeout():
+    collection = SessionCollection()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=10, flush_interval=0.01, writers=1, write_timeout=2.5)
+        buffer.offer(sessions('a'))
+        await buffer.close()
+
+    run(scenario())
+    assert 0 < collection.timeouts[0] <= 2.5
+
+
+def interleaved_refreshes(settle_seconds):
+    """Two writers whose batches commit in the opposite order of their created_at stamps"""
+    collection = SessionCollection(commit_delays={'early': 0.2})
+    engine = ColumnarEngine(collection, settle_seconds=settle_seconds)
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=1, flush_interval=0.01, writers=2, timestamp_field='created_at')
+        buffer.offer(viewing_sessions('early'))
+        await asyncio.sleep(0.05)
+        buffer.offer(viewing_sessions('late'))
+        while 'late' not in collection.docs:
+            await asyncio.sleep(0.01)
+        # 'late' is committed, 'early' (stamped before it) is still in flight
+        await engine.refresh()
+        loaded_before = engine.size
+        await buffer.close()
+        await engine.refresh()
+        return loaded_before
+
+    loaded_before = run(scenario())
+    assert collection.docs['early']['created_at'] < collection.docs['late']['created_at']
+    return loaded_before, engine.size
+
+
+def test_sessions_committing_out_of_order_are_not_skipped():
+    assert interleaved_refreshes(settle_seconds=5) == (1, 2)
+
+
+def test_a_reader_without_the_settle_window_would_skip_them():
+    assert interleaved_refreshes(settle_seconds=0) == (1, 1)
+
+
+def test_live_counters_summarize_recent_minutes(monkeypatch):
+    now = [600 * 60.0]
+    monkeypatch.setattr('session_ingest.time.time', lambda: now[0])
+    counters = LiveCounters(retention_minutes=5)
+
+    def session(device, country, minutes, completion):
+        return {'device_type': device, 'user_country': country, 'watch_duration_minutes': minutes, 'completion_rate': completion}
+
+    counters.add([session('tv', 'US', 30, 0.5), session('mobile', 'US', 10, 1.0)])
+    now[0] += 120
+    counters.add([session('tv', 'DE', 20, 0.0)])
+
+    summary = counters.summary(5)
+    assert summary['sessions'] == 3
+    assert summary['sessions_per_minute'] == 0.6
+    assert summary['watch_minutes'] == 60
+    assert summary['avg_completion_rate'] == 0.5
+    assert summary['devices'] == {'tv': 2, 'mobile': 1}
+    assert list(summary['countries']) == ['US', 'DE']
+    assert counters.summary(1)['sessions'] == 1
+
+    # Minutes past the retention are dropped when a new minute starts
+    now[0] += 10 * 60
+    counters.add([])
+    assert counters.summary(60)['sessions'] == 0
+    assert counters.summary(1)['avg_completion_rate'] == 0.0
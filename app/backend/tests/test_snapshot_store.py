@@ -0,0 +1,151 @@
+"""Snapshot files: layout round trip, atomic publishing and the reader"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pytest
+
+from columnar_engine import ColumnarEngine
+from snapshot_store import ALIGNMENT, POINTER, Snapshot, SnapshotReader, snapshot_name, write_snapshot
+
+
+def test_arrays_strings_and_meta_round_trip(tmp_path):
+    arrays = {
+        'ints': np.arange(10, dtype=np.int64),
+        'small': np.array([1, -2, 3], dtype=np.int8),
+        'matrix': np.arange(12, dtype=np.float64).reshape(3, 4),
+        'empty': np.zeros(0, dtype=np.int32),
+    }
+    strings = {'names': ['alpha', '', 'größe', '映画']}
+    path = write_snapshot(tmp_path, 3, arrays, strings, {'rows': 10, 'watermark': None})
+
+    snapshot = Snapshot(path)
+    assert snapshot.version == 3
+    assert snapshot.meta == {'rows': 10, 'watermark': None}
+    for name, array in arrays.items():
+        assert snapshot.arrays[name].dtype == array.dtype
+        assert np.array_equal(snapshot.arrays[name], array)
+        assert snapshot.arrays[name].ctypes.data % ALIGNMENT == 0 or not array.size
+    names = snapshot.strings['names']
+    assert len(names) == 4
+    assert list(names) == strings['names']
+    assert names[2] == 'größe'
+    assert names[-1] == '映画'
+
+
+def test_mapped_arrays_are_read_only(tmp_path):
+    snapshot = Snapshot(write_snapshot(tmp_path, 1, {'values': np.ones(4)}))
+    with pytest.raises(ValueError):
+        snapshot.arrays['values'][0] = 2
+
+
+def test_publishing_moves_the_pointer_and_keeps_one_previous_file(tmp_path):
+    for version in range(1, 5):
+        write_snapshot(tmp_path, version, {'values': np.full(3, version)})
+
+    assert (tmp_path / POINTER).read_text() == snapshot_name(4)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [POINTER, snapshot_name(3), snapshot_name(4)]
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / 'snapshot-00000001.snap'
+    path.write_bytes(b'not a snapshot file at all')
+    with pytest.raises(ValueError):
+        Snapshot(path)
+
+
+def test_reader_follows_the_pointer_once_per_interval(tmp_path, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('snapshot_store.time.monotonic', lambda: now[0])
+    reader = SnapshotReader(tmp_path, check_interval=5)
+    assert reader.latest() is None
+
+    now[0] += 5
+    write_snapshot(tmp_path, 1, {'values': np.zeros(2)})
+    first = reader.latest()
+    assert first.version == 1
+
+    write_snapshot(tmp_path, 2, {'values': np.zeros(2)})
+    assert reader.latest() is first
+    now[0] += 5
+    assert reader.latest().version == 2
+
+
+def test_reader_keeps_the_last_good_snapshot(tmp_path, monkeypatch):
+    reader = SnapshotReader(tmp_path, check_interval=0)
+    write_snapshot(tmp_path, 1, {'values': np.zeros(2)})
+    assert reader.latest().version == 1
+
+    (tmp_path / 'broken.snap').write_bytes(b'garbage')
+    (tmp_path / POINTER).write_text('broken.snap')
+    assert reader.latest().version == 1
+
+
+class Filter(NamedTuple):
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    device_type: Optional[str] = None
+    country: Optional[str] = None
+
+    @property
+    def is_empty(self):
+        return not (self.start or self.end or self.device_type or self.country)
+
+
+class SessionCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None, batch_size=None):
+        since = query.get('created_at', {}).get('$gte')
+
+        async def cursor():
+            for doc in self.docs:
+                if since is None or doc['created_at'] >= since:
+                    yield dict(doc)
+        return cursor()
+
+    async def estimated_document_count(self):
+        return len(self.docs)
+
+
+def sessions(first, count, created_at):
+    base = datetime(2024, 3, 1)
+    return [
+        {
+            'id': f's{n}', 'user_id': f'u{n % 7}', 'movie_id': f'm{n % 5}',
+            'start_time': base + timedelta(hours=n), 'watch_duration_minutes': n % 90,
+            'completion_rate': (n % 10) / 10, 'device_type': ('tv', 'mobile')[n % 2],
+            'user_country': ('US', 'DE', 'IN')[n % 3], 'created_at': created_at
+        }
+        for n in range(first, first + count)
+    ]
+
+
+def test_engine_resumes_from_a_published_snapshot(tmp_path):
+    created_at = datetime(2024, 3, 10)
+    collection = SessionCollection(sessions(0, 200, created_at))
+    writer = ColumnarEngine(collection)
+    asyncio.run(writer.refresh())
+    arrays, strings, meta = writer.to_snapshot()
+    write_snapshot(tmp_path, 1, arrays, strings, meta)
+
+    # Sessions created after the snapshot are read from the collection on top of it
+    collection.docs += sessions(200, 50, created_at + timedelta(hours=1))
+    reader = ColumnarEngine(collection, snapshots=SnapshotReader(tmp_path, check_interval=0))
+    asyncio.run(reader.refresh())
+    fresh = ColumnarEngine(collection)
+    asyncio.run(fresh.refresh())
+
+    assert reader.snapshot_version == 1
+    assert reader.size == fresh.size == 250
+    for flt in (Filter(), Filter(device_type='tv'), Filter(country='IN', device_type='mobile')):
+        assert reader.devices(flt) == fresh.devices(flt)
+        assert reader.distinct_users('country', flt) == fresh.distinct_users('country', flt)
+        # Completion sums are added in another order, so averages may differ in the last bits
+        expected = fresh.top_movies(flt)
+        assert [(row['_id'], row['total_views']) for row in reader.top_movies(flt)] == \
+            [(row['_id'], row['total_views']) for row in expected]
+        assert [row['avg_completion_rate'] for row in reader.top_movies(flt)] == \
+            pytest.approx([row['avg_completion_rate'] for row in expected])
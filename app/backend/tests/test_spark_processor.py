@@ -0,0 +1,82 @@
+"""Spark batch jobs on a local session (skipped when pyspark is not installed)"""
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('pyspark')
+
+from spark_processor import SparkStreamingProcessor  # noqa: E402
+
+START = datetime(2024, 3, 1, 20, 0)
+
+
+def session(n, movie_id, minutes, completion, created_at=START):
+    start_time = START + timedelta(minutes=n)
+    return {
+        'id': f's{n}', 'user_id': f'u{n % 3}', 'movie_id': movie_id,
+        'start_time': start_time, 'end_time': start_time + timedelta(minutes=minutes),
+        'hour_of_day': start_time.hour, 'watch_duration_minutes': minutes, 'completion_rate': completion,
+        'device_type': 'tv' if n % 2 else 'mobile', 'quality': 'HD', 'buffering_count': n % 2,
+        'user_country': 'US', 'subscription_type': 'premium', 'created_at': created_at,
+        'day': start_time.date().isoformat()
+    }
+
+
+def movie(movie_id, title, genre):
+    return {
+        'id': movie_id, 'title': title, 'genre': genre, 'sub_genres': [], 'duration_minutes': 100,
+        'release_date': '2020-01-01', 'rating': 'PG', 'director': 'D', 'cast': [], 'production_budget': 1,
+        'description': '', 'language': 'en', 'country': 'US', 'avg_rating': 4.0, 'total_views': 0,
+        'created_at': '2024-01-01T00:00:00'
+    }
+
+
+SESSIONS = [
+    session(0, 'm1', 30, 0.5),
+    session(1, 'm1', 60, 1.0),
+    session(2, 'm2', 45, 0.25),
+    # Created after the high-water mark: counted by the batch jobs, not by the transform
+    session(3, 'm2', 10, 0.1, created_at=START + timedelta(days=1)),
+]
+MOVIES = [movie('m1', 'First', 'Drama'), movie('m2', 'Second', 'Comedy')]
+
+
+@pytest.fixture(scope='module')
+def processor():
+    processor = SparkStreamingProcessor()
+    yield processor
+    processor.close()
+
+
+def test_batch_jobs_materialize_each_output_once(processor):
+    patterns = processor.batch_process_viewing_patterns(SESSIONS)
+    devices = {row['device_type']: row for row in patterns['device_analytics']}
+    assert devices['tv']['total_sessions'] == 2
+    assert devices['tv']['total_buffering'] == 2
+    assert patterns['time_analysis'][0]['session_count'] == 4
+
+    top = processor.batch_process_content_performance(MOVIES, sessions_data=SESSIONS)
+    assert sorted((row['title'], row['view_count']) for row in top) == [('First', 2), ('Second', 2)]
+
+    report = processor.plan_report()
+    assert report['outputs']['Top Performing Content']['rows'] == 2
+    # The sessions source is built once and reused by the second job
+    assert report['sources']['sessions']['reuses'] == 1
+
+
+def test_transform_aggregates_respect_the_high_water_mark(processor):
+    results = processor.compute_transform_aggregates(START, SESSIONS, MOVIES)
+
+    movies = {doc['id']: doc for doc in results['movie_statistics']}
+    assert movies['m1']['total_views'] == 2
+    assert movies['m1']['avg_completion_rate'] == 0.75
+    assert movies['m1']['total_watch_time_minutes'] == 90
+    assert movies['m2']['total_views'] == 1
+
+    genres = {doc['genre']: doc for doc in results['genre_analytics']}
+    assert genres['Drama']['avg_watch_time'] == 45.0
+    assert genres['Comedy']['total_views'] == 1
+
+    assert [(doc['date'], doc['total_views']) for doc in results['daily_analytics']] == [('2024-03-01', 3)]
+    assert sum(doc['session_count'] for doc in results['session_rollup']) == 3
+    assert all(isinstance(doc['hour_start'], datetime) for doc in results['session_rollup'])
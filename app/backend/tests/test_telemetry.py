@@ -0,0 +1,182 @@
+"""Route-template request metrics, MongoDB command labels, ETL gauges and the /metrics body"""
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY
+
+from telemetry import (
+    MongoCommandMetrics, RequestMetricsMiddleware, _current_route,
+    record_etl_run, render_metrics, route_template
+)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.get('/items/{item_id}')
+    async def item(item_id: str):
+        return {'id': item_id}
+
+    @app.get('/health')
+    async def health():
+        return {'ok': True}
+
+    app.add_middleware(RequestMetricsMiddleware, routes_app=app)
+    return app
+
+
+def http_scope(path, method='GET'):
+    return {'type': 'http', 'method': method, 'path': path, 'root_path': '', 'query_string': b'', 'headers': []}
+
+
+def command_event(name, command, request_id=1, duration_micros=2500):
+    return SimpleNamespace(
+        command_name=name, command=command, connection_id=('localhost', 27017),
+        request_id=request_id, duration_micros=duration_micros
+    )
+
+
+def test_requests_are_labelled_by_route_template():
+    labels = {'method': 'GET', 'route': '/items/{item_id}', 'status': '200'}
+    before = sample('http_request_duration_seconds_count', **labels)
+    client = TestClient(make_app())
+
+    assert client.get('/items/abc').status_code == 200
+    assert client.get('/items/xyz').status_code == 200
+
+    assert sample('http_request_duration_seconds_count', **labels) == before + 2
+    assert REGISTRY.get_sample_value(
+        'http_request_duration_seconds_count', {'method': 'GET', 'route': '/items/abc', 'status': '200'}
+    ) is None
+    assert sample('http_requests_in_progress', method='GET', route='/items/{item_id}') == 0
+
+
+def test_unknown_paths_are_unmatched():
+    labels = {'method': 'GET', 'route': 'unmatched', 'status': '404'}
+    before = sample('http_request_duration_seconds_count', **labels)
+    client = TestClient(make_app())
+
+    assert client.get('/nope/123').status_code == 404
+
+    assert sample('http_request_duration_seconds_count', **labels) == before + 1
+
+
+def test_route_template_matches_unrouted_scopes():
+    app = make_app()
+    assert route_template(app, http_scope('/items/42')) == '/items/{item_id}'
+    assert route_template(app, http_scope('/health')) == '/health'
+    assert route_template(app, http_scope('/missing')) == 'unmatched'
+
+
+def test_only_exact_routes_are_remembered():
+    app = make_app()
+    middleware = RequestMetricsMiddleware(app, routes_app=app)
+    assert middleware._route(http_scope('/items/1')) == '/items/{item_id}'
+    assert middleware._route(http_scope('/health')) == '/health'
+    assert middleware._route(http_scope('/missing')) == 'unmatched'
+    assert middleware._templates == {('GET', '/health'): '/health'}
+
+
+def test_command_labelled_by_comment():
+    labels = {'command': 'aggregate', 'collection': 'viewing_sessions', 'pipeline': 'top_movies', 'status': 'ok'}
+    before = sample('mongodb_command_duration_seconds_count', **labels)
+    before_sum = sample('mongodb_command_duration_seconds_sum', **labels)
+    listener = MongoCommandMetrics()
+
+    token = _current_route.set('/api/analytics/top-movies')
+    try:
+        event = command_event('aggregate', {'aggregate': 'viewing_sessions', 'pipeline': [], 'comment': 'top_movies'})
+        listener.started(event)
+    finally:
+        _current_route.reset(token)
+    listener.succeeded(event)
+
+    assert sample('mongodb_command_duration_seconds_count', **labels) == before + 1
+    assert sample('mongodb_command_duration_seconds_sum', **labels) == pytest.approx(before_sum + 0.0025)
+    assert listener._pending == {}
+
+
+def test_command_without_comment_falls_back_to_route():
+    labels = {'command': 'find', 'collection': 'movies', 'pipeline': '/api/movies/{movie_id}', 'status': 'ok'}
+    before = sample('mongodb_command_duration_seconds_count', **labels)
+    listener = MongoCommandMetrics()
+
+    token = _current_route.set('/api/movies/{movie_id}')
+    try:
+        event = command_event('find', {'find': 'movies', 'filter': {}})
+        listener.started(event)
+    finally:
+        _current_route.reset(token)
+    listener.succeeded(event)
+
+    assert sample('mongodb_command_duration_seconds_count', **labels) == before + 1
+
+
+def test_get_more_uses_collection_field_and_failures_are_errors():
+    labels = {'command': 'getMore', 'collection': 'viewing_sessions', 'pipeline': '', 'status': 'error'}
+    before = sample('mongodb_command_duration_seconds_count', **labels)
+    listener = MongoCommandMetrics()
+
+    event = command_event('getMore', {'getMore': 12345, 'collection': 'viewing_sessions'}, request_id=7)
+    listener.started(event)
+    listener.failed(event)
+
+    assert sample('mongodb_command_duration_seconds_count', **labels) == before + 1
+
+
+def test_ignored_and_unknown_commands_are_not_recorded():
+    listener = MongoCommandMetrics()
+    hello = command_event('hello', {'hello': 1})
+    listener.started(hello)
+    listener.succeeded(hello)
+    assert listener._pending == {}
+    assert REGISTRY.get_sample_value(
+        'mongodb_command_duration_seconds_count',
+        {'command': 'hello', 'collection': '', 'pipeline': '', 'status': 'ok'}
+    ) is None
+
+    # A reply whose start was never seen is dropped rather than mislabelled
+    listener.succeeded(command_event('find', {'find': 'movies'}, request_id=99))
+
+
+def test_record_etl_run_sets_gauges_and_clears_old_stages():
+    record_etl_run({'stages': [{'stage': 'spark_only', 'seconds': 9.0, 'rows': 1}], 'status': 'success'})
+    record_etl_run({
+        'stages': [{'stage': 'extract', 'seconds': 1.5, 'rows': 200}, {'stage': 'load', 'seconds': 0.25}],
+        'finished_at': '2024-03-01T00:00:00',
+        'status': 'failed'
+    })
+
+    assert sample('etl_stage_duration_seconds', stage='extract') == 1.5
+    assert sample('etl_stage_rows', stage='extract') == 200
+    assert sample('etl_stage_duration_seconds', stage='load') == 0.25
+    assert REGISTRY.get_sample_value('etl_stage_rows', {'stage': 'load'}) is None
+    assert REGISTRY.get_sample_value('etl_stage_duration_seconds', {'stage': 'spark_only'}) is None
+    assert sample('etl_last_run_timestamp_seconds') == 1709251200.0
+    assert sample('etl_last_run_success') == 0
+
+    # No run recorded yet leaves the gauges alone
+    record_etl_run(None)
+    assert sample('etl_stage_duration_seconds', stage='extract') == 1.5
+
+
+def test_render_metrics_single_process(monkeypatch):
+    monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+    body, content_type = render_metrics()
+    assert content_type == CONTENT_TYPE_LATEST
+    assert b'http_request_duration_seconds' in body
+    assert b'mongodb_command_duration_seconds' in body
+
+
+def test_render_metrics_multiprocess_reads_the_shared_directory(monkeypatch, tmp_path):
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    body, content_type = render_metrics()
+    assert content_type == CONTENT_TYPE_LATEST
+    # Only samples written to the directory are exposed, not this process's registry
+    assert b'http_request_duration_seconds' not in body